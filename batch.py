@@ -0,0 +1,142 @@
+import os
+import csv
+import sys
+import argparse
+
+from src.cache import Cache
+from src.fitting import ENGINES, fitSurface, parseSchedule
+from src.preprocess import DUPLICATE_VOXEL, NEIGHBOURS, boxPlanes, cachedCleanIpdata, formatCounts
+from src.quality import TOLERANCE, Convergence, stoppedEarly
+from src.service import ADDRESS, RemoteFit, available
+from src.worker import Worker, runPool
+from src import trace
+
+MANIFEST_COLUMNS = ['ipdata', 'ipnode', 'ipelem', 'ipmap', 'iterations', 'output']
+SUMMARY_COLUMNS = ['output', 'status', 'seconds', 'iterations', 'seconds saved', 'message']
+
+
+def readManifest(filename):
+    """Read a CSV manifest with a header row naming the MANIFEST_COLUMNS, paths are relative to the manifest.
+    The iterations are a number or a schedule of fraction:iterations stages, see parseSchedule.
+    """
+    path = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            job = {}
+            for column in MANIFEST_COLUMNS:
+                if not row.get(column):
+                    raise ValueError('%s: missing %s on line %d' % (filename, column, len(jobs) + 2))
+                job[column] = row[column].strip()
+            for column in ['ipdata', 'ipnode', 'ipelem', 'ipmap', 'output']:
+                job[column] = os.path.join(path, job[column])
+            try:
+                job['iterations'] = parseSchedule(job['iterations'])
+            except ValueError as e:
+                raise ValueError('%s: %s on line %d' % (filename, e, len(jobs) + 2))
+            jobs.append(job)
+    return jobs
+
+
+def cleanAndFit(cleaning, ipdata, *args, **kwargs):
+    """Fit like fitSurface after cleaning the data cloud with the cleanIpdata options, in the cache."""
+    cleaned, counts = cachedCleanIpdata(Cache(), ipdata, **cleaning)
+    print('%s: %s' % (ipdata, formatCounts(counts)))
+    return fitSurface(cleaned, *args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit template meshes to data clouds without the GUI.')
+    parser.add_argument('manifest', help='CSV file with columns %s' % ', '.join(MANIFEST_COLUMNS))
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='seconds after which a job is killed')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='aether', help='fitting engine (default: aether)')
+    parser.add_argument('--schedule', type=parseSchedule, default=None,
+                        help="coarse-to-fine stages used for all jobs instead of their iterations, such as '0.1:4, 0.3:2, 1:2'")
+    parser.add_argument('--clean', action='store_true', help='remove duplicate and outlying data points before fitting')
+    parser.add_argument('--voxel', type=float, default=DUPLICATE_VOXEL,
+                        help='with --clean, voxel size in mm within which points are duplicates (default: exact duplicates)')
+    parser.add_argument('--neighbours', type=int, default=NEIGHBOURS,
+                        help='with --clean, neighbours that decide whether a point is an outlier, 0 keeps outliers')
+    parser.add_argument('--crop', type=float, nargs=6, metavar=('XMIN', 'YMIN', 'ZMIN', 'XMAX', 'YMAX', 'ZMAX'),
+                        help='with --clean, drop data points outside this box')
+    parser.add_argument('--converge', nargs='?', type=float, const=TOLERANCE, default=None, metavar='TOLERANCE',
+                        help='stop fits once an iteration improves the RMS error and moves the nodes by less than this '
+                             'relative tolerance, the iterations are then a maximum (default: %g)' % TOLERANCE)
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='seconds after which every fit stops with the mesh fitted so far, unlike --timeout')
+    parser.add_argument('--service', nargs='?', const=ADDRESS, default=None,
+                        help='queue the jobs in the fitting service on this socket instead of running them here (default: %s)' % ADDRESS)
+    parser.add_argument('-p', '--priority', type=int, default=0, help='with --service, priority of the jobs (default: 0)')
+    parser.add_argument('-s', '--summary', default='summary.csv', help='CSV file to write the per-job summary to')
+    parser.add_argument('--trace', default=None, help='write the time spent in every stage of the jobs to this Chrome trace file')
+    args = parser.parse_args()
+    if args.trace:
+        trace.enable()
+    if args.service and not available(args.service):
+        print('No fitting service is listening on %s, start one with: python fitd.py serve' % args.service)
+        return 1
+
+    jobs = readManifest(args.manifest)
+    cleaning = {
+        'planes': boxPlanes(args.crop[:3], args.crop[3:]) if args.crop else None,
+        'voxelSize': args.voxel,
+        'neighbours': args.neighbours,
+    }
+    convergence = None
+    if args.converge is not None or args.time_budget:
+        convergence = Convergence(args.converge or 0.0, args.time_budget)
+    # the last progress of a fit tells how many iterations it ran, it is only measured when it can stop early
+    progress = convergence is not None
+
+    workers = []
+    for job in jobs:
+        output = os.path.splitext(job['output'])[0]
+        iterations = args.schedule or job['iterations']
+        fitArgs = (job['ipdata'], job['ipnode'], job['ipelem'], job['ipmap'], iterations, output, args.engine, convergence)
+        if args.service:
+            # the data clouds are cleaned here, the service only fits
+            if args.clean:
+                cleaned, counts = cachedCleanIpdata(Cache(), job['ipdata'], **cleaning)
+                print('%s: %s' % (job['ipdata'], formatCounts(counts)))
+                fitArgs = (cleaned,) + fitArgs[1:]
+            workers.append(RemoteFit(fitArgs, args.priority, args.service, args.timeout))
+        elif args.clean:
+            workers.append(Worker(cleanAndFit, (cleaning,) + fitArgs, args.timeout, progress))
+        else:
+            workers.append(Worker(fitSurface, fitArgs, args.timeout, progress))
+    outputs = dict(zip(workers, [job['output'] for job in jobs]))
+
+    failed = 0
+    saved = 0.0
+    with open(args.summary, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        # the service queues all jobs itself and runs as many at once as it has worker processes
+        for worker in runPool(workers, len(workers) if args.service else args.processes):
+            lines = str(worker.result).strip().splitlines() if worker.status != 'done' else []
+            message = lines[-1] if lines else ''
+            iterations = '%d/%d' % tuple(worker.progress[:2]) if worker.progress else ''
+            stopped = stoppedEarly(worker.progress) if worker.status == 'done' else None
+            if stopped:
+                message = 'stopped early, %s' % stopped[0]
+                saved += stopped[3]
+            writer.writerow([outputs[worker], worker.status, '%.1f' % worker.duration, iterations,
+                             '%.1f' % stopped[3] if stopped else '', message])
+            f.flush()
+            print(' '.join(part for part in ['%s: %s in %.1fs' % (outputs[worker], worker.status, worker.duration),
+                                             iterations, message] if part))
+            if worker.status != 'done':
+                failed += 1
+
+    print('Finished %d jobs, %d failed, summary written to %s' % (len(jobs), failed, args.summary))
+    if convergence is not None:
+        print('Stopping early saved about %.1fs of fitting' % saved)
+    if args.trace:
+        trace.export(args.trace)
+        print('Trace written to %s' % args.trace)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
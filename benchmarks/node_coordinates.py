@@ -0,0 +1,48 @@
+"""
+Compare per-node and bulk access to the coordinates of a data cloud region.
+
+    python benchmarks/node_coordinates.py [number of nodes]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.scene import Scene
+from src.model import FileModel
+
+
+def timeit(name, func):
+    t = time.time()
+    func()
+    duration = time.time() - t
+    print('%-40s %8.3fs' % (name, duration))
+    return duration
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    ids = np.arange(1, n + 1)
+    coords = np.random.RandomState(0).rand(n, 3) * 100.0
+
+    model = FileModel(Scene(), 'benchmark')
+    print('%d nodes' % n)
+    timeit('loadPoints', lambda: model.loadPoints(ids, coords))
+
+    perNode = timeit('getNodeCoordinates per node', lambda: [model.getNodeCoordinates(nid) for nid in ids.tolist()])
+    bulk = timeit('getAllNodeCoordinates', model.getAllNodeCoordinates)
+    print('%-40s %8.1fx' % ('speedup', perNode / bulk))
+
+    perNode = timeit('setNodeCoordinates per node', lambda: [model.setNodeCoordinates(nid, xyz) for nid, xyz in zip(ids.tolist(), coords.tolist())])
+    bulk = timeit('setNodeCoordinates bulk', lambda: model.setNodeCoordinates(ids, coords))
+    print('%-40s %8.1fx' % ('speedup', perNode / bulk))
+
+    _, result = model.getAllNodeCoordinates()
+    assert np.allclose(result, coords)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+Time the stages of loading, fitting and saving on synthetic lobe data clouds and templates of growing size,
+and store the results as JSON so that versions can be compared.
+
+    python benchmarks/pipeline.py [--points 10000 ... 10000000] [--elements 32 128 512 2048] [--output results.json]
+    python benchmarks/pipeline.py --compare baseline.json results.json
+
+Templates are converted to EX format natively, as the GUI does, and through aether for comparison.
+Every stage reports its duration, throughput and the peak resident memory of the process running it.
+When aether is not installed, or with --stub, the stand-in in benchmarks/stub is used and fitting with
+'aether' runs the Python engine. Stages that need Zinc are left out when it is not installed.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+
+# checked on import, so that spawned fitting workers use the same aether as the benchmark
+if os.environ.get('LUNG_FITTING_AETHER_STUB'):
+    AETHER = 'stub'
+else:
+    try:
+        import aether
+        AETHER = 'fortran'
+    except ImportError:
+        AETHER = 'stub'
+if AETHER == 'stub':
+    sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stub'))
+
+try:
+    from opencmiss.zinc.context import Context
+    ZINC = True
+except ImportError:
+    ZINC = False
+
+from src.ipdata import readIpdata
+from src.hermite import HermiteMesh
+from src.fitting import ENGINES, fitSurface, readBuffers, writeBuffers
+from src.worker import Worker
+
+from synthetic import writeLobeCloud, writeTemplate, templateGrid
+
+POINTS = [10000, 100000, 1000000, 10000000]
+ELEMENTS = [32, 128, 512, 2048]
+FIT_POINTS = 1000000  # larger clouds are only loaded, fitting them takes too long for a benchmark run
+REGRESSION = 1.2  # ratio of durations above which --compare reports a regression
+
+
+def resetPeakMemory():
+    # Linux resets the peak resident set size of the process when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peakMemory():
+    """Return the peak resident memory of this process in bytes, since the last resetPeakMemory on Linux."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(func, *args):
+    """Return the result, duration and peak memory of func(*args)."""
+    resetPeakMemory()
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start, peakMemory()
+
+
+def _fit(*args):
+    # runs in the fitting worker, which measures itself so that the start of the process is not included
+    _, duration, memory = measure(fitSurface, *args)
+    return duration, memory
+
+
+class Results(object):
+    def __init__(self):
+        self.records = []
+
+    def add(self, stage, points, elements, count, duration, memory):
+        """Record a stage that processed count points or elements, and print it."""
+        self.records.append({
+            'stage': stage,
+            'points': points,
+            'elements': elements,
+            'seconds': duration,
+            'throughput': count / duration if duration > 0.0 else None,
+            'peakMemory': memory,
+        })
+        print('%-24s %9d points %6d elements %9.3fs %12.0f/s %8.1f MB' %
+              (stage, points, elements, duration, count / max(duration, 1e-9), memory / 1e6))
+
+    def run(self, stage, points, elements, count, func, *args):
+        result, duration, memory = measure(func, *args)
+        self.add(stage, points, elements, count, duration, memory)
+        return result
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=BENCHMARK_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def benchmarkClouds(results, scratch, points):
+    clouds = {}
+    for count in points:
+        ipdata = os.path.join(scratch, 'cloud%d.ipdata' % count)
+        results.run('writeLobeCloud', count, 0, count, writeLobeCloud, ipdata, count)
+        ids, coords = results.run('readIpdata', count, 0, count, readIpdata, ipdata)
+        clouds[count] = ipdata
+
+        if ZINC:
+            from src.scene import Scene
+            from src.model import FileModel
+
+            model = FileModel(Scene(), 'datacloud')
+            results.run('FileModel.loadPoints', count, 0, count, model.loadPoints, ids, coords)
+            results.run('visualizePoints', count, 0, count, model.visualizePoints, 'nodes', 'white', 0)
+    return clouds
+
+
+def benchmarkTemplates(results, scratch, elements):
+    from aether.geometry import define_elem_geometry_2d, define_node_geometry_2d
+    from aether.exports import export_node_geometry_2d, export_elem_geometry_2d
+
+    def convert(template):
+        # the same conversion to EX format as run.py does on load
+        return HermiteMesh.read(template + '.ipnode', template + '.ipelem').buffers()
+
+    def convertAether(template, mesh):
+        define_node_geometry_2d(template + '.ipnode')
+        define_elem_geometry_2d(template, 'unit')
+        export_node_geometry_2d(mesh, 'fitted', 0)
+        export_elem_geometry_2d(mesh, 'fitted', 0, 0)
+        return readBuffers(mesh + '.exnode', mesh + '.exelem')
+
+    templates = {}
+    for count in elements:
+        columns, rows = templateGrid(count)
+        count = columns * rows
+        template = os.path.join(scratch, 'template%d' % count)
+        writeTemplate(template, columns, rows)
+        mesh = os.path.join(scratch, 'mesh%d' % count)
+        results.run('convert template aether', 0, count, count, convertAether, template, mesh)
+        buffers = results.run('convert template', 0, count, count, convert, template)
+        writeBuffers([mesh + '.exnode', mesh + '.exelem'], buffers)
+        templates[count] = template
+
+        if ZINC:
+            from src.scene import Scene
+            from src.model import FileModel
+
+            model = FileModel(Scene(), 'surface')
+            results.run('FileModel.loadBuffers', 0, count, count, model.loadBuffers, *buffers)
+            results.run('FileModel.load', 0, count, count, model.load, mesh + '.exnode', mesh + '.exelem')
+            results.run('visualizeLines', 0, count, count, model.visualizeLines, 'lines', 'gold')
+            results.run('visualizeSurfaces', 0, count, count, model.visualizeSurfaces, 'surfaces', 'transBlue')
+    return templates
+
+
+def benchmarkFits(results, scratch, clouds, templates, engines, iterations):
+    for points, ipdata in sorted(clouds.items()):
+        if points > FIT_POINTS:
+            continue
+        for elements, template in sorted(templates.items()):
+            for engine in engines:
+                output = os.path.join(scratch, 'fitted')
+                args = (ipdata, template + '.ipnode', template + '.ipelem', template + '.ipmap', iterations, output, engine)
+                worker = Worker(_fit, args)
+                worker.start()
+                while not worker.poll():
+                    time.sleep(0.01)
+                if worker.status != 'done':
+                    print('fit %s %d points %d elements %s: %s' % (engine, points, elements, worker.status, worker.result or ''))
+                    continue
+                duration, memory = worker.result
+                results.add('fit %s' % engine, points, elements, points * iterations, duration, memory)
+
+                buffers = readBuffers(output + '.exnode', output + '.exelem')
+                results.run('save', points, elements, elements, writeBuffers, [output + '.save.exnode', output + '.save.exelem'], buffers)
+
+
+def compare(baselineFilename, resultsFilename):
+    """Print the duration ratio of every stage in both files, returning 1 when any is a regression."""
+    with open(baselineFilename, 'r') as f:
+        baseline = json.load(f)
+    with open(resultsFilename, 'r') as f:
+        results = json.load(f)
+    print('%s (%s) -> %s (%s)' % (baselineFilename, baseline['revision'], resultsFilename, results['revision']))
+
+    def key(record):
+        return record['stage'], record['points'], record['elements']
+
+    before = dict((key(record), record) for record in baseline['results'])
+    regressions = 0
+    for record in results['results']:
+        if key(record) not in before:
+            continue
+        ratio = record['seconds'] / max(before[key(record)]['seconds'], 1e-9)
+        regressed = ratio > REGRESSION
+        regressions += regressed
+        print('%-24s %9d points %6d elements %9.3fs -> %9.3fs %6.2fx%s' %
+              (key(record) + (before[key(record)]['seconds'], record['seconds'], ratio, '  REGRESSION' if regressed else '')))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the lung fitting pipeline on synthetic data.')
+    parser.add_argument('--points', type=int, nargs='+', default=POINTS, help='data cloud sizes')
+    parser.add_argument('--elements', type=int, nargs='+', default=ELEMENTS, help='approximate template element counts')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='fitting engines to time')
+    parser.add_argument('-i', '--iterations', type=int, default=2, help='fitting iterations')
+    parser.add_argument('--stub', action='store_true', help='use the aether stand-in even when aether is installed')
+    parser.add_argument('-o', '--output', help='results file, benchmarks/results/<revision>.json by default')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'), help='compare two results files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.stub and AETHER != 'stub':
+        # the stand-in must be imported instead of aether, also in the fitting workers
+        os.environ['LUNG_FITTING_AETHER_STUB'] = '1'
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    print('aether: %s, zinc: %s' % (AETHER, 'yes' if ZINC else 'not installed, skipping its stages'))
+    results = Results()
+    scratch = tempfile.mkdtemp(prefix='lung_fitting_benchmark')
+    try:
+        clouds = benchmarkClouds(results, scratch, args.points)
+        templates = benchmarkTemplates(results, scratch, args.elements)
+        benchmarkFits(results, scratch, clouds, templates, args.engines, args.iterations)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', revision() + '.json')
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump({
+            'revision': revision(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'aether': AETHER,
+            'zinc': ZINC,
+            'iterations': args.iterations,
+            'results': results.records,
+        }, f, indent=1)
+    print('Wrote %s' % output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Measure the time from launching run.py to its window being shown and fail when it exceeds a budget, so that
+slow imports creeping back into startup are caught.
+
+    python benchmarks/startup.py [--runs 3] [--budget 2.0] [--offscreen]
+
+Every run starts the GUI with LUNG_FITTING_STARTUP set, waits for its startup report and stops it. The median
+time to the window is compared with the budget, and the slowest imports of that run are listed. The time
+includes starting the interpreter, which the report of run.py itself leaves out.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from src.startup import formatReport
+
+BUDGET = 2.0  # seconds from launch to the window being shown
+TIMEOUT = 60.0  # seconds after which a run that shows no window is stopped
+
+
+def launch(reportFilename, offscreen):
+    """Start run.py and return the seconds until its window was shown and its startup report."""
+    env = dict(os.environ, LUNG_FITTING_STARTUP=reportFilename)
+    if offscreen:
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+    start = time.time()
+    process = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    try:
+        # the report is written once the background imports are done, after the window was shown
+        while not os.path.exists(reportFilename):
+            if process.poll() is not None:
+                raise RuntimeError('run.py exited with code %d before showing its window:\n%s' %
+                                   (process.returncode, process.stderr.read().decode(errors='replace')))
+            if time.time() - start > TIMEOUT:
+                raise RuntimeError('run.py showed no window within %.0f seconds' % TIMEOUT)
+            time.sleep(0.05)
+        with open(reportFilename, 'r') as f:
+            report = json.load(f)
+    finally:
+        process.kill()
+        process.wait()
+    milestones = dict(report['milestones'])
+    return milestones['window shown'] - start, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the time to the first window of run.py against a budget.')
+    parser.add_argument('--runs', type=int, default=3, help='number of launches, the median is compared')
+    parser.add_argument('--budget', type=float, default=BUDGET, help='seconds to the window (default: %g)' % BUDGET)
+    parser.add_argument('--offscreen', action='store_true', help='show the window on the offscreen Qt platform')
+    parser.add_argument('--imports', type=int, default=15, help='number of slowest imports listed')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='lung_fitting_startup')
+    try:
+        runs = []
+        for run in range(args.runs):
+            try:
+                runs.append(launch(os.path.join(scratch, 'startup%d.json' % run), args.offscreen))
+            except RuntimeError as e:
+                print(e)
+                return 2
+            print('run %d: window shown after %.3fs' % (run + 1, runs[-1][0]))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    runs.sort(key=lambda run: run[0])
+    seconds, report = runs[len(runs) // 2]
+    print(formatReport(report, args.imports))
+    if seconds > args.budget:
+        print('FAIL: median time to the window %.3fs is over the budget of %.3fs' % (seconds, args.budget))
+        return 1
+    print('OK: median time to the window %.3fs is within the budget of %.3fs' % (seconds, args.budget))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Stand-in for the aether Python bindings, used by the benchmarks when the Fortran build is not available.
+
+It implements the geometry definitions, exports and surface fitting that this repository calls, with the
+same signatures and files. The geometry is kept in module state like aether keeps it in Fortran module
+arrays, and fitting runs the Python engine of src/solver.py, so timings of the fitting stage measure that
+engine rather than aether.
+"""
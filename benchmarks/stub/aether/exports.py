@@ -0,0 +1,11 @@
+from .geometry import state
+
+
+def export_node_geometry_2d(EXNODEFILE, name, offset):
+    with open(EXNODEFILE + '.exnode', 'w') as f:
+        f.write(state['mesh'].writeExnode(name))
+
+
+def export_elem_geometry_2d(EXELEMFILE, name, offset_elem, offset_node):
+    with open(EXELEMFILE + '.exelem', 'w') as f:
+        f.write(state['mesh'].writeExelem(name))
@@ -0,0 +1,24 @@
+import numpy as np
+
+from src.hermite import HermiteMesh, readIpnode, readIpelem
+from src.ipdata import readIpdata
+
+# defined geometry: 'nodes' (ids, values) from the ipnode, 'mesh' the HermiteMesh once elements are defined
+# and 'data' the coordinates of the data cloud
+state = {}
+
+
+def define_node_geometry_2d(NODEFILE):
+    state['nodes'] = readIpnode(NODEFILE)
+
+
+def define_elem_geometry_2d(ELEMFILE, sf_option):
+    nodeIds, values = state['nodes']
+    elementIds, elementNodes, elementVersions = readIpelem(ELEMFILE + '.ipelem')
+    mesh = HermiteMesh(nodeIds, values, elementIds, np.zeros_like(elementNodes), elementVersions)
+    mesh.elementNodes = mesh.nodeIndices(elementNodes)
+    state['mesh'] = mesh
+
+
+def define_data_geometry(DATAFILE):
+    state['data'] = readIpdata(DATAFILE + '.ipdata')[1]
@@ -0,0 +1,16 @@
+from src.hermite import readIpmap
+from src.solver import Projector, fitIteration
+
+from .geometry import state
+
+
+def fit_surface_geometry(niterations, fitting_file):
+    mesh = state['mesh']
+    fixed, mapped, scales = readIpmap(fitting_file + '.ipmap')
+    fixed[:, 0] = mesh.nodeIndices(fixed[:, 0])
+    mapped[:, [0, 3]] = mesh.nodeIndices(mapped[:, [0, 3]])
+    mesh.fixed, mesh.mapped, mesh.scales = fixed, mapped, scales
+
+    with Projector() as projector:
+        for _ in range(niterations):
+            fitIteration(mesh, state['data'], projector)
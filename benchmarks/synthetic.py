@@ -0,0 +1,82 @@
+"""
+Synthetic lobe-shaped data clouds and bicubic Hermite templates for the benchmarks.
+
+The lobe is a smooth egg shape, flattened towards its base and leaning sideways, with the data points
+spread around its surface like a segmented scan. The templates cover the same shape with a grid of
+elements that wraps around it and is open at the apex and the base.
+"""
+import numpy as np
+
+from src.hermite import COORDINATES, HermiteMesh
+from src.ipdata import writeIpdata
+
+SIZE = np.array([60.0, 45.0, 100.0])  # semi-axes of the lobe in mm
+NOISE = 0.5  # standard deviation in mm of the data points around the surface
+THETA_MARGIN = 0.15 * np.pi  # templates leave out the caps at the apex and base, where the grid would collapse
+
+
+def lobe(theta, phi):
+    """Return the (..., 3) points of the lobe surface at the polar angle theta and azimuth phi."""
+    z = np.cos(theta) * (0.7 + 0.3 * np.cos(theta)) * SIZE[2]
+    x = np.sin(theta) * np.cos(phi) * SIZE[0] + 0.15 * z
+    y = np.sin(theta) * np.sin(phi) * SIZE[1]
+    return np.stack([x, y, z], axis=-1)
+
+
+def lobeCloud(count, seed=0):
+    """Return the ids and (count, 3) coordinates of a data cloud spread evenly around the lobe."""
+    random = np.random.RandomState(seed)
+    theta = np.arccos(random.uniform(-1.0, 1.0, count))
+    phi = random.uniform(0.0, 2.0 * np.pi, count)
+    coords = lobe(theta, phi)
+    coords += random.normal(0.0, NOISE, coords.shape)
+    return np.arange(1, count + 1, dtype=np.int64), coords
+
+
+def writeLobeCloud(filename, count, seed=0):
+    ids, coords = lobeCloud(count, seed)
+    writeIpdata(filename, ids, coords, 'synthetic lobe, %d points' % count)
+
+
+def templateGrid(elements):
+    """Return the (columns, rows) of the template grid with about the given number of elements, with
+    twice as many elements around the lobe as along it.
+    """
+    rows = max(int(round(np.sqrt(elements / 2.0))), 1)
+    return max(elements // rows, 3), rows
+
+
+def lobeTemplate(columns, rows):
+    """Return node ids (N,), node values (N, 3, 4) [node, coordinate, derivative] and element nodes (E, 4)
+    of a template of columns x rows elements around the lobe. Derivatives are scaled to the element size,
+    as the unit scale factors used for the templates require.
+    """
+    dphi = 2.0 * np.pi / columns
+    dtheta = (np.pi - 2.0 * THETA_MARGIN) / rows
+    phi, theta = np.meshgrid(np.arange(columns) * dphi, THETA_MARGIN + np.arange(rows + 1) * dtheta)
+    phi = phi.ravel()
+    theta = theta.ravel()
+
+    # central differences of the surface, which is smooth, for the derivatives along the grid
+    h = 1e-4
+    value = lobe(theta, phi)
+    dphiValue = (lobe(theta, phi + h) - lobe(theta, phi - h)) / (2.0 * h) * dphi
+    dthetaValue = (lobe(theta + h, phi) - lobe(theta - h, phi)) / (2.0 * h) * dtheta
+    cross = (lobe(theta + h, phi + h) - lobe(theta + h, phi - h) - lobe(theta - h, phi + h) +
+             lobe(theta - h, phi - h)) / (4.0 * h * h) * dphi * dtheta
+    values = np.stack([value, dphiValue, dthetaValue, cross], axis=-1)
+
+    def node(column, row):
+        return row * columns + column % columns + 1
+
+    elementNodes = [[node(i, j), node(i + 1, j), node(i, j + 1), node(i + 1, j + 1)]
+                    for j in range(rows) for i in range(columns)]
+    return np.arange(1, len(values) + 1, dtype=np.int64), values, np.array(elementNodes, dtype=np.int64)
+
+
+def writeTemplate(basename, columns, rows):
+    """Write the template as basename.ipnode, basename.ipelem and basename.ipmap without constraints."""
+    nodeIds, values, elementNodes = lobeTemplate(columns, rows)
+    mesh = HermiteMesh(nodeIds, values[:, None], np.arange(1, len(elementNodes) + 1), elementNodes - 1,
+                       np.zeros(elementNodes.shape + (COORDINATES,), dtype=np.int32))
+    mesh.write(basename + '.ipnode', basename + '.ipelem', basename + '.ipmap', 'synthetic lobe template')
@@ -0,0 +1,37 @@
+import sys
+import argparse
+
+from src.ipdata import readIpdata, writeIpdata
+from src.lod import LevelsOfDetail
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a voxel-downsampled level of detail of a data cloud as a reduced .ipdata file.')
+    parser.add_argument('ipdata', help='data cloud to reduce')
+    parser.add_argument('output', nargs='?', help='reduced .ipdata file, leave out to only list the levels')
+    parser.add_argument('-l', '--level', type=int, default=None, help='level to write, 0 is the full cloud')
+    parser.add_argument('-p', '--points', type=int, default=None, help='write the finest level with at most this many points')
+    args = parser.parse_args()
+
+    ids, coords = readIpdata(args.ipdata)
+    levels = LevelsOfDetail(coords)
+    for level, (voxelSize, count) in enumerate(zip(levels.voxelSizes, levels.counts)):
+        print('level %d: %d points, voxel size %g' % (level, count, voxelSize))
+    if not args.output:
+        return 0
+
+    if args.level is not None:
+        level = min(max(args.level, 0), len(levels.counts) - 1)
+    elif args.points is not None:
+        level = levels.levelForPoints(args.points)
+    else:
+        parser.error('either --level or --points is required to write a reduced cloud')
+
+    indices = levels.indices(level)
+    writeIpdata(args.output, ids[indices], coords[indices], 'level %d of %s' % (level, args.ipdata))
+    print('Wrote %d of %d points to %s' % (len(indices), len(ids), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
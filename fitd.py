@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import argparse
+
+from src.fitting import ENGINES, parseSchedule
+from src.quality import TOLERANCE, Convergence, stoppedEarly
+from src.service import ADDRESS, SHARED_ADDRESS, FittingService, RemoteFit, available, request
+from src.worker import POLL_INTERVAL
+
+
+def serve(args):
+    if available(args.address):
+        print('A fitting service is already listening on %s' % args.address)
+        return 1
+    try:
+        service = FittingService(args.address, args.processes, args.shared)
+    except (OSError, ValueError) as e:
+        print('Cannot start the fitting service: %s' % e)
+        return 1
+    service.serve()
+    return 0
+
+
+def submit(args):
+    output = os.path.splitext(args.output)[0] if args.output else None
+    convergence = None
+    if args.converge is not None or args.time_budget:
+        convergence = Convergence(args.converge or 0.0, args.time_budget)
+    worker = RemoteFit((args.ipdata, args.ipnode, args.ipelem, args.ipmap, args.iterations, output, args.engine, convergence),
+                       args.priority, args.address)
+    worker.start()
+    while worker.id is None and not worker.poll():
+        time.sleep(POLL_INTERVAL)
+    if worker.id is None:
+        print('Job not submitted: %s' % worker.result)
+        return 1
+    print('Submitted job %s' % worker.id)
+    if not args.wait:
+        return 0
+
+    # the progress of the job is streamed back while it runs
+    progress = None
+    while True:
+        finished = worker.poll()
+        if worker.progress is not None and worker.progress is not progress:
+            progress = worker.progress
+            print('iteration %d of %d, RMS error %.3g' % progress[:3])
+        if finished:
+            break
+        time.sleep(POLL_INTERVAL)
+    lines = str(worker.result).strip().splitlines() if worker.status != 'done' else []
+    message = lines[-1] if lines else ''
+    print('Job %s %s in %.1fs %s' % (worker.id, worker.status, worker.duration, message))
+    stopped = stoppedEarly(worker.progress)
+    if stopped:
+        print('Stopped early (%s) after %d of %d iterations, saving about %.1fs' % stopped)
+    return 0 if worker.status == 'done' else 1
+
+
+def jobs(args):
+    _, _, summaries = request(('jobs',), args.address)
+    print('%5s %-12s %8s %-10s %-10s %s' % ('job', 'user', 'priority', 'status', 'iteration', 'data cloud'))
+    for summary in summaries:
+        print('%5d %-12s %8d %-10s %-10s %s' % summary)
+    return 0
+
+
+def cancel(args):
+    status, _, _ = request(('cancel', args.job), args.address)
+    print('Job %d: %s' % (args.job, 'unknown' if status == 'error' else 'cancelled' if status == 'running' else status))
+    return 0
+
+
+def stop(args):
+    kind, _, message = request(('shutdown',), args.address)
+    if kind == 'error':
+        print(message)
+        return 1
+    print('Stopping the fitting service on %s' % args.address)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the local fitting service, or submit fits to it and manage them.')
+    parser.add_argument('-a', '--address', default=None,
+                        help='socket of the service (default: $LUNG_FITTING_SERVICE or %s)' % ADDRESS)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('serve', help='run the service in the foreground')
+    command.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes (default: all cores)')
+    command.add_argument('--shared', action='store_true',
+                         help='accept jobs of all users of this workstation, on Linux (default socket: %s)' % SHARED_ADDRESS)
+    command.set_defaults(run=serve)
+
+    command = commands.add_parser('submit', help='queue a fit')
+    command.add_argument('ipdata')
+    command.add_argument('ipnode')
+    command.add_argument('ipelem')
+    command.add_argument('ipmap')
+    command.add_argument('-i', '--iterations', type=parseSchedule, default=[(1.0, 8)],
+                         help="number of iterations or coarse-to-fine stages such as '0.1:4, 0.3:2, 1:2' (default: 8)")
+    command.add_argument('-o', '--output', default=None, help='exnode or exelem file to write the fitted mesh to')
+    command.add_argument('-e', '--engine', choices=ENGINES, default='aether', help='fitting engine (default: aether)')
+    command.add_argument('--converge', nargs='?', type=float, const=TOLERANCE, default=None, metavar='TOLERANCE',
+                         help='stop once an iteration improves the RMS error and moves the nodes by less than this '
+                              'relative tolerance (default: %g)' % TOLERANCE)
+    command.add_argument('--time-budget', type=float, default=None, help='seconds after which the fit stops')
+    command.add_argument('-p', '--priority', type=int, default=0, help='jobs with a higher priority start first (default: 0)')
+    command.add_argument('-w', '--wait', action='store_true', help='print the progress of the job until it finishes')
+    command.set_defaults(run=submit)
+
+    command = commands.add_parser('jobs', help='list the queued and running jobs')
+    command.set_defaults(run=jobs)
+
+    command = commands.add_parser('cancel', help='cancel a queued or running job')
+    command.add_argument('job', type=int)
+    command.set_defaults(run=cancel)
+
+    command = commands.add_parser('stop', help='cancel all jobs and stop the service')
+    command.set_defaults(run=stop)
+
+    args = parser.parse_args()
+    if args.address is None:
+        args.address = SHARED_ADDRESS if getattr(args, 'shared', False) else ADDRESS
+    if args.command != 'serve' and not available(args.address):
+        print('No fitting service is listening on %s, start one with: python fitd.py serve' % args.address)
+        return 1
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,24 @@
 import sys
 import os
-import fileinput
-from shutil import copyfile
-from PySide2 import QtGui,QtWidgets
-from src.view import View
-from src.scene import Scene
-from src.model import *
-
-from aether.diagnostics import set_diagnostics_on
-from aether.geometry import define_elem_geometry_2d, define_node_geometry_2d,define_data_geometry, define_rad_from_file, define_rad_from_geom, append_units
-from aether.exports import export_node_geometry_2d, export_elem_geometry_2d,export_data_geometry
-#from aether.surface_fitting import fit_surface_geometry
-from opencmiss.zinc.scenecoordinatesystem import SCENECOORDINATESYSTEM_WINDOW_PIXEL_TOP_LEFT
-
-app = QtWidgets.QApplication(sys.argv)
-scene = Scene()
-
-datacloudModel = FileModel(scene, 'datacloud')
-surfaceModel = FileModel(scene, 'surface')
-
-# the keys in these dicts correspond to the accessibleName in Qt
-landmarkCoords = {}
-landmarkModels = {}
+import math
+import threading
+import importlib
+from src import startup
+# the startup report times the imports from here on until the window is shown, see LUNG_FITTING_STARTUP below
+if __name__ == '__main__':
+    startup.milestone('start')
+    if os.environ.get('LUNG_FITTING_STARTUP'):
+        startup.recordImports()
+from src import trace
+
+# Qt and Zinc are imported when the GUI starts, and the modules below, NumPy included, only by the callbacks
+# that need them or by warmUp once the window is shown, so that the window appears sooner and fitting workers,
+# which import this file, skip all of them
+WARM_MODULES = ['numpy', 'src.cache', 'src.tessellation', 'src.lobe', 'src.ipdata', 'src.hermite', 'src.alignment',
+                'src.quality', 'src.preprocess', 'src.fitting']
+
+# the landmark names correspond to the accessibleName in Qt, the landmarks themselves are kept per lobe
+landmarkModels = {}  # (lobe, landmark) => NodeModel
 landmarkMaterials = {
     'apex': 'green',
     'basal': 'red',
@@ -29,126 +26,337 @@ landmarkMaterials = {
     'ventral': 'yellow',
 }
 
-# callback functions for actions: load, show, landmark, fit, save
-def load(ipdata, ipnode, ipelem):
+# callback functions for actions: load, show, landmark, fit, frame, interaction, save
+def getLobe(name):
+    from src.lobe import Lobe
+
+    if name not in lobes:
+        lobes[name] = Lobe(scene, name, fitCache, service)
+    return lobes[name]
+
+def clean(lobe, ipdata):
+    """Return the cleaned data cloud of the lobe, without duplicates and outliers and cropped to the landmarks
+    of the lobe when it has any.
+    """
+    from src.preprocess import cachedCleanIpdata, landmarkPlanes, formatCounts
+
+    planes = landmarkPlanes(lobe.landmarks, mirror=lobe.name.startswith('R')) if lobe.landmarks else None
+    with trace.stage('cache cleaned ipdata'):
+        path, counts = cachedCleanIpdata(cache, ipdata, planes=planes)
+    print('Cleaned the data cloud of lobe %s: %s' % (lobe.name, formatCounts(counts)))
+    return path
+
+@trace.traced(lambda name, ipdata, ipnode, ipelem, *args: {'bytes': trace.fileSize(ipdata) + trace.fileSize(ipnode) + trace.fileSize(ipelem)})
+def load(name, ipdata, ipnode, ipelem, cleanData):
+    from src.ipdata import readIpdata
+    from src.hermite import HermiteMesh
+
+    lobe = getLobe(name)
+
     if ipdata:
-        data = os.path.splitext(ipdata)[0]
-        try:
-            os.remove(data + '.exdata')
-        except OSError:
-            pass
+        if cleanData:
+            ipdata = clean(lobe, ipdata)
 
-        define_data_geometry(data)
-        export_data_geometry(data, 'fitted')
+        def parse(path):
+            readIpdata(ipdata, mmapFilename=os.path.join(path, 'data'))
 
-        datacloudModel.load(data + '.exdata')
-        datacloudModel.visualizePoints('nodes', 'white', 0)
+        with trace.stage('cache ipdata'):
+            path = cache.get(cache.key([ipdata]), parse)
+        ids, coords = readIpdata(ipdata, mmapFilename=os.path.join(path, 'data'))
+        lobe.datacloudModel.loadPoints(ids, coords)
+        lobe.datacloudModel.visualizePoints('nodes', 'white', 0)
 
     if ipnode and ipelem:
-        node = os.path.splitext(ipnode)[0]
-        elem = os.path.splitext(ipelem)[0]
-        try:
-            os.remove(node + '.exnode')
-        except OSError:
-            pass
-
-        try:
-            os.remove(elem + '.exelem')
-        except OSError:
-            pass
-
-        define_node_geometry_2d(ipnode)
-        define_elem_geometry_2d(elem, 'unit')
-        export_node_geometry_2d(node, 'fitted', 0)
-        export_elem_geometry_2d(elem, 'fitted', 0, 0)
-
-        surfaceModel.load(node + '.exnode', elem + '.exelem')
-        surfaceModel.visualizeLines('lines', 'gold')
-        surfaceModel.visualizeSurfaces('lines', 'transBlue')
+        # the template is converted to EX format in memory, which is faster than a round trip through aether
+        lobe.mesh = HermiteMesh.read(ipnode, ipelem).buffers()
+        lobe.surfaceModel.loadBuffers(*lobe.mesh)
+        # reuses the graphics of a previous load, with the error coloring of a previous fit removed
+        lobe.surfaceModel.visualizeLines('lines', 'gold')
+        lobe.surfaceModel.visualizeSurfaces('surfaces', 'transBlue')
+        updateSurfaceExtents(lobe)
+
+    # define the inputs in the fitting process of the lobe in the background so that fitting can start right away
+    lobe.session.define(ipdata, ipnode, ipelem)
 
 def show(datacloud, mesh):
-    datacloudModel.setVisibility(datacloud)
-    surfaceModel.setVisibility(mesh)
+    for lobe in lobes.values():
+        lobe.setVisibility(datacloud, mesh)
 
+@trace.traced()
 def landmark(widget, landmark, x, y):
+    from opencmiss.zinc.scenecoordinatesystem import SCENECOORDINATESYSTEM_WINDOW_PIXEL_TOP_LEFT, SCENECOORDINATESYSTEM_WORLD
+    from src.model import NodeModel
+    from src.spatial import pickingCone
+
     selectTol = 5  # number of pixels around clicked area that are probed for datacloud points
     sceneviewer = widget.getSceneviewer()
-    scenepicker = widget.getScenepicker()
-    scenepicker.setSceneviewerRectangle(sceneviewer, SCENECOORDINATESYSTEM_WINDOW_PIXEL_TOP_LEFT,
-        x - selectTol, y - selectTol, x + selectTol, y + selectTol)
-
-    graphics = scenepicker.getNearestGraphics()
-    if graphics.getType() == 1:  # selecting node
-        node = scenepicker.getNearestNode()
-        coords = datacloudModel.getNodeCoordinates(node.getIdentifier())
-        
-        if landmark not in landmarkModels:
-            landmarkModels[landmark] = NodeModel(scene, landmark)
-        model = landmarkModels[landmark]
+    _, eye, _, _ = sceneviewer.getLookatParameters()
+    _, point = sceneviewer.transformCoordinates(SCENECOORDINATESYSTEM_WINDOW_PIXEL_TOP_LEFT, SCENECOORDINATESYSTEM_WORLD, scene.getScene(), [x, y, 0.0])
+    _, edgePoint = sceneviewer.transformCoordinates(SCENECOORDINATESYSTEM_WINDOW_PIXEL_TOP_LEFT, SCENECOORDINATESYSTEM_WORLD, scene.getScene(), [x + selectTol, y, 0.0])
+
+    # snap to the data point nearest to the viewer within selectTol pixels of the click, of any lobe, which the
+    # landmark is then set for
+    direction, tanAngle = pickingCone(eye, point, edgePoint)
+    coords = None
+    for lobe in lobes.values():
+        index = lobe.datacloudModel.getPointIndex()
+        i = index.nearestToRay(eye, direction, tanAngle)
+        if i is not None:
+            depth = sum((a - b) * d for a, b, d in zip(index.coords[i], eye, direction))
+            if coords is None or depth < nearest:
+                coords, nearest, picked = index.coords[i].tolist(), depth, lobe
+    if coords is not None:
+        if (picked.name, landmark) not in landmarkModels:
+            landmarkModels[(picked.name, landmark)] = NodeModel(scene, landmark, picked.region)
+        model = landmarkModels[(picked.name, landmark)]
         model.setNodeCoordinates(1, coords)
         model.visualizePoints('nodes', landmarkMaterials[landmark], 6)  # 6 is the size of the sphere
-        
-        if landmark not in landmarkCoords:
-            landmarkCoords[landmark] = coords
+        picked.landmarks[landmark] = coords
 
-        print('Setting landmark %s to %s' % (landmark, coords))
+        print('Setting landmark %s of lobe %s to %s' % (landmark, picked.name, coords))
         return True
     return False
 
-def fit(ipdata, ipnode, ipelem, iterations):
-    if not ipdata or not ipnode or not ipelem:
-        print('Error: data cloud or surface mesh not loaded')
+@trace.traced(lambda inputs, iterations, *args: {'lobes': len(inputs), 'iterations': iterations})
+def fit(inputs, iterations, restart, engine, transform, icp, cleanData, convergence):
+    """Return a worker per lobe that fits its (ipdata, ipnode, ipelem, ipmap) inputs, which all run at once.
+    Templates of lobes with landmarks are first aligned to them with the transform and the data clouds are
+    cleaned first when cleanData is True, both in the worker of the lobe, see prepareInputs. With a Convergence the fits stop early once they
+    converged or ran out of time. Lobes without all of their inputs are skipped.
+    """
+    for name in sorted(inputs):
+        if not all(inputs[name]):
+            print('Warning: data cloud, surface mesh or map of lobe %s not selected, skipping it' % name)
+    inputs = dict((name, filenames) for name, filenames in inputs.items() if all(filenames))
+    if not inputs:
+        print('Error: no lobe has a data cloud, surface mesh and map selected')
+        return None
+
+    from src.preprocess import prepareInputs
+
+    workers = {}
+    for name in sorted(inputs):
+        lobe = getLobe(name)
+        ipdata, ipnode, ipelem, ipmap = inputs[name]
+        if not restart and not lobe.session.fitted(ipelem):
+            print('No fitted mesh of lobe %s to continue from, starting from the template' % name)
+        lobe.inputs = inputs[name]
+        lobe.rms = []
+        landmarks = sorted(lobe.landmarks.items())
+        align = restart and bool(landmarks)
+        prepare = None
+        if cleanData or align:
+            prepare = (prepareInputs, (cache, name, ipdata, ipnode, ipelem, landmarks, cleanData, transform if align else None, icp))
+        workers[name] = lobe.session.fit(ipdata, ipnode, ipelem, ipmap, iterations, restart, engine, landmarks, convergence, prepare)
+    print('Fitting %s with the %s engine' % (', '.join(sorted(workers)), engine))
+    return workers
+
+@trace.traced()
+def fitProgress(name, worker):
+    lobe = lobes[name]
+    lobe.rms.append(worker.progress[2])
+    # only the node parameters change between iterations, update them in place instead of reloading files
+    lobe.surfaceModel.setAllNodeParameters(*worker.progress[3])
+
+    # color the surface by the RMS distance of the data points nearest to each element, on the same scale
+    # for all lobes
+    ids, rms, maximum = worker.progress[4]
+    lobe.surfaceModel.setElementValues('error', ids, rms)
+    lobe.surfaceModel.setDataField('surfaces', 'error')
+    errorRange[name] = rms.max()
+    scene.setSpectrumRange('error', 0.0, max(max(errorRange.values()), 1e-6))
+
+@trace.traced()
+def fitFinished(name, worker):
+    from src.quality import CONVERGED, convergedIteration, stoppedEarly
+
+    lobe = lobes[name]
+    lobe.session.finished(worker)
+    if worker.status != 'done':
+        print('Fitting %s %s: %s' % (name, worker.status, worker.result or ''))
+        return
+
+    lobe.mesh = worker.result
+    if worker.progress:
+        # same mesh as the template, so only the node parameters change and the error coloring is kept
+        lobe.surfaceModel.setAllNodeParameters(*worker.progress[3])
+    else:
+        lobe.surfaceModel.loadBuffers(*lobe.mesh)
+        lobe.surfaceModel.setDataField('surfaces', None)
+    updateSurfaceExtents(lobe)
+    print('Fitted %s in %.1fs' % (name, worker.duration))
+    if worker.progress:
+        _, _, rms = worker.progress[:3]
+        ids, elementRms, maximum = worker.progress[4]
+        worst = elementRms.argmax()
+        print('%s RMS error %.3g, maximum %.3g, worst element %d with RMS %.3g' % (name, rms, maximum.max(), ids[worst], elementRms[worst]))
+    stopped = stoppedEarly(worker.progress)
+    if stopped:
+        print('%s stopped early (%s) after %d of %d iterations, saving about %.1fs' % ((name,) + stopped))
+    if len(lobe.rms) > 1:
+        print('%s converged to within %g%% of the final RMS error after %d of %d iterations' %
+              (name, CONVERGED * 100.0, convergedIteration(lobe.rms), len(lobe.rms)))
+
+def warmUp():
+    # runs in the background, the callbacks importing the same modules on the main thread wait for it
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+def windowShown():
+    """Finish starting up once the window is shown: set up the scene, look for a fitting service and import
+    the modules of the callbacks in the background.
+    """
+    global service, warmer, cache, fitCache
+    from src.cache import Cache, FitCache
+
+    startup.milestone('window shown')
+    startup.stopImports()
+    scene.initialize()
+    cache = Cache()
+    fitCache = FitCache(cache)
+    startup.milestone('scene initialized')
+
+    # fits from the template go to the fitting service when one is running, see fitd.py
+    from src.service import ADDRESS, available
+    service = ADDRESS if available() else None
+    if service:
+        print('Fitting with the fitting service on %s' % service)
+
+    warmer = threading.Thread(target=warmUp)
+    warmer.daemon = True
+    warmer.start()
+    if startupFilename:
+        startupTimer.start()
+
+def startupPoll():
+    # the startup report is complete once the background imports are done
+    if warmer.is_alive():
+        return
+    startupTimer.stop()
+    startup.milestone('warmed up')
+    startup.write(startupFilename)
+    print(startup.formatReport(startup.report()))
+    print('Startup report written to %s' % startupFilename)
+
+def pixelSize(widget):
+    # size in the scene of a pixel at the distance of the point looked at
+    sceneviewer = widget.getSceneviewer()
+    _, eye, lookat, _ = sceneviewer.getLookatParameters()
+    distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(eye, lookat)))
+    return 2.0 * distance * math.tan(sceneviewer.getViewAngle() / 2.0) / max(math.hypot(widget.width(), widget.height()), 1.0)
+
+def updateSurfaceExtents(lobe):
+    # the size and curvature of elements only change with the mesh, the next frame picks their refinement
+    from src.tessellation import SAMPLE_XI, elementExtents
+    global tessellationPending
+
+    ids, samples = lobe.surfaceModel.getElementSamples(SAMPLE_XI)
+    lobe.surfaceExtents = (ids,) + elementExtents(samples)
+    tessellationPending = True
+
+@trace.traced()
+def tessellate(widget):
+    # the triangle budget is shared by all lobes
+    import numpy as np
+    from src.tessellation import refinementFactors
+    global tessellationPending
+
+    tessellationPending = False
+    shown = [lobe for lobe in lobes.values() if lobe.surfaceExtents is not None and len(lobe.surfaceExtents[0])]
+    if shown:
+        size = np.concatenate([lobe.surfaceExtents[1] for lobe in shown])
+        curvature = np.concatenate([lobe.surfaceExtents[2] for lobe in shown])
+        factors = np.split(refinementFactors(size, curvature, pixelSize(widget)), np.cumsum([len(lobe.surfaceExtents[0]) for lobe in shown])[:-1])
+        for lobe, lobeFactors in zip(shown, factors):
+            lobe.surfaceModel.setTessellations('surfaces', lobe.surfaceExtents[0], lobeFactors)
+
+def frame(widget, seconds):
+    if tessellationPending:
+        tessellate(widget)
+
+    # draw fewer data cloud points when the clouds are far away or frames take too long
+    for lobe in lobes.values():
+        levels = lobe.datacloudModel.getLevelsOfDetail()
+        if levels is not None:
+            lobe.datacloudModel.setLevelOfDetail(levels.select(pixelSize(widget), seconds))
+
+def interaction(widget, interacting):
+    # draw the surface coarsely while the view moves, and refine it for the new view once it stops
+    scene.setInteracting(interacting)
+    if not interacting:
+        tessellate(widget)
+
+@trace.traced()
+def save(name, exnode, exelem):
+    from src.fitting import writeBuffers
+
+    if name not in lobes or not lobes[name].mesh:
+        print('Error: surface mesh of lobe %s not loaded' % name)
         return
 
-    for landmark in landmarkCoords:
-        coords = landmarkCoords[landmark]
-        print('Fitting with landmark %s = %s' % (landmark, coords))
-
-    mapname = 'example/LUL_map'
-
-    elem = os.path.splitext(ipelem)[0]
-    data = os.path.splitext(ipdata)[0]
-    define_node_geometry_2d(ipnode)
-    define_elem_geometry_2d(elem, 'unit')
-    define_data_geometry(data)
-
-    fit_surface_geometry(iterations, mapname)
-
-    export_node_geometry_2d('.tmp', 'fitted', 0)
-    export_elem_geometry_2d('.tmp', 'fitted', 0, 0)
-
-    surfaceModel.load('.tmp.exnode', '.tmp.exelem')
-
-def save(exnode, exelem):
-    node = os.path.splitext(exnode)[0]
-    elem = os.path.splitext(exelem)[0]
-    export_node_geometry_2d(node, 'fitted', 0)
-    export_elem_geometry_2d(elem, 'fitted', 0, 0)
-    print('Saved mesh as %s and %s' % (exnode, exelem))
-
-
-view = View(scene)
-view.loadCallback(load)
-view.showCallback(show)
-view.landmarkCallback(landmark)
-view.fitCallback(fit)
-view.saveCallback(save)
-view.setOutputs('out.exnode', 'out.exelem')
-view.setInfo("""
-<h2>Lung fitting</h2>
-<p>This GUI provides an easy interface for the surface_fitting Fortran code in lungsim. It allows the visualization of the data cloud and fitted surface mesh and allows configuring the fitting algorithm.</p>
-<p>Created for use within the Auckland Bioengineering Institute at the University of Auckland.</p>
-<h3>Usage</h3>
-<p>Select the data cloud (.ipdata) and template mesh (.ipnode and .ipelem) files and press Load. Both the data cloud and surface mesh are visible in the 3D view and their visibility can be toggled with the checkboxes.</p>
-<p>The number of iterations can be set for the fitting algorithm and optionally there is the possibility to select landmark nodes to supply to the fitting algorithm (not yet supported). Click on the Fit button to start the fitting procedure with its output redirected to the console.</p>
-<p>You can select landmarks by hiding the surface mesh and then clicking one of the landmark buttons. Then click on a data cloud point to select the location for the landmark node. Do this for all landmarks and the nodes will show up with matching colors.</p>
-<p>When the surface mesh has a good fit with the data cloud you can export the data by clicking Save after selecting the output file names (.exnode and .exelem).</p>
-""")
-view.show()
-sys.exit(app.exec_())
-
-
-# Print errors
-num = model._logger.getNumberOfMessages()
-for i in range(0, num):
-    print(model._logger.getMessageTextAtIndex(i))
+    writeBuffers([exnode, exelem], lobes[name].mesh)
+    print('Saved mesh of lobe %s as %s and %s' % (name, exnode, exelem))
+
+
+# fitting workers are spawned processes that import this file as __mp_main__, they must not start the GUI
+if __name__ == '__main__':
+    # LUNG_FITTING_TRACE=trace.json records the stages from the start and writes them as a Chrome trace on exit
+    traceFilename = os.environ.get('LUNG_FITTING_TRACE')
+    if traceFilename:
+        trace.enable()
+    # LUNG_FITTING_STARTUP=startup.json prints the time to the window and the slowest imports, and writes them
+    startupFilename = os.environ.get('LUNG_FITTING_STARTUP')
+
+    from PySide2 import QtCore, QtWidgets
+    from src.view import View
+    from src.scene import Scene
+    startup.milestone('imports')
+
+    app = QtWidgets.QApplication(sys.argv)
+    scene = Scene()
+
+    lobes = {}  # name => Lobe, created when the lobe is first loaded or fitted
+    errorRange = {}  # name => largest element error of the lobe's last fit iteration
+
+    cache = None  # of converted and cleaned inputs and fitted meshes, created by windowShown
+    fitCache = None
+    tessellationPending = False
+    service = None  # address of the fitting service, set by windowShown
+    warmer = None  # thread importing the modules of the callbacks, see warmUp
+
+    view = View(scene)
+    view.loadCallback(load)
+    view.showCallback(show)
+    view.landmarkCallback(landmark)
+    view.fitCallback(fit)
+    view.fitProgressCallback(fitProgress)
+    view.fitFinishedCallback(fitFinished)
+    view.frameCallback(frame)
+    view.interactionCallback(interaction)
+    view.saveCallback(save)
+    view.setOutputs('out.exnode', 'out.exelem')
+    view.setInputs('LUL', '', '', '', 'example/LUL_map.ipmap')
+    view.setInfo("""
+    <h2>Lung fitting</h2>
+    <p>This GUI provides an easy interface for the surface_fitting Fortran code in lungsim. It allows the visualization of the data cloud and fitted surface mesh and allows configuring the fitting algorithm.</p>
+    <p>Created for use within the Auckland Bioengineering Institute at the University of Auckland.</p>
+    <h3>Usage</h3>
+    <p>Select the data cloud (.ipdata) and template mesh (.ipnode and .ipelem) files and press Load. Both the data cloud and surface mesh are visible in the 3D view and their visibility can be toggled with the checkboxes.</p>
+    <p>Each lobe selected with Lobe has its own data cloud, template mesh and fitting map (.ipmap), shown together in the 3D view. Fit fits all lobes with inputs at the same time, each in a process of its own, and shows every lobe as soon as it is fitted. Save writes the fitted mesh of the selected lobe.</p>
+    <p>The number of iterations can be set for the fitting algorithm, or a coarse-to-fine Schedule of fraction:iterations stages such as 0.1:4, 0.3:2, 1:2 that fits the early iterations on a downsampled data cloud, and optionally landmarks can be selected on the data cloud that the template is aligned to before fitting. Click on the Fit button to start the fitting procedure in the background, its progress and RMS error are shown below the button and it can be stopped with Cancel. While fitting, the surface is colored by the RMS distance of the data points nearest to each element, from blue for a close fit to red for the worst element. Check Continue from fitted mesh to run more iterations starting from the previous fit instead of the template.</p>
+    <p>Check Stop when converged to treat the iterations as a maximum: fitting stops once an iteration improves the RMS error by less than the tolerance next to it and no node moves further than the tolerance times the size of the mesh. A Time budget stops every fit after that many seconds. The output reports how many iterations each fit ran and about how much time stopping early saved.</p>
+    <p>You can select landmarks by hiding the surface mesh and then clicking one of the landmark buttons. Then click on a data cloud point to select the location for the landmark node. Do this for all landmarks and the nodes will show up with matching colors. Landmarks belong to the lobe whose data cloud point was clicked. Before fitting from the template, its apex, basal, lateral and ventral nodes, the nodes the furthest out in those directions, are moved onto the landmarks of the lobe with a similarity (rotation, scaling and translation) or affine transform, chosen below the landmark buttons. Check Refine with ICP to then improve the alignment against the whole data cloud by iterative closest point. The output reports the landmark and data distances before and after, and after fitting how many iterations the fit needed to converge.</p>
+    <p>When a fitting service is running on this workstation, started with python fitd.py serve, fits from the template are queued there and run in its worker processes, which have the fitting engines loaded already and are shared with your other scripts, or with all users of the workstation when LUNG_FITTING_SERVICE names a shared service.</p>
+    <p>When the surface mesh has a good fit with the data cloud you can export the data by clicking Save after selecting the output file names (.exnode and .exelem).</p>
+    <p>Timings opens a table of the time spent in every stage of loading, fitting and saving. Check Record to collect them and Export to save them as a trace for chrome://tracing or Perfetto.</p>
+    """)
+    view.show()
+    startupTimer = QtCore.QTimer()
+    startupTimer.setInterval(100)
+    startupTimer.timeout.connect(startupPoll)
+    # runs as soon as the event loop has shown the window
+    QtCore.QTimer.singleShot(0, windowShown)
+    status = app.exec_()
+    if traceFilename:
+        trace.export(traceFilename)
+    sys.exit(status)
@@ -0,0 +1,133 @@
+import numpy as np
+
+from .hermite import basis, COORDINATES, DERIVATIVES, LOCAL_NODES
+from .trace import traced
+
+TRANSFORMS = ['similarity', 'affine']  # see similarity and affine
+# direction in which the template node of each landmark is the furthest out, in patient coordinates with x
+# towards the left, y towards the back and z towards the head; lateral is mirrored for right lobes
+LANDMARK_DIRECTIONS = {
+    'apex': (0.0, 0.0, 1.0),
+    'basal': (0.0, 0.0, -1.0),
+    'lateral': (1.0, 0.0, 0.0),
+    'ventral': (0.0, -1.0, 0.0),
+}
+ICP_ITERATIONS = 20
+ICP_TOLERANCE = 1e-3  # relative decrease of the RMS distance below which ICP stops
+ICP_SAMPLES = 6  # points along each xi direction at which elements are sampled for ICP
+
+
+def templateLandmarks(mesh, names, mirror=False):
+    """Return the node index of each named landmark in mesh, the node the furthest out in the landmark's
+    LANDMARK_DIRECTIONS, with the lateral direction reversed when mirror is True.
+    """
+    coords = mesh.values[:, 0, :, 0]
+    indices = []
+    for name in names:
+        direction = np.array(LANDMARK_DIRECTIONS[name])
+        if mirror and name == 'lateral':
+            direction = -direction
+        indices.append(int(np.argmax(coords.dot(direction))))
+    return np.array(indices, dtype=np.int64)
+
+
+def similarity(source, target):
+    """Return the (3, 3) matrix and translation of the rotation, uniform scaling and translation that maps
+    the (P, 3) source points closest to target in the least squares sense. Fewer than 3 points only
+    determine a translation.
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    sourceMean = source.mean(axis=0)
+    targetMean = target.mean(axis=0)
+    if len(source) < 3:
+        return np.eye(COORDINATES), targetMean - sourceMean
+
+    # Umeyama's solution, the sign correction keeps the rotation from becoming a reflection
+    s = source - sourceMean
+    u, sigma, vt = np.linalg.svd((target - targetMean).T.dot(s) / len(source))
+    signs = np.ones(COORDINATES)
+    if np.linalg.det(u) * np.linalg.det(vt) < 0.0:
+        signs[-1] = -1.0
+    matrix = u.dot(np.diag(signs)).dot(vt) * (sigma.dot(signs) / max(np.mean(np.sum(s * s, axis=1)), 1e-300))
+    return matrix, targetMean - matrix.dot(sourceMean)
+
+
+def affine(source, target):
+    """Return the (3, 3) matrix and translation of the affine map from the (P, 3) source points closest to
+    target in the least squares sense, or the similarity when the points do not span a volume.
+    """
+    source = np.asarray(source, dtype=float)
+    homogeneous = np.hstack([source, np.ones((len(source), 1))])
+    if np.linalg.matrix_rank(homogeneous) < COORDINATES + 1:
+        return similarity(source, target)
+    solution = np.linalg.lstsq(homogeneous, np.asarray(target, dtype=float), rcond=None)[0]
+    return solution[:COORDINATES].T, solution[COORDINATES]
+
+
+def transformMesh(mesh, matrix, translation):
+    """Transform the node values of mesh in place. Derivatives are transformed by the matrix only."""
+    mesh.values = np.einsum('ij,nvjd->nvid', matrix, mesh.values)
+    mesh.values[:, :, :, 0] += translation
+
+
+def surfacePoints(mesh, samples=ICP_SAMPLES):
+    """Return the (E * samples^2, 3) points of a grid of samples x samples xi locations in every element."""
+    grid = (np.arange(samples) + 0.5) / samples
+    xi = np.stack(np.meshgrid(grid, grid, indexing='ij'), -1).reshape(-1, 2)
+    params = mesh.elementParameters().transpose(0, 1, 3, 2).reshape(-1, LOCAL_NODES * DERIVATIVES, COORDINATES)
+    return np.matmul(basis(xi).reshape(-1, LOCAL_NODES * DERIVATIVES), params).reshape(-1, COORDINATES)
+
+
+@traced(lambda mesh, landmarks, *args, **kwargs: {'landmarks': len(landmarks), 'nodes': len(mesh.nodeIds)})
+def alignMesh(mesh, landmarks, index=None, transform='similarity', icpIterations=ICP_ITERATIONS, mirror=False,
+              nodes=None):
+    """Move mesh in place so that its landmark nodes match the {name: coords} of landmarks with the
+    similarity or affine transform. The landmark nodes are given as {name: node index}, or otherwise found
+    by templateLandmarks. When the PointIndex of the data cloud is given, the alignment is refined by
+    iterative closest point with the same kind of transform: the points sampled on the mesh are moved
+    towards their nearest data points until the RMS distance stops decreasing.
+
+    Return a dict with the RMS landmark distance before and after, the RMS distance of the mesh samples to
+    the data cloud before and after and the number of ICP iterations.
+    """
+    fit = affine if transform == 'affine' else similarity
+    names = sorted(landmarks)
+    targets = np.array([landmarks[name] for name in names], dtype=float).reshape(-1, COORDINATES)
+    if nodes is None:
+        nodes = templateLandmarks(mesh, names, mirror)
+    else:
+        nodes = np.array([nodes[name] for name in names], dtype=np.int64)
+    report = {'landmarkRmsBefore': _rms(mesh.values[nodes, 0, :, 0] - targets)}
+
+    if len(names):
+        matrix, translation = fit(mesh.values[nodes, 0, :, 0], targets)
+        transformMesh(mesh, matrix, translation)
+    report['landmarkRms'] = _rms(mesh.values[nodes, 0, :, 0] - targets)
+
+    report['icpIterations'] = 0
+    if index is not None:
+        points = surfacePoints(mesh)
+        distances, nearest = index.nearest(points)
+        report['dataRmsBefore'] = rms = _rms(distances)
+        for _ in range(icpIterations):
+            matrix, translation = fit(points, index.coords[nearest])
+            moved = points.dot(matrix.T) + translation
+            distances, movedNearest = index.nearest(moved)
+            if _rms(distances) >= rms:
+                break
+            transformMesh(mesh, matrix, translation)
+            converged = _rms(distances) > rms * (1.0 - ICP_TOLERANCE)
+            points, nearest, rms = moved, movedNearest, _rms(distances)
+            report['icpIterations'] += 1
+            if converged:
+                break
+        report['dataRms'] = rms
+    return report
+
+
+def _rms(distances):
+    distances = np.asarray(distances, dtype=float)
+    if distances.size == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(np.sum(distances.reshape(len(distances), -1) ** 2, axis=1))))
@@ -0,0 +1,128 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+CACHE_DIR = os.environ.get('LUNG_FITTING_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'lung_fitting'))
+CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+
+_digests = {}  # (filename, size, mtime) => content digest, prevents rehashing unchanged files
+
+
+def fileDigest(filename):
+    stat = os.stat(filename)
+    statKey = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+    if statKey not in _digests:
+        h = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        _digests[statKey] = h.hexdigest()
+    return _digests[statKey]
+
+
+def _size(path):
+    """Return the total size of the files in path and its subdirectories, symbolic links are not followed."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                # removed while walking
+                pass
+    return size
+
+
+class Cache(object):
+    """Content-addressed directory cache. Each entry is a directory named after the hash of its input
+    files and options, the least recently used entries are evicted once the total size exceeds maxSize.
+    """
+    def __init__(self, path=CACHE_DIR, maxSize=CACHE_SIZE):
+        self._path = path
+        self._maxSize = maxSize
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+
+    def key(self, filenames, *options):
+        h = hashlib.sha1()
+        for filename in filenames:
+            h.update(fileDigest(filename).encode())
+        for option in options:
+            h.update(repr(option).encode())
+        return h.hexdigest()
+
+    def lookup(self, key):
+        path = os.path.join(self._path, key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def store(self, key, fill):
+        """Create an entry by calling fill with a temporary directory which is moved into place when done."""
+        path = os.path.join(self._path, key)
+        tmp = tempfile.mkdtemp(prefix='.tmp', dir=self._path)
+        try:
+            fill(tmp)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # another process stored the same entry concurrently
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            # left behind when fill failed, was interrupted or the entry already existed
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+        self._evict(key)
+        return path
+
+    def get(self, key, fill):
+        path = self.lookup(key)
+        if path is None:
+            path = self.store(key, fill)
+        return path
+
+    def _evict(self, keep):
+        entries = []
+        total = 0
+        for name in os.listdir(self._path):
+            path = os.path.join(self._path, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = _size(path)
+            entries.append((os.path.getmtime(path), size, name))
+            total += size
+
+        for _, size, name in sorted(entries):
+            if total <= self._maxSize:
+                break
+            if name != keep:
+                shutil.rmtree(os.path.join(self._path, name), ignore_errors=True)
+                total -= size
+
+
+class FitCache(object):
+    """Fitted meshes kept in a Cache. A fit is identified by the content of its input files, its options and
+    the fraction of the data cloud of every iteration it ran, see fractions in the fitting module, so that a
+    fit with more iterations can continue from the cached fit it starts with.
+    """
+    def __init__(self, cache):
+        self._cache = cache
+
+    def _key(self, inputs, options, fractions):
+        return self._cache.key(inputs, 'fit', options, tuple(fractions))
+
+    def lookup(self, inputs, options, fractions):
+        """Return the path of the cached fit that ran the most of the first iterations of fractions, and how
+        many of them it ran, or (None, 0) when there is none.
+        """
+        for count in range(len(fractions), 0, -1):
+            path = self._cache.lookup(self._key(inputs, options, fractions[:count]))
+            if path is not None:
+                return path, count
+        return None, 0
+
+    def store(self, inputs, options, fractions, fill):
+        return self._cache.store(self._key(inputs, options, fractions), fill)
@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .ipdata import readIpdata, writeIpdata
+from .lod import LevelsOfDetail
+from .trace import stage, traced, fileSize
+
+ENGINES = ['aether', 'python']  # see fitGeometry and the solver module
+MIN_STAGE_POINTS = 1000  # stages on a fraction of the data cloud do not decimate it below this many points
+
+# aether can only export to files, keep them in memory-backed storage where available. Elsewhere, such as on macOS
+# and Windows, they are written to the temporary directory on disk and removed after the fit
+SCRATCH_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def parseSchedule(text):
+    """Parse a fitting schedule of (fraction, iterations) stages written as 'fraction:iterations' separated by
+    commas or spaces, such as '0.1:4, 0.3:2, 1:2'. A plain number of iterations is a single stage on the full
+    data cloud. Raises ValueError for anything else.
+    """
+    schedule = []
+    for item in str(text).replace(',', ' ').split():
+        fraction, _, iterations = item.rpartition(':')
+        fraction = float(fraction) if fraction else 1.0
+        iterations = int(iterations)
+        if not 0.0 < fraction <= 1.0 or iterations < 1:
+            raise ValueError('invalid fitting stage %s, expected a fraction in (0, 1] and at least 1 iteration' % item)
+        schedule.append((fraction, iterations))
+    if not schedule:
+        raise ValueError('empty fitting schedule')
+    return schedule
+
+
+def schedule(iterations):
+    """Return the (fraction, iterations) stages of iterations, which is a number of iterations on the full
+    data cloud or already a schedule.
+    """
+    if isinstance(iterations, int):
+        return [(1.0, iterations)]
+    return [(float(fraction), int(count)) for fraction, count in iterations]
+
+
+def fractions(iterations):
+    """Return the fraction of the data cloud that every iteration of a number of iterations or a schedule fits."""
+    return tuple(fraction for fraction, count in schedule(iterations) for _ in range(count))
+
+
+def fromFractions(fractions):
+    """Return the schedule that fits the fractions of the data cloud one iteration each, see fractions."""
+    stages = []
+    for fraction in fractions:
+        if stages and stages[-1][0] == fraction:
+            stages[-1] = (fraction, stages[-1][1] + 1)
+        else:
+            stages.append((fraction, 1))
+    return stages
+
+
+def stageLevels(coords):
+    """Return the LevelsOfDetail that the stages of a schedule choose their data from."""
+    return LevelsOfDetail(coords, minPoints=MIN_STAGE_POINTS)
+
+
+def decimate(levels, fraction):
+    """Return the indices of the points of the finest level of detail with at most fraction of the points."""
+    if fraction >= 1.0:
+        return np.arange(levels.counts[0])
+    return levels.indices(levels.levelForPoints(fraction * levels.counts[0]))
+
+
+def readBuffers(*filenames):
+    buffers = []
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            buffers.append(f.read())
+    return tuple(buffers)
+
+
+def writeBuffers(filenames, buffers):
+    for filename, buffer in zip(filenames, buffers):
+        with open(filename, 'wb') as f:
+            f.write(buffer)
+
+
+def defineGeometry(ipdata=None, ipnode=None, ipelem=None):
+    """Define the template mesh and/or the data cloud in aether's global state."""
+    from aether.geometry import define_elem_geometry_2d, define_node_geometry_2d, define_data_geometry
+
+    if ipnode and ipelem:
+        with stage('define_node_geometry_2d', bytes=fileSize(ipnode)):
+            define_node_geometry_2d(ipnode)
+        with stage('define_elem_geometry_2d', bytes=fileSize(ipelem)):
+            define_elem_geometry_2d(os.path.splitext(ipelem)[0], 'unit')
+    if ipdata:
+        with stage('define_data_geometry', bytes=fileSize(ipdata)):
+            define_data_geometry(os.path.splitext(ipdata)[0])
+
+
+def fitGeometry(ipdata, ipnode, ipelem, ipmap, iterations, progress=None, convergence=None):
+    """Fit the geometry currently defined in aether for the given number of iterations, or the stages of a
+    schedule as returned by parseSchedule, and return the contents of the fitted exnode and exelem. Stages
+    on a fraction of the data cloud define a voxel-downsampled cloud in aether for their iterations, after
+    the fit the full cloud is defined again. When progress is given, the iterations are run one at a time
+    and progress is called after each of them with the iteration number, the total number of iterations,
+    the RMS error, the node parameters as returned by readNodeParameters, the element errors as returned
+    by FitError.elementErrors, measured on the template ipnode and ipelem and the data of the stage, and
+    None. With a Convergence the iterations are also measured one at a time, stages stop once they
+    converged and the fit once its time budget ran out. A fit that ran fewer iterations than planned
+    repeats its last progress with the reason, 'converged' or 'time budget', and the seconds per iteration
+    instead of None.
+    """
+    from aether.exports import export_node_geometry_2d, export_elem_geometry_2d
+    from aether.geometry import define_data_geometry
+    from aether.surface_fitting import fit_surface_geometry
+
+    stages = schedule(iterations)
+    scratch = tempfile.mkdtemp(prefix='lung_fitting', dir=SCRATCH_DIR)
+    try:
+        fitted = os.path.join(scratch, 'fitted')
+        mapname = os.path.splitext(ipmap)[0]
+        coords = levels = None
+        measure = progress is not None or convergence is not None
+        if measure or any(fraction < 1.0 for fraction, _ in stages):
+            ids, coords = readIpdata(ipdata)
+            levels = stageLevels(coords)
+        decimated = False
+
+        def defineStage(fraction):
+            # return the indices of the data points the stage fits, defining them in aether
+            nonlocal decimated
+            indices = None if levels is None else decimate(levels, fraction)
+            if indices is not None and len(indices) < len(coords):
+                stageData = os.path.join(scratch, 'stage')
+                writeIpdata(stageData + '.ipdata', ids[indices], coords[indices], 'fraction %g of %s' % (fraction, ipdata))
+                with stage('define_data_geometry', points=len(indices)):
+                    define_data_geometry(stageData)
+                decimated = True
+            elif decimated:
+                with stage('define_data_geometry', bytes=fileSize(ipdata)):
+                    define_data_geometry(os.path.splitext(ipdata)[0])
+                decimated = False
+            return indices
+
+        if measure:
+            from .hermite import HermiteMesh, readExnode
+            from .quality import FitError, runStages
+            from .solver import Projector
+
+            mesh = HermiteMesh.read(ipnode, ipelem)
+
+            def iterate(error):
+                with stage('fit_surface_geometry', iterations=1):
+                    fit_surface_geometry(1, mapname)
+                with stage('export_node_geometry_2d'):
+                    export_node_geometry_2d(fitted, 'fitted', 0)
+                # the exported nodes are parsed with NumPy, without a Zinc region
+                with stage('readExnode', bytes=fileSize(fitted + '.exnode')):
+                    nodeIds, values = readExnode(fitted + '.exnode')
+                mesh.values[mesh.nodeIndices(nodeIds), :values.shape[1]] = values
+
+            with Projector() as projector:
+                runStages(stages, lambda fraction: FitError(mesh, coords[defineStage(fraction)], projector), iterate,
+                          progress, convergence)
+        else:
+            for fraction, count in stages:
+                defineStage(fraction)
+                with stage('fit_surface_geometry', iterations=count):
+                    fit_surface_geometry(count, mapname)
+
+        # later fits in the same process continue with the full data cloud
+        if decimated:
+            with stage('define_data_geometry', bytes=fileSize(ipdata)):
+                define_data_geometry(os.path.splitext(ipdata)[0])
+
+        with stage('export_node_geometry_2d'):
+            export_node_geometry_2d(fitted, 'fitted', 0)
+        with stage('export_elem_geometry_2d'):
+            export_elem_geometry_2d(fitted, 'fitted', 0, 0)
+        return readBuffers(fitted + '.exnode', fitted + '.exelem')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+@traced(lambda ipdata, ipnode, ipelem, ipmap, iterations, *args, **kwargs: {'bytes': fileSize(ipdata), 'iterations': iterations})
+def fitSurface(ipdata, ipnode, ipelem, ipmap, iterations, output=None, engine='aether', convergence=None, progress=None):
+    """Fit the template mesh to the data cloud with aether, see fitGeometry, or with the Python engine of the
+    solver module, for a number of iterations or a schedule of (fraction, iterations) stages, stopping early
+    with a Convergence. Aether keeps its geometry in global state, so this must run in a process of its own.
+    When output is given the fitted mesh is also written to output.exnode and output.exelem.
+    """
+    if engine == 'python':
+        from .solver import fitHermite
+        buffers = fitHermite(ipdata, ipnode, ipelem, ipmap, iterations, progress, convergence=convergence)
+    elif engine == 'aether':
+        defineGeometry(ipdata, ipnode, ipelem)
+        buffers = fitGeometry(ipdata, ipnode, ipelem, ipmap, iterations, progress, convergence)
+    else:
+        raise ValueError('unknown fitting engine %s, expected one of %s' % (engine, ', '.join(ENGINES)))
+    if output:
+        writeBuffers([output + '.exnode', output + '.exelem'], buffers)
+    return buffers
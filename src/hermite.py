@@ -0,0 +1,349 @@
+import numpy as np
+
+from .trace import traced, fileSize
+
+COORDINATES = 3
+DERIVATIVES = 4  # value, d/ds1, d/ds2 and d2/ds1ds2 for every node version and coordinate
+LOCAL_NODES = 4
+
+
+def _hermite(xi, order=0):
+    """Return the 1D cubic Hermite basis functions [value at 0, slope at 0, value at 1, slope at 1], or
+    their first or second derivatives, as a list of arrays evaluated at the array xi.
+    """
+    if order == 0:
+        return [1.0 - xi * xi * (3.0 - 2.0 * xi), xi * (xi - 1.0) ** 2, xi * xi * (3.0 - 2.0 * xi), xi * xi * (xi - 1.0)]
+    if order == 1:
+        return [6.0 * xi * (xi - 1.0), (3.0 * xi - 1.0) * (xi - 1.0), 6.0 * xi * (1.0 - xi), xi * (3.0 * xi - 2.0)]
+    return [12.0 * xi - 6.0, 6.0 * xi - 4.0, 6.0 - 12.0 * xi, 6.0 * xi - 2.0]
+
+
+def basis(xi, order1=0, order2=0):
+    """Return the bicubic Hermite basis functions [point, local node, derivative] at the (P, 2) xi, or their
+    derivatives of the given orders along xi1 and xi2.
+    """
+    h1 = _hermite(xi[:, 0], order1)
+    h2 = _hermite(xi[:, 1], order2)
+    result = np.empty((len(xi), LOCAL_NODES, DERIVATIVES))
+    for local in range(LOCAL_NODES):
+        for derivative in range(DERIVATIVES):
+            # local node j sits at xi1 = j % 2 and xi2 = j // 2, derivative k is along xi1 when k & 1 and
+            # along xi2 when k & 2
+            result[:, local, derivative] = h1[2 * (local % 2) + (derivative & 1)] * h2[2 * (local // 2) + (derivative >> 1)]
+    return result
+
+
+def _value(line):
+    return line.rsplit(':', 1)[1].strip()
+
+
+def readIpnode(filename):
+    """Return the node ids and their values[node, version, coordinate, derivative] from a CMISS .ipnode file,
+    padded with NaN for versions a node does not have.
+    """
+    ids = []
+    nodes = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if 'Node number' in line:
+                ids.append(int(_value(line)))
+                node = [[] for _ in range(COORDINATES)]
+                nodes.append(node)
+            elif 'The Xj(' in line:
+                versions = node[int(line.split('Xj(', 1)[1].split(')', 1)[0]) - 1]
+                versions.append([float(_value(line)), 0.0, 0.0, 0.0])
+            elif 'directions 1 & 2' in line:
+                versions[-1][3] = float(_value(line))
+            elif 'direction 1 is' in line:
+                versions[-1][1] = float(_value(line))
+            elif 'direction 2 is' in line:
+                versions[-1][2] = float(_value(line))
+
+    maxVersions = max([len(versions) for node in nodes for versions in node] or [1])
+    values = np.full((len(ids), maxVersions, COORDINATES, DERIVATIVES), np.nan)
+    for i, node in enumerate(nodes):
+        for coord, versions in enumerate(node):
+            if versions:
+                values[i, :len(versions), coord] = versions
+    return np.array(ids, dtype=np.int64), values
+
+
+def readExnode(filename, fieldName='coordinates'):
+    """Return the node ids and values[node, version, coordinate, derivative] of a field with up to 3 derivatives
+    from an EX format node file such as aether's exports or writeExnode, padded with NaN like readIpnode.
+    """
+    ids = []
+    nodes = []
+    components = []  # (field name, derivatives, versions) of every component of the current header
+    field = None
+    with open(filename, 'r') as f:
+        tokens = []
+        for line in f:
+            text = line.strip()
+            if text.startswith('#Fields'):
+                components = []
+            elif text.split(')', 1)[0].isdigit() and ',' in text:
+                field = text.split(')', 1)[1].split(',', 1)[0].strip()
+            elif '#Derivatives' in text:
+                derivatives = int(text.split('#Derivatives=', 1)[1].split()[0].rstrip(','))
+                versions = int(text.split('#Versions=', 1)[1].split()[0]) if '#Versions=' in text else 1
+                components.append((field, derivatives, versions))
+            elif text.startswith('Node:'):
+                ids.append(int(text.split()[1]))
+                count = sum((derivatives + 1) * versions for _, derivatives, versions in components)
+                while len(tokens) < count:
+                    tokens.extend(float(value) for value in next(f).split())
+                node = []
+                for name, derivatives, versions in components:
+                    values, tokens = tokens[:(derivatives + 1) * versions], tokens[(derivatives + 1) * versions:]
+                    if name == fieldName:
+                        node.append([values[i:i + derivatives + 1] + [0.0] * (DERIVATIVES - 1 - derivatives)
+                                     for i in range(0, len(values), derivatives + 1)])
+                nodes.append(node)
+
+    maxVersions = max([len(versions) for node in nodes for versions in node] or [1])
+    values = np.full((len(ids), maxVersions, COORDINATES, DERIVATIVES), np.nan)
+    for i, node in enumerate(nodes):
+        for coord, versions in enumerate(node):
+            values[i, :len(versions), coord] = versions
+    return np.array(ids, dtype=np.int64), values
+
+
+def readIpelem(filename):
+    """Return the element ids, their (E, 4) global node numbers and (E, 4, 3) zero-based node versions per
+    local node and coordinate from a CMISS .ipelem file with bicubic Hermite elements.
+    """
+    ids = []
+    elementNodes = []
+    elementVersions = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if 'Element number' in line:
+                ids.append(int(_value(line)))
+                versions = np.zeros((LOCAL_NODES, COORDINATES), dtype=np.int32)
+                elementVersions.append(versions)
+            elif 'global numbers' in line:
+                nodes = [int(n) for n in _value(line).split()]
+                elementNodes.append(nodes)
+            elif 'version number for occurrence' in line:
+                occurrence = int(line.split('occurrence', 1)[1].split()[0])
+                node = int(line.split('of node', 1)[1].split(',', 1)[0])
+                coord = int(line.split('njj=', 1)[1].split()[0]) - 1
+                local = [j for j, n in enumerate(nodes) if n == node][occurrence - 1]
+                versions[local, coord] = int(_value(line)) - 1
+    return np.array(ids, dtype=np.int64), np.array(elementNodes, dtype=np.int64).reshape(-1, LOCAL_NODES), \
+        np.array(elementVersions, dtype=np.int32).reshape(-1, LOCAL_NODES, COORDINATES)
+
+
+def readIpmap(filename):
+    """Return the fixed (F, 3) [node, version, derivative] and mapped (M, 6) [node, version, derivative,
+    node, version, derivative] tables and (M,) scale factors from a .ipmap file. The first derivative of a
+    mapping equals the scale factor times the second, versions are zero-based and derivatives index
+    the derivative axis of the node values, so 1 is d/ds1 and 2 is d/ds2.
+    """
+    with open(filename, 'r') as f:
+        lines = [line.split() for line in f if line.strip()]
+
+    fixed = np.zeros((0, 3), dtype=np.int64)
+    mapped = np.zeros((0, 7))
+    i = 0
+    while i < len(lines):
+        count = int(lines[i][-1])
+        rows = np.array(lines[i + 1:i + 1 + count], dtype=float)
+        if lines[i][1] == 'fixed:':
+            fixed = rows.reshape(-1, 3).astype(np.int64)
+        else:
+            mapped = rows.reshape(-1, 7)
+        i += 1 + count
+
+    fixed[:, 1] -= 1
+    scales = mapped[:, 6]
+    mapped = mapped[:, :6].astype(np.int64)
+    mapped[:, [1, 4]] -= 1
+    return fixed, mapped, scales
+
+
+class HermiteMesh(object):
+    """Bicubic Hermite surface mesh with versioned nodes, held in arrays:
+
+    nodeIds (N,), values (N, V, 3, 4) [node, version, coordinate, derivative] padded with NaN, elementIds (E,),
+    elementNodes (E, 4) node indices, elementVersions (E, 4, 3) zero-based versions per local node and
+    coordinate, fixed (F, 3) and mapped (M, 6) [node index, version, derivative] constraints as read by
+    readIpmap and the (M,) scales of the mappings.
+    """
+    def __init__(self, nodeIds, values, elementIds, elementNodes, elementVersions, fixed=None, mapped=None, scales=None):
+        self.nodeIds = np.asarray(nodeIds, dtype=np.int64)
+        self.values = np.asarray(values, dtype=float)
+        self.elementIds = np.asarray(elementIds, dtype=np.int64)
+        self.elementNodes = np.asarray(elementNodes, dtype=np.int64)
+        self.elementVersions = np.asarray(elementVersions, dtype=np.int32)
+        self.fixed = np.zeros((0, 3), dtype=np.int64) if fixed is None else np.asarray(fixed, dtype=np.int64)
+        self.mapped = np.zeros((0, 6), dtype=np.int64) if mapped is None else np.asarray(mapped, dtype=np.int64)
+        self.scales = np.zeros(0) if scales is None else np.asarray(scales, dtype=float)
+
+    @classmethod
+    @traced(lambda cls, ipnode, ipelem, ipmap=None: {'bytes': fileSize(ipnode) + fileSize(ipelem) + fileSize(ipmap)})
+    def read(cls, ipnode, ipelem, ipmap=None):
+        """Read a mesh from CMISS .ipnode, .ipelem and optionally .ipmap files, without aether."""
+        nodeIds, values = readIpnode(ipnode)
+        elementIds, elementNodes, elementVersions = readIpelem(ipelem)
+        mesh = cls(nodeIds, values, elementIds, np.zeros_like(elementNodes), elementVersions)
+        mesh.elementNodes = mesh.nodeIndices(elementNodes)
+        if ipmap:
+            fixed, mapped, scales = readIpmap(ipmap)
+            fixed[:, 0] = mesh.nodeIndices(fixed[:, 0])
+            mapped[:, [0, 3]] = mesh.nodeIndices(mapped[:, [0, 3]])
+            mesh.fixed, mesh.mapped, mesh.scales = fixed, mapped, scales
+        return mesh
+
+    def write(self, ipnode, ipelem, ipmap=None, heading=''):
+        """Write the mesh as CMISS .ipnode, .ipelem and optionally .ipmap files that read and aether read."""
+        for filename, contents in [(ipnode, self.writeIpnode(heading)), (ipelem, self.writeIpelem(heading)),
+                                   (ipmap, self.writeIpmap())]:
+            if filename:
+                with open(filename, 'w') as f:
+                    f.write(contents)
+
+    def nodeIndices(self, ids):
+        """Return the indices into nodeIds of an array of node ids."""
+        order = np.argsort(self.nodeIds)
+        indices = order[np.minimum(np.searchsorted(self.nodeIds, ids, sorter=order), len(order) - 1)]
+        if not np.array_equal(self.nodeIds[indices], ids):
+            raise ValueError('unknown node ids %s' % np.setdiff1d(ids, self.nodeIds).tolist())
+        return indices
+
+    def versions(self):
+        """Return the number of versions of every node."""
+        return np.sum(~np.isnan(self.values[:, :, 0, 0]), axis=1).astype(np.int32)
+
+    def elementParameters(self):
+        """Return the node values used by every element as [element, local node, coordinate, derivative]."""
+        coords = np.arange(COORDINATES)
+        return self.values[self.elementNodes[:, :, None], self.elementVersions, coords]
+
+    def parameterIndices(self):
+        """Return for every element [element, local node, coordinate, derivative] the index of the value
+        in values[:, :, coordinate, :] flattened, which is the same for all coordinates.
+        """
+        versions = self.values.shape[1]
+        rows = self.elementNodes[:, :, None] * versions + self.elementVersions
+        return rows[:, :, :, None] * DERIVATIVES + np.arange(DERIVATIVES)
+
+    def nodeParameters(self):
+        """Return (ids, versions, values) as returned by readNodeParameters from the model module."""
+        return self.nodeIds, self.versions(), self.values.transpose(0, 1, 3, 2).copy()
+
+    def setNodeParameters(self, ids, versions, values):
+        """Set the values of nodes from (ids, versions, values) as returned by nodeParameters."""
+        count = min(values.shape[1], self.values.shape[1])
+        self.values[self.nodeIndices(ids), :count] = values[:, :count].transpose(0, 1, 3, 2)
+
+    def writeIpnode(self, heading=''):
+        """Return the nodes in CMISS .ipnode format as a string, prompting for versions so that every node
+        keeps its own number of them.
+        """
+        lines = [' CMISS Version 1.21 ipnode File Version 2', ' Heading: %s' % heading, '']
+        lines.append(' The number of nodes is [%5d]: %5d' % (len(self.nodeIds), len(self.nodeIds)))
+        lines.append(' Number of coordinates [ 3]:  %d' % COORDINATES)
+        for coord in range(1, COORDINATES + 1):
+            lines.append(' Do you want prompting for different versions of nj=%d [N]? Y' % coord)
+        for coord in range(1, COORDINATES + 1):
+            lines.append(' The number of derivatives for coordinate %d is [0]: %d' % (coord, DERIVATIVES - 1))
+        for nid, versions, values in zip(self.nodeIds.tolist(), self.versions().tolist(), self.values.tolist()):
+            lines.append('')
+            lines.append(' Node number [%5d]: %5d' % (nid, nid))
+            for coord in range(COORDINATES):
+                lines.append(' The number of versions for nj=%d is [1]: %2d' % (coord + 1, versions))
+                for version in range(versions):
+                    x, ds1, ds2, ds12 = values[version][coord]
+                    lines.append(' For version number %d:' % (version + 1))
+                    lines.append(' The Xj(%d) coordinate is [ 0.00000E+00]: %.15e' % (coord + 1, x))
+                    lines.append(' The derivative wrt direction 1 is [ 0.00000E+00]: %.15e' % ds1)
+                    lines.append(' The derivative wrt direction 2 is [ 0.00000E+00]: %.15e' % ds2)
+                    lines.append(' The derivative wrt directions 1 & 2 is [ 0.00000E+00]: %.15e' % ds12)
+        return '\n'.join(lines) + '\n'
+
+    def writeIpelem(self, heading=''):
+        """Return the elements in CMISS .ipelem format as a string. The versions of local nodes are only
+        prompted for nodes with more than one version, for every occurrence of the node in the element.
+        """
+        lines = [' CMISS Version 2.1  ipelem File Version 2', ' Heading: %s' % heading, '']
+        lines.append(' The number of elements is [1]: %d' % len(self.elementIds))
+        versions = self.versions()
+        nodeIds = self.nodeIds[self.elementNodes]
+        for eid, nodes, indices, elementVersions in zip(self.elementIds.tolist(), nodeIds.tolist(),
+                                                        self.elementNodes.tolist(), self.elementVersions.tolist()):
+            lines.append('')
+            lines.append(' Element number [    1]: %d' % eid)
+            lines.append(' The number of geometric Xj-coordinates is [3]: %d' % COORDINATES)
+            for coord in range(1, COORDINATES + 1):
+                lines.append(' The basis function type for geometric variable %d is [1]:  1' % coord)
+            lines.append(' Enter the %d global numbers for basis 1: %s' % (LOCAL_NODES, ' '.join('%d' % n for n in nodes)))
+            for local, (nid, index) in enumerate(zip(nodes, indices)):
+                if versions[index] < 2:
+                    continue
+                occurrence = nodes[:local + 1].count(nid)
+                for coord in range(COORDINATES):
+                    lines.append(' The version number for occurrence %2d of node %5d, njj=%d is [ 1]: %2d'
+                                 % (occurrence, nid, coord + 1, elementVersions[local][coord] + 1))
+        return '\n'.join(lines) + '\n'
+
+    def writeIpmap(self):
+        """Return the fixed and mapped derivatives in the .ipmap format that readIpmap reads as a string."""
+        lines = ['Number fixed: %d' % len(self.fixed)]
+        for node, version, derivative in self.fixed.tolist():
+            lines.append('%d %d %d' % (self.nodeIds[node], version + 1, derivative))
+        lines.append('Number of mappings: %d' % len(self.mapped))
+        for (node, version, derivative, other, otherVersion, otherDerivative), scale in zip(self.mapped.tolist(), self.scales.tolist()):
+            lines.append('%d %d %d %d %d %d %2g' % (self.nodeIds[node], version + 1, derivative, self.nodeIds[other],
+                                                    otherVersion + 1, otherDerivative, scale))
+        return '\n'.join(lines) + '\n'
+
+    def buffers(self, group='fitted'):
+        """Return the exnode and exelem contents as bytes, as readBuffers in the fitting module does."""
+        return self.writeExnode(group).encode(), self.writeExelem(group).encode()
+
+    def writeExnode(self, group='fitted'):
+        """Return the nodes in EX format as a string, with the group name used by aether's exports."""
+        lines = [' Group name: %s' % group]
+        header = None
+        for nid, versions, values in zip(self.nodeIds.tolist(), self.versions().tolist(), self.values):
+            if versions != header:
+                header = versions
+                lines.append(' #Fields=1')
+                lines.append(' 1) coordinates, coordinate, rectangular cartesian, #Components=3')
+                for coord, name in enumerate('xyz'):
+                    lines.append('   %s.  Value index=%d, #Derivatives=3 (d/ds1,d/ds2,d2/ds1ds2), #Versions=%d'
+                                 % (name, 1 + coord * versions * DERIVATIVES, versions))
+            lines.append(' Node: %12d' % nid)
+            for coord in range(COORDINATES):
+                lines.append(' ' + ' '.join('%22.15e' % v for v in values[:versions, coord].ravel()))
+        return '\n'.join(lines) + '\n'
+
+    def writeExelem(self, group='fitted'):
+        """Return the elements in EX format as a string, the element field header is repeated whenever the
+        node versions used by an element differ from those of the previous element.
+        """
+        lines = [' Group name: %s' % group]
+        header = None
+        nodeIds = self.nodeIds[self.elementNodes]
+        for eid, nodes, versions in zip(self.elementIds.tolist(), nodeIds.tolist(), self.elementVersions.tolist()):
+            if versions != header:
+                header = versions
+                lines.append(' Shape.  Dimension=2, line*line')
+                lines.append(' #Scale factor sets= 0')
+                lines.append(' #Nodes=           %d' % LOCAL_NODES)
+                lines.append(' #Fields=1')
+                lines.append(' 1) coordinates, coordinate, rectangular cartesian, #Components=3')
+                for coord, name in enumerate('xyz'):
+                    lines.append('   %s.  c.Hermite*c.Hermite, no modify, standard node based.' % name)
+                    lines.append('     #Nodes= %d' % LOCAL_NODES)
+                    for local in range(LOCAL_NODES):
+                        first = versions[local][coord] * DERIVATIVES + 1
+                        lines.append('      %d.  #Values=%d' % (local + 1, DERIVATIVES))
+                        lines.append('       Value indices: ' + ''.join('%4d' % i for i in range(first, first + DERIVATIVES)))
+                        lines.append('       Scale factor indices: ' + ''.join('%4d' % 0 for _ in range(DERIVATIVES)))
+            lines.append(' Element: %12d 0 0' % eid)
+            lines.append('   Nodes:')
+            lines.append('   ' + ''.join('%13d' % n for n in nodes))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,114 @@
+import os
+from itertools import islice
+
+import numpy as np
+
+from .trace import traced, fileSize
+
+# number of lines parsed at once, keeps memory bounded for very large data clouds
+CHUNK_SIZE = 500000
+
+
+def _point(line):
+    # whether the line starts with an id and 3 coordinates
+    tokens = line.split()
+    try:
+        [float(token) for token in tokens[:4]]
+    except ValueError:
+        return False
+    return len(tokens) >= 4
+
+
+def _parseChunk(lines, filename, first):
+    # the weights are optional, so only the id and the coordinates are parsed, which every line must have
+    if not any(line.strip() for line in lines):
+        return np.zeros((0, 4))
+    try:
+        return np.loadtxt(lines, usecols=range(4), ndmin=2)
+    except ValueError:
+        for number, line in enumerate(lines, first):
+            if line.strip() and not _point(line):
+                raise ValueError('%s line %d is not an id and 3 coordinates: %s' % (filename, number, line.strip()))
+        raise
+
+
+def iterIpdata(filename, chunkSize=CHUNK_SIZE):
+    """Yield (ids, coords) array pairs of at most chunkSize data points read from an .ipdata file
+    with lines formatted as 'id x y z w1 w2 w3', of which the weights are optional. Raises ValueError
+    for lines without an id and 3 coordinates.
+    """
+    with open(filename, 'r') as f:
+        f.readline()  # heading
+        first = 2
+        while True:
+            lines = list(islice(f, chunkSize))
+            if not lines:
+                break
+            values = _parseChunk(lines, filename, first)
+            first += len(lines)
+            if len(values) > 0:
+                yield values[:, 0].astype(np.int64), values[:, 1:4]
+
+
+def _loadMmap(mmapFilename):
+    return np.load(mmapFilename + '.ids.npy', mmap_mode='r'), np.load(mmapFilename + '.coords.npy', mmap_mode='r')
+
+
+@traced(lambda filename, *args, **kwargs: {'bytes': fileSize(filename)})
+def readIpdata(filename, chunkSize=CHUNK_SIZE, mmapFilename=None):
+    """Read an .ipdata file and return (ids, coords) with coords an (N, 3) array. When mmapFilename is
+    given, the parsed arrays are stored as <mmapFilename>.ids.npy and <mmapFilename>.coords.npy and
+    returned memory-mapped, so that subsequent calls with the same mmapFilename skip parsing altogether.
+    """
+    if mmapFilename:
+        if os.path.isfile(mmapFilename + '.ids.npy') and os.path.isfile(mmapFilename + '.coords.npy'):
+            return _loadMmap(mmapFilename)
+
+    ids = []
+    coords = []
+    for chunkIds, chunkCoords in iterIpdata(filename, chunkSize):
+        ids.append(chunkIds)
+        coords.append(chunkCoords)
+
+    if ids:
+        ids = np.concatenate(ids)
+        coords = np.concatenate(coords)
+    else:
+        ids = np.zeros(0, dtype=np.int64)
+        coords = np.zeros((0, 3))
+
+    if mmapFilename:
+        np.save(mmapFilename + '.ids.npy', ids)
+        np.save(mmapFilename + '.coords.npy', coords)
+        return _loadMmap(mmapFilename)
+    return ids, coords
+
+
+def writeIpdata(filename, ids, coords, heading='', chunkSize=CHUNK_SIZE):
+    """Write data points to an .ipdata file that readIpdata reads back, with unit weights."""
+    with open(filename, 'w') as f:
+        f.write(' %s\n' % heading)
+        for i in range(0, len(ids), chunkSize):
+            chunk = np.column_stack([ids[i:i + chunkSize], coords[i:i + chunkSize]])
+            np.savetxt(f, chunk, fmt=' %d %e %e %e 1.0 1.0 1.0')
+
+
+def exnodePoints(ids, coords, ranks=None, group='points'):
+    """Return data points as the contents of an EX format node file, which Zinc reads all at once, with the
+    coordinates in a 'coordinates' field and the integer ranks, when given, in a 'lod' field.
+    """
+    lines = [' Group name: %s' % group, ' #Fields=%d' % (1 if ranks is None else 2),
+             ' 1) coordinates, coordinate, rectangular cartesian, #Components=3']
+    for index, name in enumerate('xyz', 1):
+        lines.append('   %s.  Value index=%d, #Derivatives=0' % (name, index))
+    columns = [np.asarray(ids, dtype=float), np.asarray(coords, dtype=float)]
+    # %s writes the shortest text that reads back as the same double
+    node = ' Node: %d\n %s %s %s\n'
+    if ranks is not None:
+        lines.append(' 2) lod, field, rectangular cartesian, #Components=1')
+        lines.append('   1.  Value index=4, #Derivatives=0')
+        columns.append(np.asarray(ranks, dtype=float))
+        node = ' Node: %d\n %s %s %s %d\n'
+    # formatting all nodes with one format string is much faster than formatting them one by one
+    values = tuple(np.column_stack(columns).ravel().tolist())
+    return ('\n'.join(lines) + '\n' + node * len(ids) % values).encode()
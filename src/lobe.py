@@ -0,0 +1,35 @@
+from .model import FileModel
+from .session import Session
+
+LOBES = ['LUL', 'LLL', 'RUL', 'RML', 'RLL']  # left upper and lower, right upper, middle and lower
+
+
+class Lobe(object):
+    """The data cloud and surface mesh of one lung lobe, each a FileModel in a child region named after the
+    lobe, with a Session of its own so that lobes are fitted in parallel, sharing the FitCache and the
+    FittingService at the service address if given. The inputs are the (ipdata, ipnode, ipelem, ipmap)
+    filenames last loaded or fitted, mesh the exnode and exelem contents shown and landmarks the
+    {name: coords} picked on the data cloud of the lobe.
+    """
+    def __init__(self, scene, name, fitCache=None, service=None):
+        self.name = name
+        defaultRegion = scene.getContext().getDefaultRegion()
+        self.region = defaultRegion.findChildByName(name)
+        if not self.region.isValid():
+            self.region = defaultRegion.createChild(name)
+
+        self.datacloudModel = FileModel(scene, 'datacloud', self.region)
+        self.surfaceModel = FileModel(scene, 'surface', self.region)
+        self.session = Session(fitCache, service)
+        self.inputs = ('', '', '', '')
+        self.mesh = None
+        self.landmarks = {}
+        self.rms = []  # RMS error of every iteration of the last fit
+        self.surfaceExtents = None  # element ids, sizes and curvatures of the mesh shown
+
+    def setVisibility(self, datacloud, mesh):
+        self.datacloudModel.setVisibility(datacloud)
+        self.surfaceModel.setVisibility(mesh)
+
+    def stop(self):
+        self.session.stop()
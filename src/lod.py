@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+
+MIN_POINTS = 10000  # no coarser levels are built once a level has fewer points than this
+MIN_REDUCTION = 0.75  # a voxel size is skipped when it keeps more than this fraction of the previous level
+FRAME_BUDGET = 1.0 / 30.0  # seconds per rendered frame
+PIXELS_PER_VOXEL = 2.0  # voxels smaller than this many pixels on screen show no more detail than coarser ones
+REFINE_MARGIN = 0.5  # fraction of the frame budget that frames of a finer level must be predicted to take at most
+COOLDOWN = 1.0  # seconds after dropping to a coarser level for slow frames before finer levels are tried again
+
+
+def voxelDownsample(coords, voxelSize):
+    """Return the sorted indices of one point per occupied voxel of a grid with the given voxel size."""
+    if len(coords) == 0:
+        return np.zeros(0, dtype=np.int64)
+    cells = np.floor((coords - coords.min(axis=0)) / voxelSize).astype(np.int64)
+    keys = np.ravel_multi_index(cells.T, cells.max(axis=0) + 1)
+    _, indices = np.unique(keys, return_index=True)
+    return np.sort(indices)
+
+
+class LevelsOfDetail(object):
+    """Hierarchy of voxel-downsampled versions of a point cloud. Level 0 holds all points and every
+    coarser level is a subset of the previous one, with a voxel size that at least doubles. The rank of
+    a point is the coarsest level it is part of, so level l shows the points with rank >= l.
+    """
+    def __init__(self, coords, minPoints=MIN_POINTS, frameBudget=FRAME_BUDGET):
+        coords = np.asarray(coords, dtype=float)
+        self.voxelSizes = [0.0]
+        self.counts = [len(coords)]
+        self.ranks = np.zeros(len(coords), dtype=np.int32)
+        self._frameBudget = frameBudget
+        self._pointBudget = len(coords)
+        self._coarsened = None  # time the point budget was last lowered
+        self.level = 0
+
+        if len(coords) <= minPoints:
+            return
+
+        # start at the voxel size that would hold the points of a surface at a uniform spacing
+        size = np.linalg.norm(np.ptp(coords, axis=0))
+        voxelSize = size / np.sqrt(len(coords))
+        indices = np.arange(len(coords))
+        while len(indices) > minPoints:
+            voxelSize *= 2.0
+            kept = indices[voxelDownsample(coords[indices], voxelSize)]
+            if len(kept) > MIN_REDUCTION * len(indices) and voxelSize < size:
+                continue
+            if len(kept) == len(indices):
+                break
+            indices = kept
+            self.ranks[indices] += 1
+            self.voxelSizes.append(voxelSize)
+            self.counts.append(len(indices))
+
+    def indices(self, level):
+        """Return the indices of the points in the level."""
+        return np.flatnonzero(self.ranks >= level)
+
+    def levelForPoints(self, points):
+        """Return the finest level with at most the given number of points."""
+        return next((level for level, count in enumerate(self.counts) if count <= points), len(self.counts) - 1)
+
+    def select(self, pixelSize, frameTime=None, now=None):
+        """Return the level to render when a pixel covers pixelSize in the cloud and the last frame took
+        frameTime seconds: the coarsest level that shows all detail visible at this distance, or coarser
+        when the point budget requires it. The point budget halves while frames take longer than the
+        frame budget. It only doubles again when frames with twice the points, assuming frame time grows
+        with the points drawn, are predicted to take at most REFINE_MARGIN of the frame budget, and not
+        within COOLDOWN seconds of it halving, so that it does not flip between two levels.
+        """
+        if frameTime is not None:
+            now = time.time() if now is None else now
+            if frameTime > self._frameBudget:
+                self._pointBudget = max(self.counts[self.level] // 2, self.counts[-1])
+                self._coarsened = now
+            elif self._coarsened is None or now - self._coarsened >= COOLDOWN:
+                points = min(self._pointBudget * 2, self.counts[0])
+                if points * frameTime / max(self.counts[self.level], 1) <= REFINE_MARGIN * self._frameBudget:
+                    self._pointBudget = points
+
+        visible = [level for level, voxelSize in enumerate(self.voxelSizes) if voxelSize <= pixelSize * PIXELS_PER_VOXEL]
+        self.level = max(visible[-1], self.levelForPoints(self._pointBudget))
+        return self.level
@@ -1,31 +1,129 @@
 import os
 
-from scaffoldmaker.utils.zinc_utils import *
+import numpy as np
 
 from opencmiss.zinc.graphics import Graphics
 from opencmiss.zinc.glyph import Glyph
 from opencmiss.zinc.element import Element
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.node import Node
-    
+from opencmiss.zinc.result import RESULT_OK
+
+from .ipdata import CHUNK_SIZE, exnodePoints
+from .spatial import PointIndex
+from .lod import LevelsOfDetail
+from .tessellation import LEVELS
+from .trace import traced, fileSize
+
+VALUE_LABELS = [Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2, Node.VALUE_LABEL_D2_DS1DS2]
+
+
+@traced()
+def readNodeParameters(region, fieldName='coordinates'):
+    """Return (ids, versions, values) arrays for all nodes of the field, with the number of versions per
+    node and values[node, version, label, component] for the labels in VALUE_LABELS. Values of versions
+    that a node does not have are NaN.
+    """
+    fieldModule = region.getFieldmodule()
+    field = fieldModule.findFieldByName(fieldName).castFiniteElement()
+    components = field.getNumberOfComponents()
+    nodeSet = fieldModule.findNodesetByName('nodes')
+    nodeTemplate = nodeSet.createNodetemplate()
+    fieldCache = fieldModule.createFieldcache()
+
+    ids = []
+    nodeValues = []
+    iterator = nodeSet.createNodeiterator()
+    node = iterator.next()
+    while node.isValid():
+        fieldCache.setNode(node)
+        nodeTemplate.defineFieldFromNode(field, node)
+        labelValues = []
+        for label in VALUE_LABELS:
+            versionValues = []
+            for version in range(1, nodeTemplate.getValueNumberOfVersions(field, -1, label) + 1):
+                result, values = field.getNodeParameters(fieldCache, -1, label, version, components)
+                versionValues.append(values if result == RESULT_OK else [np.nan] * components)
+            labelValues.append(versionValues)
+        ids.append(node.getIdentifier())
+        nodeValues.append(labelValues)
+        node = iterator.next()
+
+    versions = np.array([max(len(v) for v in labelValues) for labelValues in nodeValues], dtype=np.int32)
+    values = np.full((len(ids), max(versions) if len(ids) else 1, len(VALUE_LABELS), components), np.nan)
+    for i, labelValues in enumerate(nodeValues):
+        for j, versionValues in enumerate(labelValues):
+            if versionValues:
+                values[i, :len(versionValues), j] = versionValues
+    return np.array(ids, dtype=np.int64), versions, values
+
+
+@traced(lambda region, ids, *args, **kwargs: {'nodes': len(ids)})
+def writeNodeParameters(region, ids, versions, values, fieldName='coordinates'):
+    """Set node parameters as returned by readNodeParameters, all at once so graphics are updated only once."""
+    fieldModule = region.getFieldmodule()
+    fieldModule.beginChange()
+    field = fieldModule.findFieldByName(fieldName).castFiniteElement()
+    nodeSet = fieldModule.findNodesetByName('nodes')
+    fieldCache = fieldModule.createFieldcache()
+    for nid, nodeVersions, nodeValues in zip(ids.tolist(), versions.tolist(), values.tolist()):
+        fieldCache.setNode(nodeSet.findNodeByIdentifier(nid))
+        for version in range(nodeVersions):
+            for label, labelValues in zip(VALUE_LABELS, nodeValues[version]):
+                if labelValues[0] == labelValues[0]:  # skip NaN
+                    field.setNodeParameters(fieldCache, -1, label, version + 1, labelValues)
+    fieldModule.endChange()
+
 
 class Model(object):
-    def __init__(self, scene, name):
+    def __init__(self, scene, name, parent=None):
+        """Create the model in a new child region with the given name of parent, the default region if None."""
+        scene.initialize()
         self._context = scene.getContext()
         self._materialModule = self._context.getMaterialmodule()
 
-        defaultRegion = self._context.getDefaultRegion()
-        regionName = defaultRegion.findChildByName(name).getName()
-        if regionName != None:
-            defaultRegion.removeChild(region)
-        self._region = defaultRegion.createChild(name)
+        if parent is None:
+            parent = self._context.getDefaultRegion()
+        region = parent.findChildByName(name)
+        if region.isValid():
+            parent.removeChild(region)
+        self._region = parent.createChild(name)
 
         self._scene = self._region.getScene()
         self._field = None
+        self._refinements = {}  # graphics name => (ids, factors) of the elements, see setTessellations
 
     def setVisibility(self, visible):
         self._scene.setVisibilityFlag(visible)
 
+    @traced()
+    def clear(self):
+        """Remove all elements and nodes from the region, keeping its fields and graphics for reuse."""
+        fieldModule = self._region.getFieldmodule()
+        fieldModule.beginChange()
+        for dimension in [3, 2, 1]:
+            fieldModule.findMeshByDimension(dimension).destroyAllElements()
+        fieldModule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES).destroyAllNodes()
+        fieldModule.endChange()
+        # new elements have no refinement yet
+        self._refinements = {}
+
+    def _graphics(self, name, graphicsType):
+        # graphics are managed by name, so that visualizing again updates them instead of adding more
+        graphics = self._scene.findGraphicsByName(name)
+        if graphics.isValid() and graphics.getType() != graphicsType:
+            self._scene.removeGraphics(graphics)
+            graphics = self._scene.findGraphicsByName(name)
+        if not graphics.isValid():
+            if graphicsType == Graphics.TYPE_POINTS:
+                graphics = self._scene.createGraphicsPoints()
+            elif graphicsType == Graphics.TYPE_LINES:
+                graphics = self._scene.createGraphicsLines()
+            else:
+                graphics = self._scene.createGraphicsSurfaces()
+            graphics.setName(name)
+        return graphics
+
     def setField(self, field):
         self._field = field
 
@@ -40,40 +138,204 @@ class Model(object):
         z = self._field.getNodeParameters(fieldCache, 3, Node.VALUE_LABEL_VALUE, 1, 1)
         return [x[1], y[1], z[1]]
 
+    @traced()
+    def getAllNodeCoordinates(self):
+        """Return the node identifiers and an (N, 3) array of their coordinates, in one pass over the nodes."""
+        fieldModule = self._region.getFieldmodule()
+        nodeSet = fieldModule.findNodesetByName('nodes')
+        fieldCache = fieldModule.createFieldcache()
+        ids = np.empty(nodeSet.getSize(), dtype=np.int64)
+        coords = np.empty((nodeSet.getSize(), 3))
+
+        i = 0
+        iterator = nodeSet.createNodeiterator()
+        node = iterator.next()
+        while node.isValid():
+            fieldCache.setNode(node)
+            ids[i] = node.getIdentifier()
+            coords[i] = self._field.getNodeParameters(fieldCache, -1, Node.VALUE_LABEL_VALUE, 1, 3)[1]
+            i += 1
+            node = iterator.next()
+        return ids, coords
+
+    def setNodeCoordinates(self, ids, coords):
+        """Set the coordinates of existing nodes from a list of identifiers and an (N, 3) array, or of a
+        single node from its identifier and coordinates.
+        """
+        if np.isscalar(ids):
+            ids, coords = [ids], [coords]
+
+        fieldModule = self._region.getFieldmodule()
+        fieldModule.beginChange()
+        nodeSet = fieldModule.findNodesetByName('nodes')
+        fieldCache = fieldModule.createFieldcache()
+        for nid, xyz in zip(np.asarray(ids).tolist(), np.asarray(coords, dtype=float).tolist()):
+            fieldCache.setNode(nodeSet.findNodeByIdentifier(nid))
+            self._field.setNodeParameters(fieldCache, -1, Node.VALUE_LABEL_VALUE, 1, xyz)
+        fieldModule.endChange()
+
+    def getAllNodeParameters(self):
+        """Return the (ids, versions, values) arrays of all Hermite node parameters, see readNodeParameters."""
+        return readNodeParameters(self._region)
+
+    def setAllNodeParameters(self, ids, versions, values):
+        """Change node parameters in place, keeping the graphics that were created for the region."""
+        writeNodeParameters(self._region, ids, versions, values)
+
+    @traced()
     def visualizePoints(self, name, material, size=2):
-        graphics = self._scene.createGraphicsPoints()
+        self._scene.beginChange()
+        graphics = self._graphics(name, Graphics.TYPE_POINTS)
         graphics.setCoordinateField(self._field)
         graphics.setMaterial(self._materialModule.findMaterialByName(material))
-        graphics.setName(name)
         graphics.setFieldDomainType(Field.DOMAIN_TYPE_NODES)
+        graphics.setSubgroupField(Field())
 
         samplingAttr = graphics.getGraphicssamplingattributes()
         samplingAttr.setElementPointSamplingMode(Element.POINT_SAMPLING_MODE_SET_LOCATION)
         samplingAttr.setLocation([0.0])
 
+        pointAttr = graphics.getGraphicspointattributes()
         if size > 0:
             glyph = self._context.getGlyphmodule().findGlyphByGlyphShapeType(Glyph.SHAPE_TYPE_SPHERE)
-            pointAttr = graphics.getGraphicspointattributes()
             pointAttr.setGlyph(glyph)
             pointAttr.setBaseSize([size, size, size])
+        else:
+            pointAttr.setGlyphShapeType(Glyph.SHAPE_TYPE_POINT)
+        self._scene.endChange()
+        return graphics
 
+    @traced()
     def visualizeLines(self, name, material):
-        graphics = self._scene.createGraphicsLines()
+        self._scene.beginChange()
+        graphics = self._graphics(name, Graphics.TYPE_LINES)
         graphics.setCoordinateField(self._field)
         graphics.setMaterial(self._materialModule.findMaterialByName(material))
-        graphics.setName(name)
+        self._scene.endChange()
+        return graphics
 
-    def visualizeSurfaces(self, name, material):
-        graphics = self._scene.createGraphicsSurfaces()
+    @traced()
+    def visualizeSurfaces(self, name, material, dataField=None, spectrum='error'):
+        self._scene.beginChange()
+        graphics = self._graphics(name, Graphics.TYPE_SURFACES)
         graphics.setCoordinateField(self._field)
         graphics.setRenderPolygonMode(Graphics.RENDER_POLYGON_MODE_SHADED)
         graphics.setMaterial(self._materialModule.findMaterialByName(material))
-        graphics.setName(name)
+        self.setDataField(name, dataField, spectrum)
+        self._scene.endChange()
+        return graphics
+
+    def setDataField(self, name, dataField, spectrum='error'):
+        """Color the graphics with the given name by the values of dataField through the named spectrum,
+        or by its material only when dataField is None.
+        """
+        if dataField is None:
+            field = Field()
+        else:
+            field = self._region.getFieldmodule().findFieldByName(dataField)
+        spectrum = self._context.getSpectrummodule().findSpectrumByName(spectrum)
+        # including the copies drawn with adaptive tessellation
+        for graphicsName in [name] + ['%s/%d' % (name, level) for level in LEVELS]:
+            graphics = self._scene.findGraphicsByName(graphicsName)
+            if graphics.isValid():
+                graphics.setDataField(field)
+                if dataField is not None:
+                    graphics.setSpectrum(spectrum)
+
+    @traced()
+    def getElementSamples(self, xi):
+        """Return the ids of the 2D elements and their (E, P, 3) coordinates at the (P, 2) xi locations."""
+        fieldModule = self._region.getFieldmodule()
+        mesh = fieldModule.findMeshByDimension(2)
+        fieldCache = fieldModule.createFieldcache()
+        locations = np.asarray(xi, dtype=float).tolist()
+        ids = []
+        samples = []
+        iterator = mesh.createElementiterator()
+        element = iterator.next()
+        while element.isValid():
+            ids.append(element.getIdentifier())
+            for location in locations:
+                fieldCache.setMeshLocation(element, location)
+                samples.append(self._field.evaluateReal(fieldCache, 3)[1])
+            element = iterator.next()
+        return np.array(ids, dtype=np.int64), np.array(samples).reshape(len(ids), len(locations), 3)
+
+    @traced(lambda self, name, ids, factors: {'elements': len(ids)})
+    def setTessellations(self, name, ids, factors):
+        """Draw the elements of the graphics with the given name with their own refinement factors from LEVELS.
+        Graphics use a single tessellation, so the elements of each level are drawn by a copy of the graphics
+        named name/level that uses the 'refine<level>' tessellation of the scene and the 'refine<level>'
+        field selecting its elements. Both are created once, later calls only set the factors that changed.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        factors = np.asarray(factors, dtype=float)
+        previous = self._refinements.get(name)
+        self._refinements[name] = (ids, factors)
+        if previous is not None and np.array_equal(previous[0], ids):
+            changed = previous[1] != factors
+            if not changed.any():
+                return
+            ids, factors = ids[changed], factors[changed]
+
+        self._scene.beginChange()
+        self.setElementValues('refinement', ids, factors)
+        tessellationModule = self._context.getTessellationmodule()
+
+        graphics = self._scene.findGraphicsByName(name)
+        graphics.setVisibilityFlag(False)
+        for level in LEVELS:
+            copyName = '%s/%d' % (name, level)
+            if self._scene.findGraphicsByName(copyName).isValid():
+                continue
+            copy = self._graphics(copyName, graphics.getType())
+            copy.setCoordinateField(graphics.getCoordinateField())
+            copy.setMaterial(graphics.getMaterial())
+            copy.setRenderPolygonMode(graphics.getRenderPolygonMode())
+            copy.setDataField(graphics.getDataField())
+            copy.setSpectrum(graphics.getSpectrum())
+            copy.setTessellation(tessellationModule.findTessellationByName('refine%d' % level))
+            copy.setSubgroupField(self._refinementField(level))
+        self._scene.endChange()
+
+    def _refinementField(self, level):
+        # selects the elements whose refinement is level, defined once per region
+        fieldModule = self._region.getFieldmodule()
+        field = fieldModule.findFieldByName('refine%d' % level)
+        if not field.isValid():
+            refinement = fieldModule.findFieldByName('refinement')
+            field = fieldModule.createFieldEqualTo(refinement, fieldModule.createFieldConstant([level]))
+            field.setName('refine%d' % level)
+            field.setManaged(True)
+        return field
+
+    @traced(lambda self, fieldName, ids, values: {'elements': len(ids)})
+    def setElementValues(self, fieldName, ids, values):
+        """Set a scalar field that is constant over each 2D element, defining it on the elements first."""
+        fieldModule = self._region.getFieldmodule()
+        fieldModule.beginChange()
+        mesh = fieldModule.findMeshByDimension(2)
+        field = fieldModule.findFieldByName(fieldName).castFiniteElement()
+        if not field.isValid():
+            field = fieldModule.createFieldFiniteElement(1)
+            field.setName(fieldName)
+            field.setManaged(True)
+        elementTemplate = mesh.createElementtemplate()
+        elementTemplate.defineFieldElementConstant(field, -1)
+
+        fieldCache = fieldModule.createFieldcache()
+        for eid, value in zip(np.asarray(ids).tolist(), np.asarray(values, dtype=float).tolist()):
+            element = mesh.findElementByIdentifier(eid)
+            if element.isValid():
+                element.merge(elementTemplate)
+                fieldCache.setElement(element)
+                field.assignReal(fieldCache, value)
+        fieldModule.endChange()
 
 
 class NodeModel(Model):
-    def __init__(self, scene, name):
-        Model.__init__(self, scene, name)
+    def __init__(self, scene, name, parent=None):
+        Model.__init__(self, scene, name, parent)
         
         fieldModule = self._region.getFieldmodule()
         field = fieldModule.createFieldFiniteElement(3)
@@ -85,28 +347,134 @@ class NodeModel(Model):
 
         self.setField(field)
     
-    def setNodeCoordinates(self, nid, coords):
-        node = self._nodeSet.findNodeByIdentifier(nid)
-        if node.getIdentifier() == -1:
-            node = self._nodeSet.createNode(nid, self._nodeTemplate)
+    def setNodeCoordinates(self, ids, coords):
+        """Like Model.setNodeCoordinates, but nodes that do not exist yet are created."""
+        if np.isscalar(ids):
+            ids, coords = [ids], [coords]
 
         fieldModule = self._region.getFieldmodule()
-        fieldCache = fieldModule.createFieldcache()
-        fieldCache.setNode(node)
-        self._field.setNodeParameters(fieldCache, 1, Node.VALUE_LABEL_VALUE, 1, coords[0])
-        self._field.setNodeParameters(fieldCache, 2, Node.VALUE_LABEL_VALUE, 1, coords[1])
-        self._field.setNodeParameters(fieldCache, 3, Node.VALUE_LABEL_VALUE, 1, coords[2])
-        
+        fieldModule.beginChange()
+        for nid in np.asarray(ids).tolist():
+            if not self._nodeSet.findNodeByIdentifier(nid).isValid():
+                self._nodeSet.createNode(nid, self._nodeTemplate)
+        Model.setNodeCoordinates(self, ids, coords)
+        fieldModule.endChange()
+
 
 class FileModel(Model):
-    def __init__(self, scene, name):
-        Model.__init__(self, scene, name)
+    def __init__(self, scene, name, parent=None):
+        Model.__init__(self, scene, name, parent)
+        self._pointIndex = None
+        self._levels = None
+        self._levelField = None
+        self._visibleField = None
 
+    def getPointIndex(self):
+        """Return a PointIndex over the node coordinates, which is only rebuilt after the nodes changed."""
+        if self._pointIndex is None:
+            ids, coords = self.getAllNodeCoordinates()
+            self._pointIndex = PointIndex(coords, ids)
+        return self._pointIndex
+
+    def setNodeCoordinates(self, ids, coords):
+        Model.setNodeCoordinates(self, ids, coords)
+        self._pointIndex = None
+
+    def getLevelsOfDetail(self):
+        """Return the LevelsOfDetail of the points loaded with loadPoints, or None if there is only one level."""
+        return self._levels
+
+    def setLevelOfDetail(self, level):
+        """Only draw the points of the given level in point graphics created after loadPoints. Return whether
+        the level changed, only then the graphics change and the scene is redrawn.
+        """
+        if self._levelField is None or level == self._level:
+            return False
+        self._level = level
+        fieldModule = self._region.getFieldmodule()
+        self._levelField.assignReal(fieldModule.createFieldcache(), [level - 0.5])
+        return True
+
+    @traced(lambda self, ids, coords: {'points': len(coords)})
+    def loadPoints(self, ids, coords):
+        """Create one node per data point with the coordinates given as an (N, 3) array. Large clouds get
+        levels of detail, stored as the rank of each node in a 'lod' field. The nodes are read in bulk from
+        EX format in memory, see exnodePoints in the ipdata module.
+        """
+        fieldModule = self._region.getFieldmodule()
+        fieldModule.beginChange()
+        self.clear()
+
+        field = fieldModule.findFieldByName('coordinates').castFiniteElement()
+        if not field.isValid():
+            field = fieldModule.createFieldFiniteElement(3)
+            field.setName('coordinates')
+            field.setManaged(True)
+            field.setTypeCoordinate(True)
+        self.setField(field)
+
+        ids = np.asarray(ids)
+        if len(np.unique(ids)) != len(ids):
+            ids = np.arange(1, len(coords) + 1)
+
+        levels = LevelsOfDetail(coords)
+        self._levels = levels if len(levels.counts) > 1 else None
+
+        if self._levels is not None:
+            rankField = fieldModule.findFieldByName('lod').castFiniteElement()
+            if not rankField.isValid():
+                rankField = fieldModule.createFieldFiniteElement(1)
+                rankField.setName('lod')
+                rankField.setManaged(True)
+
+        # the nodes are read from EX format in memory a chunk at a time, instead of created one by one
+        for i in range(0, len(ids), CHUNK_SIZE):
+            ranks = self._levels.ranks[i:i + CHUNK_SIZE] if self._levels is not None else None
+            streamInfo = self._region.createStreaminformationRegion()
+            streamInfo.createStreamresourceMemoryBuffer(exnodePoints(ids[i:i + CHUNK_SIZE], coords[i:i + CHUNK_SIZE], ranks))
+            self._region.read(streamInfo)
+
+        # points are drawn where their rank is at least the current level, which is a constant that can
+        # be reassigned, so switching levels does not create new graphics
+        self._levelField = None
+        self._visibleField = None
+        if self._levels is not None:
+            self._level = 0
+            self._levelField = fieldModule.createFieldConstant([-0.5])
+            self._visibleField = fieldModule.createFieldGreaterThan(rankField, self._levelField)
+
+        fieldModule.endChange()
+        self._pointIndex = PointIndex(coords, ids)
+
+    def visualizePoints(self, name, material, size=2):
+        graphics = Model.visualizePoints(self, name, material, size)
+        if self._visibleField is not None:
+            graphics.setSubgroupField(self._visibleField)
+        return graphics
+
+    @traced(lambda self, ex1, ex2=None: {'bytes': fileSize(ex1) + fileSize(ex2)})
     def load(self, ex1, ex2=None):
+        self.clear()
         self._region.readFile(ex1)
         if ex2 != None:
             self._region.readFile(ex2)
+        self._loaded()
+
+    @traced(lambda self, *buffers: {'bytes': sum(len(buffer) for buffer in buffers)})
+    def loadBuffers(self, *buffers):
+        """Read EX format file contents from memory instead of from disk."""
+        self.clear()
+        streamInfo = self._region.createStreaminformationRegion()
+        for buffer in buffers:
+            streamInfo.createStreamresourceMemoryBuffer(buffer)
+        self._region.read(streamInfo)
+        self._loaded()
 
+    def _loaded(self):
+        self._pointIndex = None
+        self._levels = None
+        self._levelField = None
+        self._visibleField = None
         fieldModule = self._region.getFieldmodule()
         field = fieldModule.findFieldByName('coordinates').castFiniteElement()
         self.setField(field)
@@ -0,0 +1,191 @@
+import os
+import json
+
+import numpy as np
+
+from .alignment import LANDMARK_DIRECTIONS, alignMesh
+from .hermite import HermiteMesh
+from .ipdata import CHUNK_SIZE, iterIpdata, readIpdata, writeIpdata
+from .spatial import PointIndex
+from .trace import traced, stage, fileSize
+
+LANDMARK_MARGIN = 5.0  # mm beyond the landmarks that points are kept when cropping to them
+DUPLICATE_VOXEL = 0.0  # voxel size in mm within which points are duplicates, 0 removes exact duplicates only
+NEIGHBOURS = 8  # neighbours of which the mean distance decides whether a point is an outlier, 0 disables it
+STD_RATIO = 6.0  # standard deviations above the mean neighbour distance beyond which a point is an outlier
+FILTERS = ['cropped', 'duplicates', 'outliers']  # counts reported by cleanIpdata besides points and kept
+
+
+def boxPlanes(lower, upper):
+    """Return the (normal, offset) half-spaces normal . x <= offset of the box between lower and upper."""
+    planes = []
+    for axis in range(3):
+        normal = [0.0, 0.0, 0.0]
+        normal[axis] = 1.0
+        planes.append((list(normal), float(upper[axis])))
+        normal[axis] = -1.0
+        planes.append((list(normal), -float(lower[axis])))
+    return planes
+
+
+def landmarkPlanes(landmarks, margin=LANDMARK_MARGIN, mirror=False):
+    """Return the half-spaces that keep the points no further than margin beyond each of the {name: coords}
+    landmarks in its direction, see LANDMARK_DIRECTIONS in the alignment module: nothing above the apex,
+    below the base, beyond the lateral side or in front of the ventral landmark.
+    """
+    planes = []
+    for name, coords in sorted(landmarks.items()):
+        normal = np.array(LANDMARK_DIRECTIONS[name])
+        if mirror and name == 'lateral':
+            normal = -normal
+        planes.append((normal.tolist(), float(normal.dot(coords) + margin)))
+    return planes
+
+
+def _voxelKeys(coords, voxelSize):
+    # one fixed-size key per point that is equal for points in the same voxel, or with the same coordinates
+    if voxelSize > 0.0:
+        cells = np.floor(coords / voxelSize).astype(np.int64)
+    else:
+        # adding 0.0 turns -0.0 into 0.0, which have different bits
+        cells = (np.ascontiguousarray(coords, dtype=np.float64) + 0.0).view(np.int64)
+    return np.ascontiguousarray(cells).view('V24').ravel()
+
+
+@traced(lambda coords, *args, **kwargs: {'points': len(coords)})
+def outlierMask(coords, neighbours=NEIGHBOURS, stdRatio=STD_RATIO, chunkSize=CHUNK_SIZE):
+    """Return a mask of the points whose mean distance to their nearest neighbours is more than stdRatio
+    standard deviations above the mean of all points, queried in chunks of the (N, 3) coords. The KD-tree
+    covers all coords, so its memory grows with their number. Sparse edges of a cloud have larger distances
+    too, the default stdRatio only drops points far from the rest.
+    """
+    if neighbours < 1 or len(coords) <= neighbours:
+        return np.zeros(len(coords), dtype=bool)
+    index = PointIndex(coords)
+    distances = np.empty(len(coords))
+    for i in range(0, len(coords), chunkSize):
+        # the nearest neighbour of every point is the point itself
+        chunkDistances, _ = index.nearest(coords[i:i + chunkSize], neighbours + 1)
+        distances[i:i + chunkSize] = chunkDistances[:, 1:].mean(axis=1)
+    return distances > distances.mean() + stdRatio * distances.std()
+
+
+@traced(lambda ipdata, *args, **kwargs: {'bytes': fileSize(ipdata)})
+def cleanIpdata(ipdata, output, planes=None, voxelSize=DUPLICATE_VOXEL, neighbours=NEIGHBOURS, stdRatio=STD_RATIO,
+                chunkSize=CHUNK_SIZE):
+    """Write the points of ipdata that pass the filters to output and return the number of points read,
+    dropped by each of the FILTERS and kept. The file is read chunkSize points at a time:
+
+    - cropped: points outside any of the (normal, offset) planes, see boxPlanes and landmarkPlanes
+    - duplicates: all but the first point in every voxel of voxelSize, or with the same coordinates when it
+      is 0, also across chunks, None keeps them
+    - outliers: see outlierMask, which needs the coordinates of the points that passed the other filters
+
+    Cropping and deduplication hold only a chunk and the voxels seen so far in memory. The points that pass
+    them are kept in memory for the outlier filter, which builds a KD-tree over all of them, so memory grows
+    with the points kept rather than the size of the file. A voxelSize bounds them by the volume of the cloud.
+    """
+    counts = dict((name, 0) for name in ['points'] + FILTERS + ['kept'])
+    seen = None
+    ids = []
+    coords = []
+    with stage('crop and deduplicate'):
+        for chunkIds, chunkCoords in iterIpdata(ipdata, chunkSize):
+            counts['points'] += len(chunkIds)
+            if planes:
+                normals = np.array([normal for normal, _ in planes])
+                offsets = np.array([offset for _, offset in planes])
+                inside = np.all(chunkCoords.dot(normals.T) <= offsets, axis=1)
+                counts['cropped'] += len(inside) - np.count_nonzero(inside)
+                chunkIds, chunkCoords = chunkIds[inside], chunkCoords[inside]
+
+            if voxelSize is not None and len(chunkIds):
+                keys = _voxelKeys(chunkCoords, voxelSize)
+                keys, first = np.unique(keys, return_index=True)
+                if seen is not None:
+                    new = ~np.isin(keys, seen, assume_unique=True)
+                    keys, first = keys[new], first[new]
+                    seen = np.concatenate([seen, keys])
+                else:
+                    seen = keys
+                first.sort()
+                counts['duplicates'] += len(chunkIds) - len(first)
+                chunkIds, chunkCoords = chunkIds[first], chunkCoords[first]
+
+            ids.append(chunkIds)
+            coords.append(chunkCoords)
+    seen = None
+
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    coords = np.concatenate(coords) if coords else np.zeros((0, 3))
+    outliers = outlierMask(coords, neighbours, stdRatio, chunkSize)
+    counts['outliers'] = int(np.count_nonzero(outliers))
+    counts['kept'] = len(ids) - counts['outliers']
+    writeIpdata(output, ids[~outliers], coords[~outliers], 'cleaned %s' % os.path.basename(ipdata), chunkSize)
+    return dict((name, int(count)) for name, count in counts.items())
+
+
+def cachedCleanIpdata(cache, ipdata, **options):
+    """Return the filename of the cleaned ipdata in the Cache and the counts of cleanIpdata, which is only
+    run when the same file was not cleaned with the same options before.
+    """
+    # part of the key, clouds cleaned with an earlier default are not reused
+    options.setdefault('stdRatio', STD_RATIO)
+
+    def fill(path):
+        counts = cleanIpdata(ipdata, os.path.join(path, 'data.ipdata'), **options)
+        with open(os.path.join(path, 'counts.json'), 'w') as f:
+            json.dump(counts, f)
+
+    path = cache.get(cache.key([ipdata], 'cleaned', sorted(options.items())), fill)
+    with open(os.path.join(path, 'counts.json'), 'r') as f:
+        return os.path.join(path, 'data.ipdata'), json.load(f)
+
+
+def formatCounts(counts):
+    return '%d of %d points kept, dropped %s' % (counts['kept'], counts['points'],
+                                                ', '.join('%d %s' % (counts[name], name) for name in FILTERS))
+
+
+@traced(lambda cache, lobe, *args, **kwargs: {'lobe': lobe})
+def prepareInputs(cache, lobe, ipdata, ipnode, ipelem, landmarks=(), clean=False, transform=None, icp=False):
+    """Return the (ipdata, ipnode) to fit the lobe named lobe from. The data cloud is cleaned when clean is
+    True, cropped to the {name: coords} landmarks when there are any, and the template is aligned to the
+    landmarks with the transform unless it is None, refined against the data cloud with ICP when icp is True,
+    see alignMesh. Both are kept in the Cache. Runs in the worker that fits the lobe, so that all lobes are
+    cleaned and aligned at the same time.
+    """
+    mirror = lobe.startswith('R')
+    landmarks = sorted(landmarks)
+    if clean:
+        planes = landmarkPlanes(dict(landmarks), mirror=mirror) if landmarks else None
+        ipdata, counts = cachedCleanIpdata(cache, ipdata, planes=planes)
+        print('Cleaned the data cloud of lobe %s: %s' % (lobe, formatCounts(counts)))
+    if transform is None or not landmarks:
+        return ipdata, ipnode
+
+    def parse(path):
+        readIpdata(ipdata, mmapFilename=os.path.join(path, 'data'))
+
+    def fill(path):
+        mesh = HermiteMesh.read(ipnode, ipelem)
+        index = None
+        if icp:
+            _, coords = readIpdata(ipdata, mmapFilename=os.path.join(cache.get(cache.key([ipdata]), parse), 'data'))
+            index = PointIndex(coords)
+        report = alignMesh(mesh, dict(landmarks), index, transform, mirror=mirror)
+        with open(os.path.join(path, 'aligned.ipnode'), 'w') as f:
+            f.write(mesh.writeIpnode('%s aligned to %s' % (os.path.basename(ipnode), ', '.join(dict(landmarks)))))
+        with open(os.path.join(path, 'alignment.json'), 'w') as f:
+            json.dump(report, f)
+
+    # the data cloud only changes the alignment with ICP
+    path = cache.get(cache.key([ipdata, ipnode, ipelem] if icp else [ipnode, ipelem], 'aligned', transform, icp, landmarks), fill)
+    with open(os.path.join(path, 'alignment.json'), 'r') as f:
+        report = json.load(f)
+    print('Aligned the template of lobe %s with a %s transform: landmark RMS distance %.3g -> %.3g' %
+          (lobe, transform, report['landmarkRmsBefore'], report['landmarkRms']))
+    if icp:
+        print('ICP refinement of lobe %s in %d iterations: RMS distance to the data cloud %.3g -> %.3g' %
+              (lobe, report['icpIterations'], report['dataRmsBefore'], report['dataRms']))
+    return ipdata, os.path.join(path, 'aligned.ipnode')
@@ -0,0 +1,182 @@
+import math
+import time
+
+import numpy as np
+
+from .trace import traced
+
+CONVERGED = 0.01  # relative distance to the final RMS error within which a fit counts as converged
+TOLERANCE = 1e-3  # relative improvement of the RMS error per iteration below which a fit can stop early
+
+
+def convergedIteration(rms, tolerance=CONVERGED):
+    """Return the first iteration, counting from 1, of which the RMS error in the list rms of all iterations
+    is within tolerance of the final one, which measures how many iterations a fit needed.
+    """
+    final = rms[-1]
+    return next(i for i, value in enumerate(rms, 1) if value <= final * (1.0 + tolerance))
+
+
+class Convergence(object):
+    """Decides when a fit can stop before it ran all of its iterations: once an iteration improves the RMS
+    error by less than tolerance relative to the previous one while no node moved further than tolerance
+    times the size of the mesh, or once timeBudget seconds have passed since start. The fitting engines
+    call start before the first iteration, restart at the start of every stage of a schedule, as the
+    error of a stage is measured on other data, and update after every iteration.
+    """
+    def __init__(self, tolerance=TOLERANCE, timeBudget=None):
+        self.tolerance = tolerance
+        self.timeBudget = timeBudget
+        self._start = None
+        self._updates = []
+        self.restart()
+
+    def key(self):
+        return (self.tolerance, self.timeBudget)
+
+    def start(self):
+        self._start = time.time()
+        self._updates = []  # time of every update, over all stages
+
+    def secondsPerIteration(self):
+        """Return the mean seconds of the iterations so far, leaving out the first, which also measured
+        the initial error, when there are more.
+        """
+        if len(self._updates) > 1:
+            return (self._updates[-1] - self._updates[0]) / (len(self._updates) - 1)
+        return self._updates[-1] - self._start if self._updates else 0.0
+
+    def restart(self):
+        self._rms = None
+        self._coords = None
+        self.improvement = None
+        self.displacement = None
+
+    def update(self, rms, coords):
+        """Record the RMS error and the coordinates of the nodes, in any shape ending in 3 with NaN for
+        missing versions, after an iteration. Return 'time budget' when the fit should stop, 'converged'
+        when the stage has converged and None to continue.
+        """
+        # copied, the engines update the node values in place
+        coords = np.array(coords, dtype=float).reshape(-1, 3)
+        if self._rms is not None:
+            self.improvement = (self._rms - rms) / self._rms if self._rms > 0.0 else 0.0
+            moved = np.sqrt(np.sum((coords - self._coords) ** 2, axis=1))
+            self.displacement = float(np.nanmax(moved)) if np.any(~np.isnan(moved)) else 0.0
+        self._rms, self._coords = rms, coords
+        self._updates.append(time.time())
+
+        if self.timeBudget and time.time() - self._start >= self.timeBudget:
+            return 'time budget'
+        if self.improvement is not None and self.improvement < self.tolerance:
+            size = np.nanmax(coords, axis=0) - np.nanmin(coords, axis=0) if len(coords) else np.zeros(3)
+            if self.displacement <= self.tolerance * np.sqrt(np.sum(size ** 2)):
+                return 'converged'
+        return None
+
+
+def stoppedEarly(progress):
+    """Return the reason a fit stopped before running all of its iterations, the iterations it ran and
+    planned and an estimate of the seconds saved, from its last progress, or None when it ran all of them.
+    """
+    if not progress or len(progress) < 6 or not progress[5]:
+        return None
+    iteration, iterations = progress[:2]
+    reason, seconds = progress[5]
+    return reason, iteration, iterations, seconds * (iterations - iteration)
+
+
+def runStages(stages, startStage, iterate, progress=None, convergence=None):
+    """Run the (fraction, iterations) stages of a fit one iteration at a time, as both fitting engines do when
+    they measure their iterations. startStage(fraction) prepares a stage and returns the FitError that measures
+    it, iterate(error) runs one iteration that changes the node values of error.mesh. Progress is reported
+    after every iteration, see fitGeometry in the fitting module, and with a Convergence stages stop once they
+    converged and the fit once its time budget ran out. Return the reason the fit stopped early or None.
+    """
+    total = sum(count for _, count in stages)
+    if convergence is not None:
+        convergence.start()
+    iteration = 0
+    stopped = None
+    for fraction, count in stages:
+        error = startStage(fraction)
+        if convergence is not None:
+            convergence.restart()
+        for _ in range(count):
+            iteration += 1
+            iterate(error)
+            error.update()
+            stop = convergence.update(error.rms(), error.mesh.values[:, :, :, 0]) if convergence is not None else None
+            if progress is not None:
+                last = (iteration, total, error.rms(), error.mesh.nodeParameters(), error.elementErrors())
+                progress(*last + (None,))
+            if stop:
+                stopped = stop
+                break
+        if stopped == 'time budget':
+            break
+    # the last progress tells why the fit ran fewer iterations than planned
+    if progress is not None and stopped and iteration < total:
+        progress(*last + ((stopped, convergence.secondsPerIteration()),))
+    return stopped
+
+
+class FitError(object):
+    """Squared distances of data points to their nearest location on a HermiteMesh, per element and
+    overall. When node values of the mesh change, update only reprojects the points that can be
+    affected: those nearest to an element using a changed node, and those that such an element may now
+    be closer to than their current nearest location.
+    """
+    def __init__(self, mesh, coords, projector):
+        self.mesh = mesh
+        self.coords = coords
+        self._projector = projector
+        self._values = mesh.values.copy()
+        self.elements, self.xi, self.distances = projector.project(mesh, coords)
+
+    @traced()
+    def update(self, ids=None, versions=None, values=None):
+        """Update the distances after the node values of the mesh changed, setting them first from node
+        parameters as returned by readNodeParameters when given. Return the indices of the elements of
+        which the errors changed.
+        """
+        if ids is not None:
+            self.mesh.setNodeParameters(ids, versions, values)
+        old, new = self._values, self.mesh.values
+        changed = np.any((old != new) & ~(np.isnan(old) & np.isnan(new)), axis=(1, 2, 3))
+        self._values = new.copy()
+        affected = np.flatnonzero(np.any(changed[self.mesh.elementNodes], axis=1))
+        if len(affected) == len(self.mesh.elementIds):
+            self.elements, self.xi, self.distances = self._projector.project(self.mesh, self.coords)
+            return affected
+        if len(affected) == 0:
+            return affected
+
+        # points on changed elements can now be nearest to any element
+        points = np.flatnonzero(np.isin(self.elements, affected))
+        moved = [self.elements[points]]
+        self.elements[points], self.xi[points], self.distances[points] = self._projector.project(self.mesh, self.coords[points])
+
+        # other points can only move onto a changed element
+        others = np.flatnonzero(~np.isin(self.elements, affected))
+        others = others[self._projector.near(self.mesh, self.coords[others], np.sqrt(self.distances[others]), affected)]
+        elements, xi, distances = self._projector.project(self.mesh, self.coords[others], affected)
+        closer = distances < self.distances[others]
+        others = others[closer]
+        moved.append(self.elements[others])
+        self.elements[others], self.xi[others], self.distances[others] = elements[closer], xi[closer], distances[closer]
+        return np.union1d(affected, np.concatenate(moved))
+
+    def rms(self):
+        return math.sqrt(np.mean(self.distances)) if len(self.distances) else 0.0
+
+    def elementErrors(self):
+        """Return the element ids with the RMS and maximum distance of the points nearest to each of them,
+        which are zero for elements without points.
+        """
+        count = len(self.mesh.elementIds)
+        points = np.bincount(self.elements, minlength=count)
+        rms = np.sqrt(np.bincount(self.elements, self.distances, count) / np.maximum(points, 1))
+        maximum = np.zeros(count)
+        np.maximum.at(maximum, self.elements, self.distances)
+        return self.mesh.elementIds, rms, np.sqrt(maximum)
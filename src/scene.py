@@ -1,13 +1,14 @@
 from opencmiss.zinc.context import Context
 from opencmiss.zinc.material import Material
-
-from .model import Model
+from opencmiss.zinc.spectrum import Spectrumcomponent
 
 class Scene(object):
-
+    """The Zinc context of the GUI. Its tessellations, materials, spectrum and glyphs are set up by
+    initialize, which is left until after the window is shown to let it appear sooner.
+    """
     def __init__(self):
         self._context = Context("Scene")
-        self._initialize()
+        self._initialized = False
 
     def getContext(self):
         return self._context
@@ -15,9 +16,45 @@ class Scene(object):
     def getScene(self):
         return self._context.getDefaultRegion().getScene()
 
-    def _initialize(self):
-        tess = self._context.getTessellationmodule().getDefaultTessellation()
-        tess.setRefinementFactors(12)
+    def setSpectrumRange(self, name, minimum, maximum):
+        self.initialize()
+        component = self._context.getSpectrummodule().findSpectrumByName(name).getFirstSpectrumcomponent()
+        component.setRangeMinimum(minimum)
+        component.setRangeMaximum(maximum)
+
+    def setInteracting(self, interacting):
+        """Draw all elements coarsely while the view is moving, and at their own refinement again after."""
+        from .tessellation import LEVELS, DEFAULT_REFINEMENT, COARSE
+
+        self.initialize()
+        tessellationModule = self._context.getTessellationmodule()
+        tessellationModule.beginChange()
+        tessellationModule.getDefaultTessellation().setRefinementFactors(COARSE if interacting else DEFAULT_REFINEMENT)
+        for level in LEVELS:
+            tess = tessellationModule.findTessellationByName('refine%d' % level)
+            tess.setRefinementFactors(min(level, COARSE) if interacting else level)
+        tessellationModule.endChange()
+
+    def initialize(self):
+        """Define the tessellations, materials, spectrum and glyphs that graphics refer to by name, once. Models
+        call this when they are created.
+        """
+        # the tessellation module imports NumPy, which is not needed until the window is shown
+        from .tessellation import LEVELS, DEFAULT_REFINEMENT
+
+        if self._initialized:
+            return
+        self._initialized = True
+        tessellationModule = self._context.getTessellationmodule()
+        tess = tessellationModule.getDefaultTessellation()
+        tess.setRefinementFactors(DEFAULT_REFINEMENT)
+
+        # one tessellation per refinement level of adaptively tessellated graphics, see Model.setTessellations
+        for level in LEVELS:
+            tess = tessellationModule.createTessellation()
+            tess.setName('refine%d' % level)
+            tess.setManaged(True)
+            tess.setRefinementFactors(level)
 
         self._materialModule = self._context.getMaterialmodule()
         self._materialModule.defineStandardMaterials()
@@ -51,6 +88,16 @@ class Scene(object):
         material.setAttributeReal(Material.ATTRIBUTE_ALPHA, 1.0)
         material.setAttributeReal(Material.ATTRIBUTE_SHININESS, 0.2)
 
+        # blue for small and red for large fit errors
+        spectrum = self._context.getSpectrummodule().createSpectrum()
+        spectrum.setName('error')
+        spectrum.setManaged(True)
+        component = spectrum.createSpectrumcomponent()
+        component.setColourMappingType(Spectrumcomponent.COLOUR_MAPPING_TYPE_RAINBOW)
+        component.setColourReverse(True)
+        component.setRangeMinimum(0.0)
+        component.setRangeMaximum(1.0)
+
         glyphmodule = self._context.getGlyphmodule()
         glyphmodule.defineStandardGlyphs()
 
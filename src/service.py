@@ -0,0 +1,602 @@
+import os
+import sys
+import json
+import stat
+import time
+import base64
+import heapq
+import shutil
+import socket
+import struct
+import getpass
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from multiprocessing.reduction import send_handle, recv_handle
+
+import numpy as np
+
+from .fitting import ENGINES, schedule, writeBuffers
+from .worker import POLL_INTERVAL, Worker, WorkerProcess
+
+# every user has a service of their own by default. It listens on a UNIX socket in a directory only its owner
+# can enter, or on a named pipe on Windows, and clients authenticate with a secret stored next to it
+if sys.platform == 'win32':
+    DEFAULT_ADDRESS = r'\\.\pipe\lung_fitting-%s' % getpass.getuser()
+    SHARED_ADDRESS = None
+else:
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), 'lung_fitting-%s' % getpass.getuser(), 'service.sock')
+    # a service shared by all users of the workstation, which it tells apart by the credentials of their connections
+    SHARED_ADDRESS = os.path.join(tempfile.gettempdir(), 'lung_fitting-shared', 'service.sock')
+ADDRESS = os.environ.get('LUNG_FITTING_SERVICE', DEFAULT_ADDRESS)
+MAX_REQUEST = 1024 * 1024  # bytes of a request the service reads at most
+
+INPUTS = ['ipdata', 'ipnode', 'ipelem', 'ipmap']
+JOB_FIELDS = INPUTS + ['iterations', 'engine', 'convergence']
+
+
+def _uid():
+    return os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+
+
+def _pipe(address):
+    return address.startswith('\\\\')
+
+
+def _secretFile(address):
+    if _pipe(address):
+        # the temporary directory is private to the user on Windows
+        return os.path.join(tempfile.gettempdir(), '%s.key' % address.rsplit('\\', 1)[-1])
+    return os.path.join(os.path.dirname(address), 'authkey')
+
+
+def _checkDirectory(path, shared):
+    """Raise PermissionError unless path is a directory of this user that nobody else can write to, or,
+    unless it is shared, enter.
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & (0o022 if shared else 0o077):
+        raise PermissionError('%s is not a directory of %s closed to other users' % (path, getpass.getuser()))
+
+
+def _authkey(address):
+    """Return the secret of the service at address, or None for a shared service."""
+    filename = _secretFile(address)
+    if not _pipe(address):
+        if not os.path.exists(filename):
+            return None
+        _checkDirectory(os.path.dirname(address), False)
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def _encode(value):
+    # messages are JSON, with arrays and bytes as base64
+    if isinstance(value, np.ndarray):
+        return {'__array__': base64.b64encode(np.ascontiguousarray(value).tobytes()).decode('ascii'),
+                'dtype': value.dtype.str, 'shape': list(value.shape)}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return dict((key, _encode(item)) for key, item in value.items())
+    if isinstance(value, (tuple, list)):
+        return [_encode(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        if '__array__' in value:
+            try:
+                dtype = np.dtype(value['dtype'])
+            except TypeError:
+                raise ValueError('unexpected array type %r' % (value['dtype'],))
+            if dtype.kind not in 'biuf':
+                raise ValueError('unexpected array of type %s' % dtype)
+            try:
+                return np.frombuffer(base64.b64decode(value['__array__']), dtype).reshape(value['shape']).copy()
+            except TypeError as e:
+                raise ValueError('invalid array: %s' % e)
+        return dict((key, _decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_decode(item) for item in value)
+    return value
+
+
+def _send(connection, message):
+    connection.send_bytes(json.dumps(_encode(message)).encode())
+
+
+def _recv(connection, maxlength=None):
+    return _decode(json.loads(connection.recv_bytes(maxlength).decode()))
+
+
+def _peer(connection):
+    """Return the user id of the process at the other end of a UNIX socket connection."""
+    with socket.fromfd(connection.fileno(), socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        credentials = s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def _userName(uid):
+    try:
+        import pwd
+        return pwd.getpwuid(uid).pw_name
+    except (ImportError, KeyError, TypeError):
+        return str(uid)
+
+
+def _checkJob(job, priority, files=True):
+    """Raise ValueError unless job is a fit with the JOB_FIELDS and priority is a number. Unless files is False,
+    for a shared service that receives the input files as descriptors, they must exist.
+    """
+    if not isinstance(job, dict) or sorted(job) != sorted(JOB_FIELDS):
+        raise ValueError('a job has the fields %s' % ', '.join(JOB_FIELDS))
+    for name in INPUTS:
+        if not isinstance(job[name], str) or not os.path.isabs(job[name]):
+            raise ValueError('%s must be an absolute path' % name)
+        if files and not os.path.isfile(job[name]):
+            raise ValueError('%s %s is not a file' % (name, job[name]))
+    try:
+        stages = [(float(fraction), int(count)) for fraction, count in job['iterations']]
+    except (TypeError, ValueError):
+        raise ValueError('iterations must be a list of (fraction, iterations) stages')
+    if not stages or any(not 0.0 < fraction <= 1.0 or count < 1 for fraction, count in stages):
+        raise ValueError('invalid fitting schedule')
+    if job['engine'] not in ENGINES:
+        raise ValueError('unknown fitting engine %s' % job['engine'])
+    convergence = job['convergence']
+    if convergence is not None and (len(convergence) != 2 or not all(
+            value is None or isinstance(value, (int, float)) and value >= 0.0 for value in convergence)):
+        raise ValueError('convergence must be a tolerance and a time budget')
+    if not isinstance(priority, int):
+        raise ValueError('priority must be an integer')
+
+
+def _copyInputs(job, handles):
+    """Copy the input files that a client of a shared service sent as open file descriptors into a private
+    directory, and return it. The client opened them, so it could read them. The descriptors are closed.
+    """
+    handles = list(handles)
+    scratch = tempfile.mkdtemp(prefix='lung_fitting_job')
+    try:
+        for name in INPUTS:
+            with os.fdopen(handles.pop(0), 'rb') as source:
+                if not stat.S_ISREG(os.fstat(source.fileno()).st_mode):
+                    raise ValueError('%s is not a file' % job[name])
+                filename = os.path.join(scratch, 'input.' + name)
+                with open(filename, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            job[name] = filename
+    except Exception:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    finally:
+        for handle in handles:
+            os.close(handle)
+    return scratch
+
+
+def _warm():
+    """Import the fitting engines in a worker process, so that the first job does not wait for them."""
+    from . import fitting, solver, quality
+    try:
+        import aether.geometry
+        import aether.exports
+        import aether.surface_fitting
+    except ImportError:
+        pass
+
+
+def _fit(job, progress=None):
+    from .fitting import fitSurface
+    from .quality import Convergence
+    convergence = Convergence(*job['convergence']) if job['convergence'] is not None else None
+    return fitSurface(*[job[name] for name in INPUTS] + [job['iterations'], None, job['engine'], convergence],
+                      progress=progress)
+
+
+class Job(object):
+    """A fit submitted to the FittingService, with the JOB_FIELDS of a submit request. The status is 'queued',
+    'running' or one of the final statuses of a Worker.
+    """
+    def __init__(self, jobId, job, priority, uid, name, scratch=None):
+        self.id = jobId
+        self.job = job
+        self.priority = priority
+        self.uid = uid
+        self.user = _userName(uid)
+        self.name = name  # of the data cloud, as submitted
+        self.scratch = scratch  # the copied input files of a shared service
+        self.status = 'queued'
+        self.progress = None
+        self.result = None
+        self.task = None
+        self.watchers = []
+
+    def summary(self):
+        iteration = '%d/%d' % tuple(self.progress[:2]) if self.progress else ''
+        return (self.id, self.user, self.priority, self.status, iteration, self.name)
+
+
+class _Connection(object):
+    # a client connection that the scheduler and the thread serving the client both send to
+    def __init__(self, connection, uid):
+        self._connection = connection
+        self._lock = threading.Lock()
+        self.uid = uid
+        self.closed = False
+
+    def recv(self):
+        return _recv(self._connection, MAX_REQUEST)
+
+    def receiveHandle(self):
+        return recv_handle(self._connection)
+
+    def send(self, message):
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                _send(self._connection, message)
+            except (OSError, EOFError):
+                self.closed = True
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._connection.close()
+
+
+class FittingService(object):
+    """Runs fit jobs submitted over a local socket in a pool of persistent worker processes that have the
+    fitting engines imported already. Jobs are started by priority, highest first and in order of submission
+    within a priority. Clients that watch a job receive its progress and result as they come in, the service
+    never writes files for them.
+
+    By default only the user running the service can connect: its socket is in a directory closed to other
+    users and clients authenticate with a secret stored there. A shared service accepts all users of the
+    workstation and identifies them by the credentials of their connection, which needs Linux. Its clients
+    send their input files as open file descriptors, so that a job can only fit files its user can read.
+    Users can only watch and cancel their own jobs, and only the owner of the service can shut it down.
+
+    Requests and answers are JSON lists, answers are (kind, job id, value):
+
+    - ('submit', job, priority, watch): queue a fit with the JOB_FIELDS, answered with ('submitted', id, None),
+      clients of a shared service then send the file descriptors of the INPUTS
+    - ('watch', id): stream ('queued' or 'running', id, None), ('progress', id, progress) and finally
+      (status, id, result) of the job
+    - ('cancel', id): cancel a queued or running job, answered with (status, id, None)
+    - ('jobs',): answered with ('jobs', None, [Job.summary() of every job that has not finished yet])
+    - ('shutdown',): stop the service after cancelling all jobs, answered with ('stopping', None, None)
+
+    Every connection starts with ('hello', None, {'shared': shared}) from the service, and invalid requests
+    are answered with ('error', id, message).
+    """
+    def __init__(self, address=ADDRESS, processes=None, shared=False):
+        if shared and not hasattr(socket, 'SO_PEERCRED'):
+            raise ValueError('a shared fitting service needs the peer credentials of Linux UNIX sockets')
+        authkey = None
+        if not _pipe(address):
+            directory = os.path.dirname(address)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+                os.chmod(directory, 0o755 if shared else 0o700)
+            _checkDirectory(directory, shared)
+            if os.path.exists(address):
+                os.remove(address)  # left behind by a service that was killed
+        if not shared:
+            authkey = os.urandom(32)
+            filename = _secretFile(address)
+            if os.path.exists(filename):
+                os.remove(filename)
+            with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+                f.write(authkey)
+        self._address = address
+        self._shared = shared
+        self._listener = Listener(address, authkey=authkey)
+        if shared:
+            os.chmod(address, 0o666)
+        self._processes = [WorkerProcess() for _ in range(processes or multiprocessing.cpu_count())]
+        self._running = {}  # WorkerProcess => Job
+        self._queue = []  # heap of (-priority, id, Job)
+        self._jobs = {}  # id => Job
+        self._nextId = 1
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def serve(self):
+        """Warm up the worker processes and run jobs until a shutdown request."""
+        for process in self._processes:
+            self._warm(process)
+        accepter = threading.Thread(target=self._accept)
+        accepter.daemon = True
+        accepter.start()
+        print('Fitting service listening on %s with %d worker processes%s' %
+              (self._address, len(self._processes), ' for all users' if self._shared else ''))
+
+        while not self._stopped:
+            with self._lock:
+                self._schedule()
+            time.sleep(POLL_INTERVAL)
+
+        with self._lock:
+            for job in list(self._jobs.values()):
+                self._cancel(job)
+                if job.status == 'running':
+                    self._finish(job, 'cancelled', None)
+        for process in self._processes:
+            process.stop()
+        self._listener.close()
+        if not self._shared and os.path.exists(_secretFile(self._address)):
+            os.remove(_secretFile(self._address))
+
+    def _warm(self, process):
+        process.submit(_warm, ()).start()
+
+    def _accept(self):
+        while not self._stopped:
+            try:
+                connection = self._listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                continue
+            try:
+                connection = _Connection(connection, _peer(connection) if self._shared else _uid())
+            except OSError:
+                connection.close()
+                continue
+            thread = threading.Thread(target=self._serveClient, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _serveClient(self, connection):
+        connection.send(('hello', None, {'shared': self._shared}))
+        while True:
+            try:
+                request = connection.recv()
+                handles = None
+                if self._shared and isinstance(request, tuple) and request and request[0] == 'submit':
+                    handles = [connection.receiveHandle() for _ in INPUTS]
+            except (OSError, EOFError, ValueError, RuntimeError):
+                break
+            self._request(connection, request, handles)
+        connection.close()
+
+    def _request(self, connection, request, handles):
+        try:
+            if not isinstance(request, tuple) or not request:
+                raise ValueError('a request is a list starting with its operation')
+            if request[0] == 'submit':
+                _, job, priority, watch = request
+                _checkJob(job, priority, handles is None)
+                name = os.path.basename(job['ipdata'])
+                # copied before taking the lock, reading them may take a while
+                received, handles = handles, None
+                scratch = _copyInputs(job, received) if received is not None else None
+                with self._lock:
+                    self._submit(connection, job, priority, watch, name, scratch)
+                return
+            with self._lock:
+                self._handle(connection, request)
+        except (ValueError, TypeError, OSError) as e:
+            connection.send(('error', None, str(e)))
+        finally:
+            for handle in handles or []:
+                os.close(handle)
+
+    def _submit(self, connection, job, priority, watch, name, scratch):
+        job = Job(self._nextId, job, priority, connection.uid, name, scratch)
+        self._nextId += 1
+        self._jobs[job.id] = job
+        heapq.heappush(self._queue, (-priority, job.id, job))
+        connection.send(('submitted', job.id, None))
+        if watch:
+            job.watchers.append(connection)
+
+    def _allowed(self, connection, job):
+        return connection.uid == job.uid or connection.uid == _uid()
+
+    def _handle(self, connection, request):
+        op = request[0]
+        if op in ('watch', 'cancel'):
+            if len(request) != 2:
+                raise ValueError('%s takes a job id' % op)
+            job = self._jobs.get(request[1])
+            if job is None or not self._allowed(connection, job):
+                connection.send(('error', request[1], 'unknown job'))
+            elif op == 'watch':
+                job.watchers.append(connection)
+                connection.send((job.status, job.id, None))
+                if job.progress is not None:
+                    connection.send(('progress', job.id, job.progress))
+            else:
+                self._cancel(job)
+                connection.send((job.status, job.id, None))
+        elif op == 'jobs':
+            connection.send(('jobs', None, [job.summary() for job in sorted(self._jobs.values(), key=lambda job: job.id)]))
+        elif op == 'shutdown':
+            if connection.uid != _uid():
+                connection.send(('error', None, 'only %s can stop the fitting service' % getpass.getuser()))
+                return
+            self._stopped = True
+            connection.send(('stopping', None, None))
+        else:
+            raise ValueError('unknown request %s' % op)
+
+    def _send(self, job, kind, value):
+        for connection in job.watchers:
+            connection.send((kind, job.id, value))
+        job.watchers = [connection for connection in job.watchers if not connection.closed]
+
+    def _finish(self, job, status, result):
+        job.status = status
+        job.result = result
+        self._send(job, status, result)
+        del self._jobs[job.id]
+        if job.scratch is not None:
+            shutil.rmtree(job.scratch, ignore_errors=True)
+
+    def _cancel(self, job):
+        if job.status == 'queued':
+            self._queue = [entry for entry in self._queue if entry[2] is not job]
+            heapq.heapify(self._queue)
+            self._finish(job, 'cancelled', None)
+        elif job.status == 'running':
+            job.task.cancel()
+
+    def _schedule(self):
+        for process, job in list(self._running.items()):
+            job.task.poll()
+            if job.task.progress is not None and job.task.progress is not job.progress:
+                job.progress = job.task.progress
+                self._send(job, 'progress', job.progress)
+            if job.task.finished():
+                del self._running[process]
+                self._finish(job, job.task.status, job.task.result)
+                if job.task.status != 'done' and job.task.status != 'error':
+                    # the process was killed with the job, start a fresh one
+                    self._warm(process)
+
+        for process in self._processes:
+            if process in self._running or not self._queue:
+                continue
+            _, _, job = heapq.heappop(self._queue)
+            job.task = process.submit(_fit, (job.job,), progress=True)
+            job.task.start()
+            job.status = 'running'
+            self._running[process] = job
+            self._send(job, 'running', None)
+
+
+def _connect(address):
+    """Connect to the service at address and return the connection and whether the service is shared."""
+    connection = Client(address, authkey=_authkey(address))
+    try:
+        kind, _, value = _recv(connection)
+        if kind != 'hello':
+            raise ValueError('unexpected answer %s from the fitting service' % kind)
+    except Exception:
+        connection.close()
+        raise
+    return connection, value['shared']
+
+
+def available(address=ADDRESS):
+    """Return whether a FittingService is listening on address."""
+    try:
+        _connect(address)[0].close()
+        return True
+    except (OSError, EOFError, ValueError, multiprocessing.AuthenticationError):
+        return False
+
+
+def request(message, address=ADDRESS):
+    """Send a single request to the service and return its answer, see FittingService."""
+    connection, _ = _connect(address)
+    try:
+        _send(connection, message)
+        return _recv(connection)
+    finally:
+        connection.close()
+
+
+class RemoteFit(Worker):
+    """A fit run by the FittingService, with the same interface as Worker: args are those of fitSurface
+    except progress, which is streamed back. The fitted mesh is written to the output here, by the user
+    that submitted it. Cancelling it cancels the job in the service.
+    """
+    def __init__(self, args, priority=0, address=ADDRESS, timeout=None):
+        ipdata, ipnode, ipelem, ipmap, iterations, output, engine, convergence = args
+        # the service runs in a directory of its own
+        self._job = {
+            'ipdata': os.path.abspath(ipdata),
+            'ipnode': os.path.abspath(ipnode),
+            'ipelem': os.path.abspath(ipelem),
+            'ipmap': os.path.abspath(ipmap),
+            'iterations': schedule(iterations),
+            'engine': engine,
+            'convergence': convergence.key() if convergence is not None else None,
+        }
+        self._output = output
+        self._priority = priority
+        self._address = address
+        self._timeout = timeout
+        self._connection = None
+        self._lost = False
+        self._start = None
+        self.id = None
+        self.status = 'pending'
+        self.result = None
+        self.progress = None
+        self.duration = 0.0
+
+    def start(self):
+        self._start = time.time()
+        self.status = 'running'
+        files = []
+        try:
+            self._connection, shared = _connect(self._address)
+            if shared:
+                # a shared service reads the files through descriptors opened as this user
+                files = [open(self._job[name], 'rb') for name in INPUTS]
+            _send(self._connection, ('submit', self._job, self._priority, True))
+            for f in files:
+                send_handle(self._connection, f.fileno(), None)
+        except (OSError, EOFError, ValueError, multiprocessing.AuthenticationError) as e:
+            self.status = 'error'
+            self.result = 'could not submit to the fitting service: %s' % e
+            if self._connection is not None:
+                self._connection.close()
+        finally:
+            for f in files:
+                f.close()
+
+    def _receive(self):
+        try:
+            while self._connection.poll():
+                self._handle(*_recv(self._connection))
+        except (OSError, EOFError, ValueError):
+            self._lost = True
+
+    def _handle(self, kind, jobId, value):
+        if kind == 'submitted':
+            self.id = jobId
+        elif kind == 'progress':
+            self.progress = value
+        elif kind == 'done' and self._output:
+            try:
+                writeBuffers([self._output + '.exnode', self._output + '.exelem'], value)
+                self.status, self.result = kind, value
+            except OSError as e:
+                self.status, self.result = 'error', 'could not write the fitted mesh: %s' % e
+        elif kind in ('done', 'error', 'crashed', 'timeout', 'cancelled'):
+            self.status = kind
+            self.result = value
+
+    def _alive(self):
+        return not self._lost
+
+    def _exitcode(self):
+        return None
+
+    def _finish(self):
+        self._connection.close()
+
+    def poll(self):
+        finished = Worker.poll(self)
+        if finished and self.status == 'crashed' and self._lost:
+            self.result = 'lost the connection to the fitting service'
+        return finished
+
+    def _kill(self):
+        # the service reports the cancelled job, but nothing waits for it anymore
+        try:
+            _send(self._connection, ('cancel', self.id))
+            self._connection.close()
+        except (OSError, EOFError):
+            pass
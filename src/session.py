@@ -0,0 +1,217 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .cache import fileDigest
+from .hermite import HermiteMesh
+from .worker import Worker, WorkerProcess, Result, Chain
+from .service import RemoteFit
+from .fitting import defineGeometry, fitGeometry, fitSurface, readBuffers, writeBuffers, fractions, fromFractions
+from .trace import traced, stage
+
+
+@traced(lambda define, ipdata, ipnode, ipelem, ipmap, iterations, *args, **kwargs: {'iterations': iterations})
+def _fit(define, ipdata, ipnode, ipelem, ipmap, iterations, convergence=None, progress=None):
+    defineGeometry(*define)
+    return fitGeometry(ipdata, ipnode, ipelem, ipmap, iterations, progress, convergence)
+
+
+def _readResult(path):
+    # the fitted mesh and the last progress of a fit stored by Session.finished
+    with np.load(os.path.join(path, 'progress.npz')) as f:
+        progress = (int(f['iteration']), int(f['iterations']), float(f['rms']),
+                    (f['nodeIds'], f['versions'], f['values']), (f['elementIds'], f['elementRms'], f['elementMaximum']), None)
+    return readBuffers(os.path.join(path, 'fitted.exnode'), os.path.join(path, 'fitted.exelem')), progress
+
+
+class Session(object):
+    """Keeps aether in a persistent worker process and records which inputs, by filename and content, are
+    defined in it. Fitting then only redefines what changed and can continue from the fitted geometry.
+    With a FitCache, fits from the template are looked up in it first. With the address of a FittingService,
+    fits from the template run there instead, so the session only keeps aether around to continue fits.
+
+    Continuing starts from the mesh of the last fit that finished, which is the one shown. When aether does
+    not hold that mesh, because the fit came from the cache, the service or the Python engine, or aether
+    fitted something else since, the mesh is written as an ipnode and fitted from instead.
+    """
+    def __init__(self, cache=None, service=None):
+        self._process = WorkerProcess()
+        self._cache = cache
+        self._service = service
+        self._pending = {}  # task => (inputs, options, fractions) of the fits to store when they are done
+        self._started = {}  # task => (ipnode, ipelem) that the fit starts from, until it finished
+        self._shown = None  # (task, ipelem digest, ipnode contents) of the last fit that finished
+        self._scratch = None  # directory of the meshes fits start from that are not kept elsewhere
+        self._reset()
+
+    def _reset(self):
+        self._generation = None
+        self._data = None
+        self._mesh = None
+        self._fitted = False  # aether holds the fitted geometry instead of the template
+        self._holder = None  # task whose fitted geometry aether holds
+        self._defineTask = None
+
+    def _valid(self):
+        if self._defineTask is not None and self._defineTask.poll() and self._defineTask.status != 'done':
+            self._reset()
+        if self._generation != self._process.generation or not self._process.alive():
+            self._reset()
+
+    def _changes(self, ipdata, ipnode, ipelem, restart):
+        self._valid()
+        data = (ipdata, fileDigest(ipdata)) if ipdata else None
+        mesh = (ipnode, fileDigest(ipnode), ipelem, fileDigest(ipelem)) if ipnode and ipelem else None
+
+        define = [None, None, None]
+        if data is not None and data != self._data:
+            define[0] = ipdata
+            self._data = data
+        # continuing keeps the fitted geometry, whatever template it started from
+        if mesh is not None and restart and (mesh != self._mesh or self._fitted):
+            define[1:] = [ipnode, ipelem]
+            self._mesh = mesh
+            self._fitted = False
+        return define
+
+    def fitted(self, ipelem):
+        """Return whether there is a fitted mesh with the elements of ipelem that a new fit can continue from."""
+        return self._shown is not None and self._shown[1] == fileDigest(ipelem)
+
+    def _holdsShown(self):
+        # whether aether holds the fitted geometry of the mesh shown
+        self._valid()
+        return self._fitted and self._holder is not None and self._holder is self._shown[0]
+
+    def _scratchFile(self, name):
+        if self._scratch is None:
+            self._scratch = tempfile.mkdtemp(prefix='lung_fitting_session')
+        return os.path.join(self._scratch, name)
+
+    def define(self, ipdata, ipnode, ipelem):
+        """Start defining the inputs in the background, so that a following fit can start right away."""
+        if self._service is not None:
+            return
+        define = self._changes(ipdata, ipnode, ipelem, True)
+        if not any(define):
+            return
+        self._process.start()
+        self._generation = self._process.generation
+        self._defineTask = self._process.submit(defineGeometry, define)
+        self._defineTask.start()
+
+    def fit(self, ipdata, ipnode, ipelem, ipmap, iterations, restart=True, engine='aether', landmarks=(),
+            convergence=None, prepare=None):
+        """Return a Task that fits the inputs, redefining only those that changed since the previous fit.
+        When restart is False the fit continues from the mesh shown, see finished, or starts from the template
+        when there is none with the elements of ipelem. The Python engine keeps no state, it runs in a Worker
+        of its own.
+
+        A fit from the template that is in the cache returns a Result that is done right away, and one that
+        runs more iterations than a cached fit starts from that fit and runs only the remaining iterations.
+        Landmarks and the Convergence, which stops the fit early, are part of the cache key. Pass the task to
+        finished once it is done to cache its result and to continue from it.
+
+        With prepare, a (func, args) pair, the task first runs func(*args) in a Worker of its own and then fits
+        the (ipdata, ipnode) it returns, such as the cleaned data cloud and the aligned template, see Chain.
+        """
+        if prepare is not None:
+            return Chain(Worker(*prepare), lambda prepared: self.fit(prepared[0], prepared[1], ipelem, ipmap, iterations,
+                                                                    restart, engine, landmarks, convergence))
+        key = None
+        if not restart and not self.fitted(ipelem):
+            restart = True
+        if not restart:
+            if engine != 'aether' or not self._holdsShown():
+                ipnode = self._scratchFile('shown.ipnode')
+                with open(ipnode, 'w') as f:
+                    f.write(self._shown[2])
+                restart = True
+        elif self._cache is not None:
+            iterationFractions = fractions(iterations)
+            options = (engine, tuple(landmarks), convergence.key() if convergence is not None else None)
+            key = ([ipdata, ipnode, ipelem, ipmap], options, iterationFractions)
+            with stage('FitCache.lookup'):
+                path, count = self._cache.lookup(*key)
+            # entries can be evicted by other processes at any time, what is needed of them is read right away
+            try:
+                if count == len(iterationFractions):
+                    task = Result(*_readResult(path))
+                    self._started[task] = (ipnode, ipelem)
+                    return task
+                if path is not None:
+                    cached = self._scratchFile('cached.ipnode')
+                    shutil.copyfile(os.path.join(path, 'fitted.ipnode'), cached)
+                    ipnode = cached
+                    iterations = fromFractions(iterationFractions[count:])
+            except (OSError, KeyError):
+                pass
+
+        task = self._fit(ipdata, ipnode, ipelem, ipmap, iterations, restart, engine, convergence)
+        if key is not None:
+            self._pending[task] = key
+        self._started[task] = (ipnode, ipelem)
+        return task
+
+    def finished(self, task):
+        """Record the result of a task returned by fit as the mesh shown, which later fits continue from, and
+        store it in the cache, when it is done.
+        """
+        if isinstance(task, Chain):
+            task = task.last
+        key = self._pending.pop(task, None)
+        started = self._started.pop(task, None)
+        if task.status != 'done' or not task.progress or started is None:
+            return
+        ipnode, ipelem = started
+        rms, nodeParameters, elementErrors = task.progress[2:5]
+        # the fitted geometry as an ipnode of the template, which later fits continue from
+        mesh = HermiteMesh.read(ipnode, ipelem)
+        mesh.setNodeParameters(*nodeParameters)
+        fitted = mesh.writeIpnode('fitted %s' % os.path.basename(ipnode))
+        self._shown = (task, fileDigest(ipelem), fitted)
+
+        # where a time budget stopped the fit depends on how busy the machine was
+        if key is None or task.progress[5] and task.progress[5][0] == 'time budget':
+            return
+        inputs, options, iterationFractions = key
+
+        def fill(path):
+            writeBuffers([os.path.join(path, 'fitted.exnode'), os.path.join(path, 'fitted.exelem')], task.result)
+            with open(os.path.join(path, 'fitted.ipnode'), 'w') as f:
+                f.write(fitted)
+            # the counts cover the whole fit, also when it continued from a cached one
+            count = len(iterationFractions)
+            np.savez(os.path.join(path, 'progress.npz'), iteration=count, iterations=count, rms=rms,
+                     nodeIds=nodeParameters[0], versions=nodeParameters[1], values=nodeParameters[2],
+                     elementIds=elementErrors[0], elementRms=elementErrors[1], elementMaximum=elementErrors[2])
+
+        with stage('FitCache.store'):
+            self._cache.store(inputs, options, iterationFractions, fill)
+
+    def _fit(self, ipdata, ipnode, ipelem, ipmap, iterations, restart, engine, convergence):
+        args = (ipdata, ipnode, ipelem, ipmap, iterations, None, engine, convergence)
+        if self._service is not None and (restart or engine != 'aether'):
+            return RemoteFit(args, address=self._service)
+        if engine != 'aether':
+            return Worker(fitSurface, args, progress=True)
+
+        define = self._changes(ipdata, ipnode, ipelem, restart)
+        self._process.start()
+        self._generation = self._process.generation
+        self._fitted = True
+        self._holder = self._process.submit(_fit, (define, ipdata, ipnode, ipelem, ipmap, iterations, convergence), progress=True)
+        return self._holder
+
+    def stop(self):
+        self._pending = {}
+        self._started = {}
+        self._shown = None
+        self._process.stop()
+        self._reset()
+        if self._scratch is not None:
+            shutil.rmtree(self._scratch, ignore_errors=True)
+            self._scratch = None
+
@@ -0,0 +1,295 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+from scipy.spatial import cKDTree
+
+from .hermite import HermiteMesh, basis, COORDINATES, DERIVATIVES, LOCAL_NODES
+from .ipdata import readIpdata
+from .trace import traced, fileSize
+
+TERMS = LOCAL_NODES * DERIVATIVES  # basis functions per element and coordinate
+
+SMOOTHING = 1e-3  # weight of the bending penalty relative to the data, per data point per element
+SAMPLES = 8  # points along each xi direction at which elements are sampled to find candidates for a data point
+CANDIDATES = 4  # nearest element samples per data point that are refined by Newton steps
+NEWTON_STEPS = 6
+PRUNE_STEPS = 2  # Newton steps after which only the best candidate of every data point is refined further
+MAX_STEP = 0.5  # largest change of xi in a single Newton step
+CHUNK_SIZE = 20000  # data points per projection task
+
+_DERIVATIVE_ORDERS = [(0, 0), (1, 0), (0, 1), (2, 0), (1, 1), (0, 2)]
+
+
+def _evaluate(params, xi, orders=((0, 0),)):
+    """Return [point, order, coordinate] for the element parameters [point, term, coordinate] at xi, with the
+    basis functions differentiated by the pairs of orders along xi1 and xi2.
+    """
+    bases = np.stack([basis(xi, *order).reshape(-1, TERMS) for order in orders], 1)
+    return np.matmul(bases, params)
+
+
+def _newton(params, xi, points, steps):
+    """Move xi towards the nearest point to points on the elements with the given parameters, clamped to
+    the element, and return it with the squared distance. Where the Hessian is not positive definite the
+    Gauss-Newton approximation is used instead, and steps that do not get closer shrink the step size.
+    """
+    values = _evaluate(params, xi, _DERIVATIVE_ORDERS)
+    distance = np.sum((values[:, 0] - points) ** 2, axis=1)
+    radius = np.full(len(xi), MAX_STEP)
+    for _ in range(steps):
+        x, d1, d2, d11, d12, d22 = np.moveaxis(values, 1, 0)
+        r = x - points
+        g1 = np.sum(r * d1, axis=1)
+        g2 = np.sum(r * d2, axis=1)
+        j11 = np.sum(d1 * d1, axis=1)
+        j12 = np.sum(d1 * d2, axis=1)
+        j22 = np.sum(d2 * d2, axis=1)
+        h11 = j11 + np.sum(r * d11, axis=1)
+        h12 = j12 + np.sum(r * d12, axis=1)
+        h22 = j22 + np.sum(r * d22, axis=1)
+
+        indefinite = (h11 <= 0.0) | (h11 * h22 - h12 * h12 <= 0.0)
+        h11 = np.where(indefinite, j11, h11)
+        h12 = np.where(indefinite, j12, h12)
+        h22 = np.where(indefinite, j22, h22)
+        damping = 1e-9 * (h11 + h22) + 1e-30
+        h11 += damping
+        h22 += damping
+        det = h11 * h22 - h12 * h12
+
+        step = -np.stack([h22 * g1 - h12 * g2, h11 * g2 - h12 * g1], -1) / det[:, None]
+        step *= np.minimum(1.0, radius / np.maximum(np.abs(step).max(axis=1), 1e-30))[:, None]
+        trial = np.clip(xi + step, 0.0, 1.0)
+        trialValues = _evaluate(params, trial, _DERIVATIVE_ORDERS)
+        trialDistance = np.sum((trialValues[:, 0] - points) ** 2, axis=1)
+
+        closer = trialDistance < distance
+        xi = np.where(closer[:, None], trial, xi)
+        values = np.where(closer[:, None, None], trialValues, values)
+        distance = np.where(closer, trialDistance, distance)
+        radius = np.where(closer, MAX_STEP, radius * 0.25)
+    return xi, distance
+
+
+def _accumulate(count, elements, xi, points):
+    """Return the per element sums of the outer products of the basis functions (count, TERMS, TERMS) and of
+    the basis functions times the data coordinates (count, TERMS, 3).
+    """
+    matrices = np.zeros((count, TERMS, TERMS))
+    rhs = np.zeros((count, TERMS, COORDINATES))
+    if len(elements) == 0:
+        return matrices, rhs
+
+    order = np.argsort(elements, kind='stable')
+    elements = elements[order]
+    b = basis(xi[order]).reshape(-1, TERMS)
+    starts = np.flatnonzero(np.r_[True, elements[1:] != elements[:-1]])
+    matrices[elements[starts]] = np.add.reduceat(b[:, :, None] * b[:, None, :], starts, axis=0)
+    rhs[elements[starts]] = np.add.reduceat(b[:, :, None] * points[order, None, :], starts, axis=0)
+    return matrices, rhs
+
+
+def smoothingMatrix():
+    """Return the (TERMS, TERMS) matrix of the bending energy of an element, the integral over xi of the
+    squared second derivatives, by 4x4 point Gauss quadrature.
+    """
+    points, weights = np.polynomial.legendre.leggauss(4)
+    points = (points + 1.0) / 2.0
+    xi = np.stack(np.meshgrid(points, points, indexing='ij'), -1).reshape(-1, 2)
+    weights = np.outer(weights, weights).ravel() / 4.0
+
+    matrix = np.zeros((TERMS, TERMS))
+    for order1, order2, factor in [(2, 0, 1.0), (1, 1, 2.0), (0, 2, 1.0)]:
+        b = basis(xi, order1, order2).reshape(-1, TERMS)
+        matrix += factor * (b.T * weights).dot(b)
+    return matrix
+
+
+class Projector(object):
+    """Projects data points onto the nearest point of a HermiteMesh, in chunks that run on a pool of threads.
+    Candidate elements for every point come from a KD-tree over points sampled on the elements, which are
+    then refined with vectorized Newton steps. NumPy and the KD-tree release the GIL while they work, and
+    threads can also be used inside the daemonic worker processes, which cannot have children.
+    """
+    def __init__(self, threads=None):
+        self._executor = ThreadPoolExecutor(threads or os.cpu_count() or 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    def _prepare(self, mesh, elements=None):
+        params = mesh.elementParameters().transpose(0, 1, 3, 2).reshape(-1, TERMS, COORDINATES)
+        elements = np.arange(len(params)) if elements is None else np.asarray(elements)
+        grid = (np.arange(SAMPLES) + 0.5) / SAMPLES
+        xi = np.stack(np.meshgrid(grid, grid, indexing='ij'), -1).reshape(-1, 2)
+        samples = np.matmul(basis(xi).reshape(-1, TERMS), params[elements]).reshape(-1, COORDINATES)
+        sampleElements = np.repeat(elements, len(xi))
+        sampleXi = np.tile(xi, (len(elements), 1))
+        return params, cKDTree(samples), sampleElements, sampleXi
+
+    def _project(self, prepared, points):
+        params, tree, sampleElements, sampleXi = prepared
+        k = min(CANDIDATES, len(sampleElements))
+        _, nearest = tree.query(points, k)
+        nearest = nearest.reshape(len(points), k)
+
+        elements = sampleElements[nearest].ravel()
+        repeated = np.repeat(points, k, axis=0)
+        xi, distances = _newton(params[elements], sampleXi[nearest].reshape(-1, 2), repeated, PRUNE_STEPS)
+
+        best = np.argmin(distances.reshape(-1, k), axis=1)
+        rows = np.arange(len(points))
+        elements = elements.reshape(-1, k)[rows, best]
+        xi, distances = _newton(params[elements], xi.reshape(-1, k, 2)[rows, best], points, NEWTON_STEPS - PRUNE_STEPS)
+        return elements, xi, distances
+
+    def _chunks(self, func, *arrays):
+        return self._executor.map(func, *[[a[i:i + CHUNK_SIZE] for i in range(0, len(arrays[0]), CHUNK_SIZE)] for a in arrays])
+
+    @traced(lambda self, mesh, coords, elements=None: {'points': len(coords), 'elements': len(mesh.elementIds)})
+    def project(self, mesh, coords, elements=None):
+        """Return the element index, xi and squared distance of the nearest point on the mesh to each point,
+        optionally only considering the given element indices.
+        """
+        prepared = self._prepare(mesh, elements)
+        results = list(self._chunks(lambda points: self._project(prepared, np.ascontiguousarray(points, dtype=float)), coords))
+        if not results:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 2)), np.zeros(0)
+        return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+    def near(self, mesh, coords, distances, elements):
+        """Return a mask of the points that may lie closer than the given distances to one of the elements.
+        Points on an element lie within the spacing of its samples from the nearest of them.
+        """
+        _, tree, _, _ = self._prepare(mesh, elements)
+        samples = tree.data.reshape(len(elements), SAMPLES, SAMPLES, COORDINATES)
+        spacing = max(np.linalg.norm(np.diff(samples, axis=1), axis=-1).max(), np.linalg.norm(np.diff(samples, axis=2), axis=-1).max())
+        nearest, _ = tree.query(coords, workers=-1)
+        return nearest - spacing < distances
+
+    @traced(lambda self, count, elements, xi, coords: {'points': len(coords)})
+    def accumulate(self, count, elements, xi, coords):
+        """Return the per element least-squares matrices and right hand sides, see _accumulate, for points
+        projected onto elements at xi, summed over chunks of points.
+        """
+        matrices = np.zeros((count, TERMS, TERMS))
+        rhs = np.zeros((count, TERMS, COORDINATES))
+        for chunkMatrices, chunkRhs in self._chunks(lambda *chunk: _accumulate(count, *chunk), elements, xi, coords):
+            matrices += chunkMatrices
+            rhs += chunkRhs
+        return matrices, rhs
+
+
+def _constraints(mesh, coord):
+    """Return the sparse transformation T, constant vector p0 and the indices of the free parameters such
+    that the values of the coordinate, flattened as in parameterIndices, are T q + p0 for the free values q.
+    Fixed values keep their current value and mapped values follow the value they are mapped to.
+    """
+    values = mesh.values[:, :, coord, :].ravel()
+    count = len(values)
+    valid = ~np.isnan(values)
+    versions = mesh.values.shape[1]
+
+    def index(rows):
+        return (rows[:, 0] * versions + rows[:, 1]) * DERIVATIVES + rows[:, 2]
+
+    target = np.arange(count)
+    scale = np.ones(count)
+    target[index(mesh.mapped[:, :3])] = index(mesh.mapped[:, 3:])
+    scale[index(mesh.mapped[:, :3])] = mesh.scales
+    for _ in range(len(mesh.mapped)):  # follow chains of mappings to the value they end in
+        if np.array_equal(target[target], target):
+            break
+        scale = scale * scale[target]
+        target = target[target]
+
+    fixed = np.zeros(count, dtype=bool)
+    fixed[index(mesh.fixed)] = True
+    free = np.flatnonzero(valid & (target == np.arange(count)) & ~fixed)
+    column = np.full(count, -1)
+    column[free] = np.arange(len(free))
+
+    rows = np.flatnonzero(valid & (column[target] >= 0))
+    transform = sparse.csr_matrix((scale[rows], (rows, column[target[rows]])), shape=(count, len(free)))
+    constant = np.where(valid & fixed[target], scale * np.nan_to_num(values[target]), 0.0)
+    return transform, constant, free
+
+
+@traced(lambda mesh, *args: {'elements': len(mesh.elementIds)})
+def solve(mesh, matrices, rhs, smoothing):
+    """Update the node values of the mesh to the least-squares solution of the per element normal
+    equations plus smoothing times the bending energy of every element, subject to the mesh constraints.
+    """
+    elementMatrices = matrices + smoothing * smoothingMatrix()
+    indices = mesh.parameterIndices()
+    count = mesh.values[:, :, 0, :].size
+    for coord in range(COORDINATES):
+        local = indices[:, :, coord, :].reshape(-1, TERMS)
+        rows = np.repeat(local[:, :, None], TERMS, axis=2)
+        cols = np.repeat(local[:, None, :], TERMS, axis=1)
+        system = sparse.csr_matrix((elementMatrices.ravel(), (rows.ravel(), cols.ravel())), shape=(count, count))
+        b = np.bincount(local.ravel(), rhs[:, :, coord].ravel(), minlength=count)
+
+        transform, constant, free = _constraints(mesh, coord)
+        reduced = (transform.T.dot(system).dot(transform)).tocsc()
+        reducedRhs = transform.T.dot(b - system.dot(constant))
+
+        # values that no data or smoothing reaches, such as unused versions, keep their current value
+        values = mesh.values[:, :, coord, :].ravel()
+        diagonal = reduced.diagonal()
+        ridge = 1e-9 * (diagonal.max() if len(diagonal) else 1.0) + 1e-30
+        q = spsolve(reduced + ridge * sparse.identity(len(free), format='csc'), reducedRhs + ridge * values[free])
+
+        fitted = transform.dot(np.atleast_1d(q)) + constant
+        valid = ~np.isnan(values)
+        values[valid] = fitted[valid]
+        mesh.values[:, :, coord, :] = values.reshape(mesh.values.shape[0], -1, DERIVATIVES)
+
+
+def fitIteration(mesh, coords, projector, smoothing=SMOOTHING, projection=None):
+    """Update the mesh to the least-squares fit of the data projected onto it, using the element indices
+    and xi of projection as returned by Projector.project when given.
+    """
+    if projection is None:
+        projection = projector.project(mesh, coords)
+    elements, xi = projection[:2]
+    matrices, rhs = projector.accumulate(len(mesh.elementIds), elements, xi, np.asarray(coords, dtype=float))
+    solve(mesh, matrices, rhs, smoothing * len(coords) / max(len(mesh.elementIds), 1))
+
+
+@traced(lambda ipdata, ipnode, ipelem, ipmap, iterations, *args, **kwargs: {'bytes': fileSize(ipdata), 'iterations': iterations})
+def fitHermite(ipdata, ipnode, ipelem, ipmap, iterations, progress=None, smoothing=SMOOTHING, threads=None, convergence=None):
+    """Fit the template mesh to the data cloud without aether and return the contents of the fitted exnode
+    and exelem, reporting progress like fitGeometry in the fitting module. Iterations is a number of
+    iterations or a schedule of (fraction, iterations) stages, which fit a voxel-downsampled part of the
+    data cloud. The projection that measures the error after an iteration is the one the next iteration
+    of the stage fits. With a Convergence, stages stop once they converged and the fit once its time
+    budget ran out.
+    """
+    from .fitting import schedule, stageLevels, decimate
+    from .quality import FitError, runStages
+
+    mesh = HermiteMesh.read(ipnode, ipelem, ipmap)
+    _, coords = readIpdata(ipdata)
+    stages = schedule(iterations)
+    levels = stageLevels(coords) if any(fraction < 1.0 for fraction, _ in stages) else None
+
+    with Projector(threads) as projector:
+        def startStage(fraction):
+            stageCoords = coords if levels is None or fraction >= 1.0 else coords[decimate(levels, fraction)]
+            return FitError(mesh, stageCoords, projector)
+
+        def iterate(error):
+            fitIteration(mesh, error.coords, projector, smoothing, (error.elements, error.xi))
+
+        runStages(stages, startStage, iterate, progress, convergence)
+    return mesh.buffers()
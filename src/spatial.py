@@ -0,0 +1,77 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+RAY_BATCH = 32  # number of spheres along a picking ray that are queried at once
+
+
+def pickingCone(eye, point, edgePoint):
+    """Return the direction and tangent of the half-angle of the cone from the eye through point, of which
+    edgePoint lies on the boundary. Both points are unprojected from window coordinates at the same depth.
+    """
+    direction = np.subtract(point, eye)
+    edge = np.subtract(edgePoint, eye)
+    cosAngle = direction.dot(edge) / (np.linalg.norm(direction) * np.linalg.norm(edge))
+    cosAngle = min(max(cosAngle, 1e-6), 1.0)
+    return direction, np.sqrt(1.0 - cosAngle * cosAngle) / cosAngle
+
+
+class PointIndex(object):
+    """KD-tree over an (N, 3) point cloud for nearest point and picking ray queries in O(log N). The
+    optional ids are the node identifiers belonging to the points.
+    """
+    def __init__(self, coords, ids=None):
+        self.coords = np.ascontiguousarray(coords, dtype=float)
+        self.ids = ids
+        self._tree = cKDTree(self.coords)
+        self._min = self.coords.min(axis=0) if len(self.coords) else np.zeros(3)
+        self._max = self.coords.max(axis=0) if len(self.coords) else np.zeros(3)
+
+    def nearest(self, points, k=1):
+        """Return the distances and indices of the k nearest points for each of the query points."""
+        return self._tree.query(points, k=k)
+
+    def withinRadius(self, points, radius):
+        """Return for each query point the list of indices of points within radius."""
+        return self._tree.query_ball_point(points, radius)
+
+    def _rayRange(self, origin, direction):
+        # distances along the ray where it enters and leaves the bounding box of the points
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0 = (self._min - origin) / direction
+            t1 = (self._max - origin) / direction
+        tmin = np.nanmax(np.where(np.isfinite(t0), np.minimum(t0, t1), -np.inf))
+        tmax = np.nanmin(np.where(np.isfinite(t0), np.maximum(t0, t1), np.inf))
+        return max(tmin, 0.0), tmax
+
+    def nearestToRay(self, origin, direction, tanAngle):
+        """Return the index of the point closest to origin within the cone around the ray from origin along
+        direction with half-angle arctan(tanAngle), or None. The cone is covered front to back by spheres
+        that are queried in the KD-tree, so that the search stops at the first points found.
+        """
+        if len(self.coords) == 0:
+            return None
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        direction = direction / np.linalg.norm(direction)
+
+        tmin, tmax = self._rayRange(origin, direction)
+        if tmin > tmax:
+            return None
+
+        minRadius = 1e-3 * max(np.linalg.norm(self._max - self._min), 1e-6)
+        t = max(tmin, minRadius)
+        while t <= tmax:
+            # sphere centres along the ray, each spaced by the cone radius at its depth
+            ts = t * (1.0 + tanAngle) ** np.arange(RAY_BATCH)
+            radii = np.maximum(ts * tanAngle, minRadius) * 2.0
+            candidates = self._tree.query_ball_point(origin + ts[:, None] * direction, radii)
+            candidates = np.unique(np.concatenate([np.asarray(c, dtype=np.int64) for c in candidates]))
+            if len(candidates):
+                v = self.coords[candidates] - origin
+                depth = v.dot(direction)
+                distance = np.linalg.norm(v - depth[:, None] * direction, axis=1)
+                inside = (depth > 0.0) & (distance <= depth * tanAngle + minRadius)
+                if np.any(inside):
+                    return int(candidates[inside][np.argmin(depth[inside])])
+            t = ts[-1] + radii[-1] / 2.0
+        return None
@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import builtins
+import threading
+import importlib.util
+
+# imports are timed on the main thread only, modules warmed in the background are not part of startup
+_originalImport = None  # the import function that recordImports replaced
+_stack = []  # [name, start, seconds spent in nested imports] of the imports in progress
+_imports = {}  # module name => (total, self) seconds of its first import
+_milestones = []  # (name, time.time()) in the order they were reached
+
+
+def _timedImport(name, globals=None, locals=None, fromlist=(), level=0):
+    module = name
+    if level:
+        try:
+            module = importlib.util.resolve_name('.' * level + name, (globals or {}).get('__package__'))
+        except (ImportError, ValueError):
+            module = None
+    if module is None or module in sys.modules or threading.current_thread() is not threading.main_thread():
+        return _originalImport(name, globals, locals, fromlist, level)
+
+    entry = [module, time.perf_counter(), 0.0]
+    _stack.append(entry)
+    try:
+        return _originalImport(name, globals, locals, fromlist, level)
+    finally:
+        _stack.pop()
+        total = time.perf_counter() - entry[1]
+        if _stack:
+            _stack[-1][2] += total
+        _imports.setdefault(module, (total, total - entry[2]))
+
+
+def recordImports():
+    """Time the first import of every module from now on until stopImports, see report."""
+    global _originalImport
+    if builtins.__import__ is not _timedImport:
+        _originalImport = builtins.__import__
+        builtins.__import__ = _timedImport
+
+
+def stopImports():
+    """Stop timing imports and restore the import function that recordImports replaced."""
+    if builtins.__import__ is _timedImport:
+        builtins.__import__ = _originalImport
+
+
+def milestone(name):
+    """Record that startup reached the named point, such as the window being shown."""
+    _milestones.append((name, time.time()))
+
+
+def report():
+    """Return the startup report: the milestones with their time.time(), in order, and the total and self
+    seconds of every module imported, the latter excluding the modules it imported in turn.
+    """
+    return {
+        'milestones': list(_milestones),
+        'imports': dict((name, {'total': total, 'self': self}) for name, (total, self) in _imports.items()),
+    }
+
+
+def formatReport(startup, count=15):
+    """Return the time between the milestones of a report and its count slowest imports as text."""
+    lines = []
+    milestones = startup['milestones']
+    for (_, previous), (name, reached) in zip(milestones, milestones[1:]):
+        lines.append('%-40s %7.3fs (+%.3fs)' % (name, reached - milestones[0][1], reached - previous))
+    imports = sorted(startup['imports'].items(), key=lambda item: -item[1]['self'])[:count]
+    if imports:
+        lines.append('%-40s %8s %8s' % ('slowest imports', 'self', 'total'))
+        for name, seconds in imports:
+            lines.append('%-40s %7.3fs %7.3fs' % (name, seconds['self'], seconds['total']))
+    return '\n'.join(lines)
+
+
+def write(filename):
+    # written under another name first, so that a complete report appears at once for whoever waits for it
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(report(), f, indent=1)
+    os.replace(filename + '.tmp', filename)
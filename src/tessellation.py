@@ -0,0 +1,47 @@
+import numpy as np
+
+LEVELS = [1, 2, 4, 8, 12, 16]  # refinement factors of the tessellations that elements are binned into
+DEFAULT_REFINEMENT = 12  # refinement factor of the default tessellation, used by graphics that are not adaptive
+COARSE = 2  # largest refinement factor while the view is moving
+TRIANGLE_BUDGET = 500000  # triangles drawn for all adaptive surface elements together
+TOLERANCE = 0.5  # pixels that the tessellated surface may deviate from the element
+MIN_SEGMENT = 4.0  # pixels, elements are not divided into smaller segments than this on screen
+
+# 3 x 3 grid of xi locations at which elements are sampled, the corners are 0, 2, 6 and 8
+SAMPLE_XI = np.array([[xi1, xi2] for xi2 in [0.0, 0.5, 1.0] for xi1 in [0.0, 0.5, 1.0]])
+
+
+def elementExtents(samples):
+    """Return the size and the curvature of elements given their (E, 9, 3) coordinates at SAMPLE_XI. The size
+    is the longest diagonal and the curvature the largest distance of a sample to the bilinear interpolation
+    of the corners, which is how far a single flat quad would be off.
+    """
+    samples = np.asarray(samples, dtype=float)
+    corners = samples[:, [0, 2, 6, 8]]
+    xi1 = SAMPLE_XI[:, 0, None]
+    xi2 = SAMPLE_XI[:, 1, None]
+    bilinear = (corners[:, None, 0] * ((1.0 - xi1) * (1.0 - xi2)) + corners[:, None, 1] * (xi1 * (1.0 - xi2)) +
+                corners[:, None, 2] * ((1.0 - xi1) * xi2) + corners[:, None, 3] * (xi1 * xi2))
+    size = np.maximum(np.linalg.norm(corners[:, 3] - corners[:, 0], axis=1), np.linalg.norm(corners[:, 2] - corners[:, 1], axis=1))
+    curvature = np.linalg.norm(samples - bilinear, axis=2).max(axis=1)
+    return size, curvature
+
+
+def refinementFactors(size, curvature, pixelSize, budget=TRIANGLE_BUDGET, tolerance=TOLERANCE):
+    """Return the refinement factor from LEVELS for each element with the given size and curvature from
+    elementExtents when a pixel covers pixelSize in the scene. The deviation of a tessellated element shrinks
+    with the square of the refinement factor, which is chosen to keep it below tolerance pixels, but without
+    making segments smaller than MIN_SEGMENT pixels. All factors are scaled down together when the 2 triangles
+    per square of the factor of all elements exceed budget.
+    """
+    pixelSize = max(pixelSize, 1e-12)
+    factors = np.minimum(np.ceil(np.sqrt(curvature / pixelSize / tolerance)), np.ceil(size / pixelSize / MIN_SEGMENT))
+    factors = np.maximum(factors, 1.0)
+
+    triangles = 2.0 * np.sum(factors * factors)
+    if triangles > budget:
+        factors = np.maximum(np.floor(factors * np.sqrt(budget / triangles)), 1.0)
+
+    # round down to the nearest level so that the budget still holds
+    levels = np.array(LEVELS)
+    return levels[np.maximum(np.searchsorted(levels, factors, side='right') - 1, 0)]
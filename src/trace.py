@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import functools
+import threading
+
+# stages recorded while tracing was enabled, kept after disabling it so they can still be exported
+_recorded = []
+# _recorded while tracing is enabled and None when it is disabled, which makes every traced call a single
+# check of this global
+_events = None
+_lock = threading.Lock()
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def _rss():
+    # current resident memory in bytes, the peak on platforms without /proc
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def enable():
+    global _events
+    _events = _recorded
+
+
+def disable():
+    """Stop tracing and return the events recorded so far."""
+    global _events
+    _events = None
+    return events()
+
+
+def enabled():
+    return _events is not None
+
+
+def events():
+    with _lock:
+        return list(_recorded)
+
+
+def clear():
+    with _lock:
+        del _recorded[:]
+
+
+def merge(recorded):
+    """Add events recorded in another process, such as a fitting worker."""
+    if _events is not None:
+        with _lock:
+            _events.extend(recorded)
+
+
+class _Stage(object):
+    def __init__(self, name, sizes):
+        self._name = name
+        self._sizes = sizes
+
+    def __enter__(self):
+        self._rss = _rss()
+        self._cpu = time.process_time()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.time()
+        args = dict(self._sizes)
+        args['cpu'] = time.process_time() - self._cpu
+        args['rss'] = _rss() - self._rss
+        event = {
+            'name': self._name,
+            'ph': 'X',
+            'ts': self._start * 1e6,
+            'dur': (end - self._start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': args,
+        }
+        if _events is not None:
+            with _lock:
+                _events.append(event)
+        return False
+
+
+class _Disabled(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+def stage(name, **sizes):
+    """Return a context manager that records the wall time, CPU time and resident memory change of the
+    code it runs as a stage, with the keyword arguments as input sizes.
+    """
+    if _events is None:
+        return _DISABLED
+    return _Stage(name, sizes)
+
+
+def traced(sizes=None):
+    """Decorator that records every call of the function as a stage named after it. When given, sizes is
+    called with the arguments of the call and returns a dict of input sizes.
+    """
+    def decorator(func):
+        name = getattr(func, '__qualname__', func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return func(*args, **kwargs)
+            with _Stage(name, sizes(*args, **kwargs) if sizes else {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def fileSize(filename):
+    try:
+        return os.path.getsize(filename)
+    except (TypeError, OSError):
+        return 0
+
+
+def summary(recorded=None):
+    """Return (name, calls, wall seconds, CPU seconds, largest resident memory change) per stage name, in the
+    order they were first recorded.
+    """
+    totals = {}
+    for event in recorded if recorded is not None else events():
+        if event['name'] not in totals:
+            totals[event['name']] = [event['name'], 0, 0.0, 0.0, 0]
+        total = totals[event['name']]
+        total[1] += 1
+        total[2] += event['dur'] / 1e6
+        total[3] += event['args']['cpu']
+        total[4] = max(total[4], event['args']['rss'])
+    return [tuple(total) for total in totals.values()]
+
+
+def export(filename, recorded=None):
+    """Write the recorded events as a Chrome trace, which chrome://tracing and Perfetto open."""
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': recorded if recorded is not None else events(), 'displayTimeUnit': 'ms'}, f)
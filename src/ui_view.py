@@ -28,45 +28,68 @@ class Ui_View(object):
         self.leftLung_groupBox.setObjectName("leftLung_groupBox")
         self.gridLayout_4 = QtWidgets.QGridLayout(self.leftLung_groupBox)
         self.gridLayout_4.setObjectName("gridLayout_4")
+        self.lobe_label = QtWidgets.QLabel(self.leftLung_groupBox)
+        self.lobe_label.setObjectName("lobe_label")
+        self.gridLayout_4.addWidget(self.lobe_label, 0, 0, 1, 1)
+        self.lobe_comboBox = QtWidgets.QComboBox(self.leftLung_groupBox)
+        self.lobe_comboBox.setObjectName("lobe_comboBox")
+        self.lobe_comboBox.addItem("")
+        self.lobe_comboBox.addItem("")
+        self.lobe_comboBox.addItem("")
+        self.lobe_comboBox.addItem("")
+        self.lobe_comboBox.addItem("")
+        self.gridLayout_4.addWidget(self.lobe_comboBox, 0, 1, 1, 1)
         self.datacloudIpdata_lineEdit = QtWidgets.QLineEdit(self.leftLung_groupBox)
         font = QtGui.QFont()
         font.setPointSize(8)
         self.datacloudIpdata_lineEdit.setFont(font)
         self.datacloudIpdata_lineEdit.setObjectName("datacloudIpdata_lineEdit")
-        self.gridLayout_4.addWidget(self.datacloudIpdata_lineEdit, 0, 0, 1, 1)
+        self.gridLayout_4.addWidget(self.datacloudIpdata_lineEdit, 1, 0, 1, 1)
         self.surfaceIpnode_pushButton = QtWidgets.QPushButton(self.leftLung_groupBox)
         self.surfaceIpnode_pushButton.setObjectName("surfaceIpnode_pushButton")
-        self.gridLayout_4.addWidget(self.surfaceIpnode_pushButton, 1, 1, 1, 1)
+        self.gridLayout_4.addWidget(self.surfaceIpnode_pushButton, 2, 1, 1, 1)
         self.datacloudIpdata_pushButton = QtWidgets.QPushButton(self.leftLung_groupBox)
         self.datacloudIpdata_pushButton.setObjectName("datacloudIpdata_pushButton")
-        self.gridLayout_4.addWidget(self.datacloudIpdata_pushButton, 0, 1, 1, 1)
+        self.gridLayout_4.addWidget(self.datacloudIpdata_pushButton, 1, 1, 1, 1)
         self.surfaceIpnode_lineEdit = QtWidgets.QLineEdit(self.leftLung_groupBox)
         font = QtGui.QFont()
         font.setPointSize(8)
         self.surfaceIpnode_lineEdit.setFont(font)
         self.surfaceIpnode_lineEdit.setObjectName("surfaceIpnode_lineEdit")
-        self.gridLayout_4.addWidget(self.surfaceIpnode_lineEdit, 1, 0, 1, 1)
+        self.gridLayout_4.addWidget(self.surfaceIpnode_lineEdit, 2, 0, 1, 1)
         self.surfaceIpelem_pushButton = QtWidgets.QPushButton(self.leftLung_groupBox)
         self.surfaceIpelem_pushButton.setObjectName("surfaceIpelem_pushButton")
-        self.gridLayout_4.addWidget(self.surfaceIpelem_pushButton, 2, 1, 1, 1)
+        self.gridLayout_4.addWidget(self.surfaceIpelem_pushButton, 3, 1, 1, 1)
         self.surfaceIpelem_lineEdit = QtWidgets.QLineEdit(self.leftLung_groupBox)
         font = QtGui.QFont()
         font.setPointSize(8)
         self.surfaceIpelem_lineEdit.setFont(font)
         self.surfaceIpelem_lineEdit.setObjectName("surfaceIpelem_lineEdit")
-        self.gridLayout_4.addWidget(self.surfaceIpelem_lineEdit, 2, 0, 1, 1)
+        self.gridLayout_4.addWidget(self.surfaceIpelem_lineEdit, 3, 0, 1, 1)
         self.showDatacloud_checkBox = QtWidgets.QCheckBox(self.leftLung_groupBox)
         self.showDatacloud_checkBox.setChecked(True)
         self.showDatacloud_checkBox.setObjectName("showDatacloud_checkBox")
-        self.gridLayout_4.addWidget(self.showDatacloud_checkBox, 4, 0, 1, 2)
+        self.gridLayout_4.addWidget(self.showDatacloud_checkBox, 7, 0, 1, 2)
         self.showMesh_checkBox = QtWidgets.QCheckBox(self.leftLung_groupBox)
         self.showMesh_checkBox.setChecked(True)
         self.showMesh_checkBox.setObjectName("showMesh_checkBox")
-        self.gridLayout_4.addWidget(self.showMesh_checkBox, 5, 0, 1, 2)
+        self.gridLayout_4.addWidget(self.showMesh_checkBox, 8, 0, 1, 2)
         self.load_pushButton = QtWidgets.QPushButton(self.leftLung_groupBox)
         self.load_pushButton.setMinimumSize(QtCore.QSize(0, 40))
         self.load_pushButton.setObjectName("load_pushButton")
-        self.gridLayout_4.addWidget(self.load_pushButton, 3, 0, 1, 2)
+        self.gridLayout_4.addWidget(self.load_pushButton, 6, 0, 1, 2)
+        self.clean_checkBox = QtWidgets.QCheckBox(self.leftLung_groupBox)
+        self.clean_checkBox.setObjectName("clean_checkBox")
+        self.gridLayout_4.addWidget(self.clean_checkBox, 5, 0, 1, 2)
+        self.surfaceIpmap_pushButton = QtWidgets.QPushButton(self.leftLung_groupBox)
+        self.surfaceIpmap_pushButton.setObjectName("surfaceIpmap_pushButton")
+        self.gridLayout_4.addWidget(self.surfaceIpmap_pushButton, 4, 1, 1, 1)
+        self.surfaceIpmap_lineEdit = QtWidgets.QLineEdit(self.leftLung_groupBox)
+        font = QtGui.QFont()
+        font.setPointSize(8)
+        self.surfaceIpmap_lineEdit.setFont(font)
+        self.surfaceIpmap_lineEdit.setObjectName("surfaceIpmap_lineEdit")
+        self.gridLayout_4.addWidget(self.surfaceIpmap_lineEdit, 4, 0, 1, 1)
         self.verticalLayout.addWidget(self.leftLung_groupBox)
         self.groupBox_2 = QtWidgets.QGroupBox(self.controlPanel_widget)
         self.groupBox_2.setObjectName("groupBox_2")
@@ -74,18 +97,66 @@ class Ui_View(object):
         self.gridLayout_3.setObjectName("gridLayout_3")
         self.iterations_spinBox = QtWidgets.QSpinBox(self.groupBox_2)
         self.iterations_spinBox.setMinimum(1)
-        self.iterations_spinBox.setMaximum(20)
+        self.iterations_spinBox.setMaximum(100)
         self.iterations_spinBox.setProperty("value", 8)
         self.iterations_spinBox.setObjectName("iterations_spinBox")
         self.gridLayout_3.addWidget(self.iterations_spinBox, 2, 1, 1, 1)
+        self.continue_checkBox = QtWidgets.QCheckBox(self.groupBox_2)
+        self.continue_checkBox.setObjectName("continue_checkBox")
+        self.gridLayout_3.addWidget(self.continue_checkBox, 6, 0, 1, 2)
         self.fit_pushButton = QtWidgets.QPushButton(self.groupBox_2)
         self.fit_pushButton.setMinimumSize(QtCore.QSize(0, 40))
         self.fit_pushButton.setObjectName("fit_pushButton")
-        self.gridLayout_3.addWidget(self.fit_pushButton, 4, 0, 1, 2)
+        self.gridLayout_3.addWidget(self.fit_pushButton, 7, 0, 1, 2)
+        self.fit_progressBar = QtWidgets.QProgressBar(self.groupBox_2)
+        self.fit_progressBar.setProperty("value", 0)
+        self.fit_progressBar.setTextVisible(True)
+        self.fit_progressBar.setObjectName("fit_progressBar")
+        self.gridLayout_3.addWidget(self.fit_progressBar, 8, 0, 1, 1)
+        self.cancel_pushButton = QtWidgets.QPushButton(self.groupBox_2)
+        self.cancel_pushButton.setEnabled(False)
+        self.cancel_pushButton.setObjectName("cancel_pushButton")
+        self.gridLayout_3.addWidget(self.cancel_pushButton, 8, 1, 1, 1)
         self.label = QtWidgets.QLabel(self.groupBox_2)
         self.label.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
         self.label.setObjectName("label")
         self.gridLayout_3.addWidget(self.label, 2, 0, 1, 1)
+        self.schedule_label = QtWidgets.QLabel(self.groupBox_2)
+        self.schedule_label.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
+        self.schedule_label.setObjectName("schedule_label")
+        self.gridLayout_3.addWidget(self.schedule_label, 3, 0, 1, 1)
+        self.schedule_lineEdit = QtWidgets.QLineEdit(self.groupBox_2)
+        self.schedule_lineEdit.setObjectName("schedule_lineEdit")
+        self.gridLayout_3.addWidget(self.schedule_lineEdit, 3, 1, 1, 1)
+        self.converge_checkBox = QtWidgets.QCheckBox(self.groupBox_2)
+        self.converge_checkBox.setObjectName("converge_checkBox")
+        self.gridLayout_3.addWidget(self.converge_checkBox, 4, 0, 1, 1)
+        self.tolerance_doubleSpinBox = QtWidgets.QDoubleSpinBox(self.groupBox_2)
+        self.tolerance_doubleSpinBox.setDecimals(4)
+        self.tolerance_doubleSpinBox.setMinimum(0.0001)
+        self.tolerance_doubleSpinBox.setMaximum(0.1)
+        self.tolerance_doubleSpinBox.setSingleStep(0.001)
+        self.tolerance_doubleSpinBox.setProperty("value", 0.001)
+        self.tolerance_doubleSpinBox.setObjectName("tolerance_doubleSpinBox")
+        self.gridLayout_3.addWidget(self.tolerance_doubleSpinBox, 4, 1, 1, 1)
+        self.budget_label = QtWidgets.QLabel(self.groupBox_2)
+        self.budget_label.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
+        self.budget_label.setObjectName("budget_label")
+        self.gridLayout_3.addWidget(self.budget_label, 5, 0, 1, 1)
+        self.budget_spinBox = QtWidgets.QSpinBox(self.groupBox_2)
+        self.budget_spinBox.setMaximum(3600)
+        self.budget_spinBox.setSingleStep(10)
+        self.budget_spinBox.setObjectName("budget_spinBox")
+        self.gridLayout_3.addWidget(self.budget_spinBox, 5, 1, 1, 1)
+        self.engine_label = QtWidgets.QLabel(self.groupBox_2)
+        self.engine_label.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
+        self.engine_label.setObjectName("engine_label")
+        self.gridLayout_3.addWidget(self.engine_label, 0, 0, 1, 1)
+        self.engine_comboBox = QtWidgets.QComboBox(self.groupBox_2)
+        self.engine_comboBox.setObjectName("engine_comboBox")
+        self.engine_comboBox.addItem("")
+        self.engine_comboBox.addItem("")
+        self.gridLayout_3.addWidget(self.engine_comboBox, 0, 1, 1, 1)
         self.landmarks_groupBox = QtWidgets.QGroupBox(self.groupBox_2)
         self.landmarks_groupBox.setObjectName("landmarks_groupBox")
         self.gridLayout = QtWidgets.QGridLayout(self.landmarks_groupBox)
@@ -145,6 +216,14 @@ class Ui_View(object):
         self.lateralNode_pushButton.setCheckable(True)
         self.lateralNode_pushButton.setObjectName("lateralNode_pushButton")
         self.gridLayout.addWidget(self.lateralNode_pushButton, 1, 1, 1, 1)
+        self.alignment_comboBox = QtWidgets.QComboBox(self.landmarks_groupBox)
+        self.alignment_comboBox.setObjectName("alignment_comboBox")
+        self.alignment_comboBox.addItem("")
+        self.alignment_comboBox.addItem("")
+        self.gridLayout.addWidget(self.alignment_comboBox, 2, 0, 1, 1)
+        self.icp_checkBox = QtWidgets.QCheckBox(self.landmarks_groupBox)
+        self.icp_checkBox.setObjectName("icp_checkBox")
+        self.gridLayout.addWidget(self.icp_checkBox, 2, 1, 1, 1)
         self.gridLayout_3.addWidget(self.landmarks_groupBox, 1, 0, 1, 2)
         self.verticalLayout.addWidget(self.groupBox_2)
         spacerItem = QtWidgets.QSpacerItem(20, 20, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
@@ -183,6 +262,16 @@ class Ui_View(object):
         self.save_pushButton.setObjectName("save_pushButton")
         self.gridLayout_2.addWidget(self.save_pushButton, 2, 0, 1, 2)
         self.verticalLayout.addWidget(self.groupBox)
+        self.timings_pushButton = QtWidgets.QPushButton(self.controlPanel_widget)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.timings_pushButton.sizePolicy().hasHeightForWidth())
+        self.timings_pushButton.setSizePolicy(sizePolicy)
+        self.timings_pushButton.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.timings_pushButton.setFlat(True)
+        self.timings_pushButton.setObjectName("timings_pushButton")
+        self.verticalLayout.addWidget(self.timings_pushButton)
         self.info_pushButton = QtWidgets.QPushButton(self.controlPanel_widget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
         sizePolicy.setHorizontalStretch(0)
@@ -209,15 +298,40 @@ class Ui_View(object):
     def retranslateUi(self, View):
         View.setWindowTitle(QtWidgets.QApplication.translate("View", "Lung fitting", None))
         self.leftLung_groupBox.setTitle(QtWidgets.QApplication.translate("View", "Inputs", None))
+        self.lobe_label.setText(QtWidgets.QApplication.translate("View", "Lobe:", None))
+        self.lobe_comboBox.setItemText(0, QtWidgets.QApplication.translate("View", "LUL", None))
+        self.lobe_comboBox.setItemText(1, QtWidgets.QApplication.translate("View", "LLL", None))
+        self.lobe_comboBox.setItemText(2, QtWidgets.QApplication.translate("View", "RUL", None))
+        self.lobe_comboBox.setItemText(3, QtWidgets.QApplication.translate("View", "RML", None))
+        self.lobe_comboBox.setItemText(4, QtWidgets.QApplication.translate("View", "RLL", None))
         self.surfaceIpnode_pushButton.setText(QtWidgets.QApplication.translate("View", ".ipnode", None))
         self.datacloudIpdata_pushButton.setText(QtWidgets.QApplication.translate("View", ".ipdata", None))
         self.surfaceIpelem_pushButton.setText(QtWidgets.QApplication.translate("View", ".ipelem", None))
+        self.surfaceIpmap_pushButton.setText(QtWidgets.QApplication.translate("View", ".ipmap", None))
         self.showDatacloud_checkBox.setText(QtWidgets.QApplication.translate("View", "Show data cloud", None))
         self.showMesh_checkBox.setText(QtWidgets.QApplication.translate("View", "Show surface mesh", None))
+        self.clean_checkBox.setToolTip(QtWidgets.QApplication.translate("View", "Remove duplicate and outlying points of the data cloud, and points beyond the landmarks when fitting", None))
+        self.clean_checkBox.setText(QtWidgets.QApplication.translate("View", "Clean data cloud", None))
         self.load_pushButton.setText(QtWidgets.QApplication.translate("View", "Load", None))
         self.groupBox_2.setTitle(QtWidgets.QApplication.translate("View", "Fitting", None))
+        self.continue_checkBox.setText(QtWidgets.QApplication.translate("View", "Continue from fitted mesh", None))
         self.fit_pushButton.setText(QtWidgets.QApplication.translate("View", "Fit", None))
+        self.fit_progressBar.setFormat(QtWidgets.QApplication.translate("View", "", None))
+        self.cancel_pushButton.setText(QtWidgets.QApplication.translate("View", "Cancel", None))
         self.label.setText(QtWidgets.QApplication.translate("View", "Iterations:", None))
+        self.schedule_label.setText(QtWidgets.QApplication.translate("View", "Schedule:", None))
+        self.schedule_lineEdit.setToolTip(QtWidgets.QApplication.translate("View", "Coarse-to-fine stages as fraction:iterations, such as 0.1:4, 0.3:2, 1:2. Fits the iterations on all points when empty.", None))
+        self.schedule_lineEdit.setPlaceholderText(QtWidgets.QApplication.translate("View", "0.1:4, 0.3:2, 1:2", None))
+        self.converge_checkBox.setToolTip(QtWidgets.QApplication.translate("View", "Stop once an iteration improves the RMS error by less than the tolerance and moves no node further than the tolerance times the size of the mesh. The iterations are then a maximum.", None))
+        self.converge_checkBox.setText(QtWidgets.QApplication.translate("View", "Stop when converged", None))
+        self.tolerance_doubleSpinBox.setToolTip(QtWidgets.QApplication.translate("View", "Relative tolerance of the RMS error and node movement per iteration", None))
+        self.budget_label.setText(QtWidgets.QApplication.translate("View", "Time budget:", None))
+        self.budget_spinBox.setToolTip(QtWidgets.QApplication.translate("View", "Seconds after which each fit stops, whether it converged or not", None))
+        self.budget_spinBox.setSpecialValueText(QtWidgets.QApplication.translate("View", "none", None))
+        self.budget_spinBox.setSuffix(QtWidgets.QApplication.translate("View", " s", None))
+        self.engine_label.setText(QtWidgets.QApplication.translate("View", "Engine:", None))
+        self.engine_comboBox.setItemText(0, QtWidgets.QApplication.translate("View", "aether", None))
+        self.engine_comboBox.setItemText(1, QtWidgets.QApplication.translate("View", "python", None))
         self.landmarks_groupBox.setTitle(QtWidgets.QApplication.translate("View", "Choosing landmarks", None))
         self.ventralNode_pushButton.setAccessibleName(QtWidgets.QApplication.translate("View", "ventral", None))
         self.ventralNode_pushButton.setText(QtWidgets.QApplication.translate("View", "Ventral", None))
@@ -227,10 +341,16 @@ class Ui_View(object):
         self.basalNode_pushButton.setText(QtWidgets.QApplication.translate("View", "Basal", None))
         self.lateralNode_pushButton.setAccessibleName(QtWidgets.QApplication.translate("View", "lateral", None))
         self.lateralNode_pushButton.setText(QtWidgets.QApplication.translate("View", "Lateral", None))
+        self.alignment_comboBox.setToolTip(QtWidgets.QApplication.translate("View", "Transform that moves the template onto the landmarks before fitting", None))
+        self.alignment_comboBox.setItemText(0, QtWidgets.QApplication.translate("View", "similarity", None))
+        self.alignment_comboBox.setItemText(1, QtWidgets.QApplication.translate("View", "affine", None))
+        self.icp_checkBox.setToolTip(QtWidgets.QApplication.translate("View", "Refine the alignment to the landmarks by iterative closest point against the data cloud", None))
+        self.icp_checkBox.setText(QtWidgets.QApplication.translate("View", "Refine with ICP", None))
         self.groupBox.setTitle(QtWidgets.QApplication.translate("View", "Saving", None))
         self.outputExnode_pushButton.setText(QtWidgets.QApplication.translate("View", ".exnode", None))
         self.outputExelem_pushButton.setText(QtWidgets.QApplication.translate("View", ".exelem", None))
         self.save_pushButton.setText(QtWidgets.QApplication.translate("View", "Save", None))
+        self.timings_pushButton.setText(QtWidgets.QApplication.translate("View", "Timings", None))
         self.info_pushButton.setText(QtWidgets.QApplication.translate("View", "Info", None))
 
 from opencmiss.zincwidgets.sceneviewerwidget import SceneviewerWidget
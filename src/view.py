@@ -1,11 +1,83 @@
 from PySide2 import QtGui, QtCore, QtWidgets
 from .ui_view import Ui_View
+from . import trace
 import os
+import time
+
+
+class TimingsPanel(QtWidgets.QDialog):
+    """Totals per traced stage, refreshed while the panel is open, with tracing switched by Record."""
+    COLUMNS = ['Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Max RSS change (MB)']
+
+    def __init__(self, parent=None):
+        super(TimingsPanel, self).__init__(parent)
+        self.setWindowTitle('Timings')
+        self.resize(560, 400)
+
+        self._record_checkBox = QtWidgets.QCheckBox('Record')
+        self._record_checkBox.setChecked(trace.enabled())
+        self._clear_pushButton = QtWidgets.QPushButton('Clear')
+        self._export_pushButton = QtWidgets.QPushButton('Export...')
+        self._table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self._table.setHorizontalHeaderLabels(self.COLUMNS)
+        self._table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self._table.verticalHeader().setVisible(False)
+        self._table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self._record_checkBox)
+        buttons.addStretch()
+        buttons.addWidget(self._clear_pushButton)
+        buttons.addWidget(self._export_pushButton)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(self._table)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self._refresh)
+        self._record_checkBox.clicked.connect(self._recordClicked)
+        self._clear_pushButton.clicked.connect(self._clearClicked)
+        self._export_pushButton.clicked.connect(self._exportClicked)
+
+    def showEvent(self, event):
+        self._refresh()
+        self._timer.start()
+        super(TimingsPanel, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self._timer.stop()
+        super(TimingsPanel, self).hideEvent(event)
+
+    def _refresh(self):
+        rows = trace.summary()
+        self._table.setRowCount(len(rows))
+        for row, (name, calls, wall, cpu, rss) in enumerate(rows):
+            for column, text in enumerate([name, '%d' % calls, '%.3f' % wall, '%.3f' % cpu, '%.1f' % (rss / 1e6)]):
+                item = QtWidgets.QTableWidgetItem(text)
+                if column > 0:
+                    item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self._table.setItem(row, column, item)
+
+    def _recordClicked(self):
+        if self._record_checkBox.isChecked():
+            trace.enable()
+        else:
+            trace.disable()
+
+    def _clearClicked(self):
+        trace.clear()
+        self._refresh()
+
+    def _exportClicked(self):
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(parent=self, caption='Export Chrome trace', dir='trace.json', filter='*.json')
+        if filename:
+            trace.export(filename)
 
 class View(QtWidgets.QWidget):
     def __init__(self, scene, parent=None):
         super(View, self).__init__(parent)
-        self._inputFilenames = ['', '', '']
+        self._inputFilenames = {}  # lobe => ipdata, ipnode, ipelem and ipmap filenames
         self._outputFilenames = ['', '']
         self._path = '.'
         self._info = ''
@@ -13,7 +85,23 @@ class View(QtWidgets.QWidget):
         self._showCallback = None
         self._landmarkCallback = None
         self._fitCallback = None
+        self._fitProgressCallback = None
+        self._fitFinishedCallback = None
         self._saveCallback = None
+        self._timingsPanel = None
+        self._frameCallback = None
+        self._frameTime = 0.0
+        self._framePending = False
+        self._interactionCallback = None
+        self._interacting = False
+        self._interactionTimer = QtCore.QTimer(self)
+        self._interactionTimer.setSingleShot(True)
+        self._interactionTimer.setInterval(300)  # ms without mouse activity after which the view has stopped
+        self._fitWorkers = {}  # lobe => worker, of the lobes that are being fitted
+        self._fitIterations = {}  # lobe => last iteration reported
+        self._fitTotals = {}  # lobe => iterations it runs
+        self._fitTimer = QtCore.QTimer(self)
+        self._fitTimer.setInterval(200)
 
         self._ui = Ui_View()
         self._ui.setupUi(self)
@@ -21,6 +109,7 @@ class View(QtWidgets.QWidget):
         self._scene = scene
         self._ui.sceneviewer_widget.setContext(scene.getContext())
         self._makeConnections()
+        self._lobeChanged()
 
     def setInfo(self, info):
         self._info = info
@@ -28,6 +117,12 @@ class View(QtWidgets.QWidget):
     def _infoClicked(self):
         QtGui.QMessageBox.information(self, 'Information', self._info)
 
+    def _timingsClicked(self):
+        if self._timingsPanel is None:
+            self._timingsPanel = TimingsPanel(self)
+        self._timingsPanel.show()
+        self._timingsPanel.raise_()
+
     def loadCallback(self, cb):
         self._loadCallback = cb
 
@@ -40,28 +135,52 @@ class View(QtWidgets.QWidget):
     def fitCallback(self, cb):
         self._fitCallback = cb
 
+    def fitProgressCallback(self, cb):
+        self._fitProgressCallback = cb
+
+    def fitFinishedCallback(self, cb):
+        self._fitFinishedCallback = cb
+
     def saveCallback(self, cb):
         self._saveCallback = cb
 
+    def frameCallback(self, cb):
+        self._frameCallback = cb
+
+    def interactionCallback(self, cb):
+        self._interactionCallback = cb
+
     def _makeConnections(self):
         self._ui.sceneviewer_widget.graphicsInitialized.connect(self._graphicsUpdate)
         self._ui.datacloudIpdata_pushButton.clicked.connect(self._datacloudIpdataClicked)
         self._ui.surfaceIpnode_pushButton.clicked.connect(self._surfaceIpnodeClicked)
         self._ui.surfaceIpelem_pushButton.clicked.connect(self._surfaceIpelemClicked)
+        self._ui.surfaceIpmap_pushButton.clicked.connect(self._surfaceIpmapClicked)
+        self._ui.lobe_comboBox.currentIndexChanged.connect(self._lobeChanged)
         self._ui.load_pushButton.clicked.connect(self._loadClicked)
         self._ui.outputExnode_pushButton.clicked.connect(self._outputExnodeClicked)
         self._ui.outputExelem_pushButton.clicked.connect(self._outputExelemClicked)
         self._ui.fit_pushButton.clicked.connect(self._fitClicked)
+        self._ui.cancel_pushButton.clicked.connect(self._cancelClicked)
+        self._fitTimer.timeout.connect(self._fitPoll)
+        self._interactionTimer.timeout.connect(self._interactionStopped)
         self._ui.save_pushButton.clicked.connect(self._saveClicked)
         self._ui.showDatacloud_checkBox.clicked.connect(self._showClicked)
         self._ui.showMesh_checkBox.clicked.connect(self._showClicked)
 
         self._ui.info_pushButton.clicked.connect(self._infoClicked)
+        self._ui.timings_pushButton.clicked.connect(self._timingsClicked)
         self._ui.info_pushButton.setIcon(QtGui.QIcon.fromTheme('dialog-information'))
         self._ui.info_pushButton.setText('')
 
         self._originalSceneviewerMousePressEvent = self._ui.sceneviewer_widget.mousePressEvent
         self._ui.sceneviewer_widget.mousePressEvent = self._sceneviewerMousePressEvent
+        self._originalSceneviewerMouseReleaseEvent = self._ui.sceneviewer_widget.mouseReleaseEvent
+        self._ui.sceneviewer_widget.mouseReleaseEvent = self._sceneviewerMouseReleaseEvent
+        self._originalSceneviewerWheelEvent = self._ui.sceneviewer_widget.wheelEvent
+        self._ui.sceneviewer_widget.wheelEvent = self._sceneviewerWheelEvent
+        self._originalSceneviewerPaintGL = self._ui.sceneviewer_widget.paintGL
+        self._ui.sceneviewer_widget.paintGL = self._sceneviewerPaintGL
 
         self._landmarksGroup = QtWidgets.QButtonGroup(self)
         for landmark_pushButton in self._ui.landmarks_groupBox.children():
@@ -78,31 +197,45 @@ class View(QtWidgets.QWidget):
             sceneviewer.setTransparencyMode(sceneviewer.TRANSPARENCY_MODE_SLOW)
             sceneviewer.viewAll()
 
-    def _datacloudIpdataClicked(self):
-        filename, _ = QtWidgets.QFileDialog.getOpenFileName(parent=self, caption='Open data cloud ipdata file', dir=self._path, filter='*.ipdata')
+    def _lobe(self):
+        return self._ui.lobe_comboBox.currentText()
+
+    def _inputs(self):
+        return self._inputFilenames.setdefault(self._lobe(), ['', '', '', ''])
+
+    def setInputs(self, lobe, ipdata, ipnode, ipelem, ipmap):
+        self._inputFilenames[lobe] = [str(ipdata), str(ipnode), str(ipelem), str(ipmap)]
+        self._lobeChanged()
+
+    def _lobeChanged(self):
+        lineEdits = [self._ui.datacloudIpdata_lineEdit, self._ui.surfaceIpnode_lineEdit, self._ui.surfaceIpelem_lineEdit, self._ui.surfaceIpmap_lineEdit]
+        for lineEdit, filename in zip(lineEdits, self._inputs()):
+            lineEdit.setText(os.path.relpath(filename, os.getcwd()) if filename else '')
+
+    def _inputClicked(self, index, lineEdit, caption, filter):
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(parent=self, caption=caption, dir=self._path, filter=filter)
         if filename:
-            self._ui.datacloudIpdata_lineEdit.setText(os.path.relpath(filename, os.getcwd()))
-            self._inputFilenames[0] = str(filename)
+            lineEdit.setText(os.path.relpath(filename, os.getcwd()))
+            self._inputs()[index] = str(filename)
             self._path = os.path.dirname(filename)
 
+    def _datacloudIpdataClicked(self):
+        self._inputClicked(0, self._ui.datacloudIpdata_lineEdit, 'Open data cloud ipdata file', '*.ipdata')
+
     def _surfaceIpnodeClicked(self):
-        filename, _ = QtWidgets.QFileDialog.getOpenFileName(parent=self, caption='Open surface ipnode file', dir=self._path, filter='*.ipnode')
-        if filename:
-            self._ui.surfaceIpnode_lineEdit.setText(os.path.relpath(filename, os.getcwd()))
-            self._inputFilenames[1] = str(filename)
-            self._path = os.path.dirname(filename)
+        self._inputClicked(1, self._ui.surfaceIpnode_lineEdit, 'Open surface ipnode file', '*.ipnode')
 
     def _surfaceIpelemClicked(self):
-        filename, _ = QtWidgets.QFileDialog.getOpenFileName(parent=self, caption='Open surface ipelem file', dir=self._path, filter='*.ipelem')
-        if filename:
-            self._ui.surfaceIpelem_lineEdit.setText(os.path.relpath(filename, os.getcwd()))
-            self._inputFilenames[2] = str(filename)
-            self._path = os.path.dirname(filename)
+        self._inputClicked(2, self._ui.surfaceIpelem_lineEdit, 'Open surface ipelem file', '*.ipelem')
+
+    def _surfaceIpmapClicked(self):
+        self._inputClicked(3, self._ui.surfaceIpmap_lineEdit, 'Open surface ipmap file', '*.ipmap')
 
     def _loadClicked(self):
         if self._loadCallback:
             QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self._loadCallback(self._inputFilenames[0], self._inputFilenames[1], self._inputFilenames[2])
+            ipdata, ipnode, ipelem = self._inputs()[:3]
+            self._loadCallback(self._lobe(), ipdata, ipnode, ipelem, self._ui.clean_checkBox.isChecked())
             self._graphicsUpdate()
             QtGui.QApplication.restoreOverrideCursor()
     
@@ -145,20 +278,131 @@ class View(QtWidgets.QWidget):
             self._path = os.path.dirname(filename)
 
     def _fitClicked(self):
-        if self._fitCallback:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        # all lobes with inputs are fitted at the same time, each in a worker of its own
+        from .fitting import parseSchedule, schedule
+        from .quality import Convergence
+
+        if self._fitCallback and not self._fitWorkers:
             iterations = self._ui.iterations_spinBox.value()
-            self._fitCallback(self._inputFilenames[0], self._inputFilenames[1], self._inputFilenames[2], iterations)
-            QtGui.QApplication.restoreOverrideCursor()
+            if self._ui.schedule_lineEdit.text().strip():
+                try:
+                    iterations = parseSchedule(self._ui.schedule_lineEdit.text())
+                except ValueError as e:
+                    QtWidgets.QMessageBox.warning(self, 'Schedule', str(e))
+                    return
+            restart = not self._ui.continue_checkBox.isChecked()
+            engine = self._ui.engine_comboBox.currentText()
+            alignment = self._ui.alignment_comboBox.currentText()
+            icp = self._ui.icp_checkBox.isChecked()
+            # every lobe starts with the default map, only lobes with a data cloud or template of their own count
+            inputs = dict((lobe, filenames) for lobe, filenames in self._inputFilenames.items() if any(filenames[:3]))
+            clean = self._ui.clean_checkBox.isChecked()
+            # a time budget also stops fits that are not meant to stop when converged
+            convergence = None
+            if self._ui.converge_checkBox.isChecked() or self._ui.budget_spinBox.value():
+                tolerance = self._ui.tolerance_doubleSpinBox.value() if self._ui.converge_checkBox.isChecked() else 0.0
+                convergence = Convergence(tolerance, self._ui.budget_spinBox.value() or None)
+            workers = self._fitCallback(inputs, iterations, restart, engine, alignment, icp, clean, convergence)
+            if not workers:
+                return
+
+            self._fitWorkers = dict(workers)
+            self._fitIterations = dict((lobe, 0) for lobe in workers)
+            # fits that continue from a cached fit report only the iterations they run
+            self._fitTotals = dict((lobe, sum(count for _, count in schedule(iterations))) for lobe in workers)
+            for worker in self._fitWorkers.values():
+                worker.start()
+            self._ui.fit_pushButton.setEnabled(False)
+            self._ui.cancel_pushButton.setEnabled(True)
+            self._ui.fit_progressBar.setRange(0, sum(self._fitTotals.values()))
+            self._ui.fit_progressBar.setValue(0)
+            self._ui.fit_progressBar.setFormat('Starting...')
+            self._fitTimer.start()
+
+    def _cancelClicked(self):
+        for worker in self._fitWorkers.values():
+            worker.cancel()
+        if self._fitWorkers:
+            self._fitPoll()
+
+    def _fitPoll(self):
+        for lobe, worker in sorted(self._fitWorkers.items()):
+            finished = worker.poll()
+            if worker.progress and worker.progress[0] != self._fitIterations[lobe]:
+                iteration, iterations, rms = worker.progress[:3]
+                self._fitIterations[lobe] = iteration
+                self._fitTotals[lobe] = iterations
+                self._ui.fit_progressBar.setRange(0, sum(self._fitTotals.values()))
+                self._ui.fit_progressBar.setValue(sum(self._fitIterations.values()))
+                self._ui.fit_progressBar.setFormat('%s %d/%d  RMS %.3g' % (lobe, iteration, iterations, rms))
+                if self._fitProgressCallback:
+                    self._fitProgressCallback(lobe, worker)
+
+            if finished:
+                # results are shown as soon as each lobe finishes
+                del self._fitWorkers[lobe]
+                # a fit that stopped early ran all the iterations it needed
+                if worker.status == 'done' and self._fitIterations[lobe]:
+                    self._fitTotals[lobe] = self._fitIterations[lobe]
+                    self._ui.fit_progressBar.setRange(0, sum(self._fitTotals.values()))
+                    self._ui.fit_progressBar.setValue(sum(self._fitIterations.values()))
+                if worker.status != 'done':
+                    self._ui.fit_progressBar.setFormat('%s %s' % (lobe, worker.status))
+                if self._fitFinishedCallback:
+                    QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+                    self._fitFinishedCallback(lobe, worker)
+                    QtWidgets.QApplication.restoreOverrideCursor()
+
+        if not self._fitWorkers:
+            self._fitTimer.stop()
+            self._ui.fit_pushButton.setEnabled(True)
+            self._ui.cancel_pushButton.setEnabled(False)
 
     def _saveClicked(self):
         if self._saveCallback:
             QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self._saveCallback(self._outputFilenames[0], self._outputFilenames[1])
+            self._saveCallback(self._lobe(), self._outputFilenames[0], self._outputFilenames[1])
             QtGui.QApplication.restoreOverrideCursor()
 
+    def _sceneviewerPaintGL(self):
+        start = time.time()
+        self._originalSceneviewerPaintGL()
+        if self._frameCallback:
+            # the callback may change graphics, which must not happen while painting
+            self._frameTime = time.time() - start
+            if not self._framePending:
+                self._framePending = True
+                QtCore.QTimer.singleShot(0, self._frameFinished)
+
+    def _frameFinished(self):
+        self._framePending = False
+        self._frameCallback(self._ui.sceneviewer_widget, self._frameTime)
+
+    def _interactionStarted(self):
+        self._interactionTimer.stop()
+        if not self._interacting:
+            self._interacting = True
+            if self._interactionCallback:
+                self._interactionCallback(self._ui.sceneviewer_widget, True)
+
+    def _interactionStopped(self):
+        if self._interacting:
+            self._interacting = False
+            if self._interactionCallback:
+                self._interactionCallback(self._ui.sceneviewer_widget, False)
+
+    def _sceneviewerMouseReleaseEvent(self, event):
+        self._originalSceneviewerMouseReleaseEvent(event)
+        self._interactionTimer.start()
+
+    def _sceneviewerWheelEvent(self, event):
+        self._originalSceneviewerWheelEvent(event)
+        self._interactionStarted()
+        self._interactionTimer.start()
+
     def _sceneviewerMousePressEvent(self, event):
         self._originalSceneviewerMousePressEvent(event)
+        self._interactionStarted()
         
         if self._landmarksGroup.checkedButton() != None:
             landmark = self._landmarksGroup.checkedButton().accessibleName()
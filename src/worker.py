@@ -0,0 +1,318 @@
+import time
+import traceback
+import multiprocessing
+
+from . import trace
+
+# aether keeps global Fortran state, so every worker is a freshly spawned interpreter instead of a fork
+_context = multiprocessing.get_context('spawn')
+
+POLL_INTERVAL = 0.1  # seconds
+
+
+def _call(func, args, progress, report, traced=False):
+    # stages traced in the worker are sent back before the result, so they are merged when it finishes
+    if traced:
+        trace.clear()
+        trace.enable()
+    try:
+        if progress:
+            result = func(*args, progress=lambda *value: report('progress', value))
+        else:
+            result = func(*args)
+        kind = 'done'
+    except Exception:
+        kind, result = 'error', traceback.format_exc()
+    if traced:
+        report('trace', trace.disable())
+    report(kind, result)
+
+
+def _run(func, args, queue, progress, traced):
+    _call(func, args, progress, lambda kind, value: queue.put((kind, value)), traced)
+
+
+def _serve(commands, messages):
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+        taskId, func, args, progress, traced = command
+        _call(func, args, progress, lambda kind, value: messages.put((taskId, kind, value)), traced)
+
+
+def _stop(process):
+    process.terminate()
+    process.join(1.0)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+class Worker(object):
+    """Run func(*args) in an isolated process. The status is one of 'pending', 'running', 'done', 'error',
+    'crashed', 'timeout' or 'cancelled', and result holds the return value or error message when finished.
+    When progress is True, func receives a progress keyword argument it can call with any values, the last
+    values reported are available as the progress attribute. Stages traced by func are added to the trace
+    of this process when tracing was enabled on creation. The process and the queue it reports through are
+    only created when the worker is started, so that pending workers hold no file descriptors.
+    """
+    def __init__(self, func, args, timeout=None, progress=False):
+        self._target = (func, args, progress, trace.enabled())
+        self._queue = None
+        self._process = None
+        self._timeout = timeout
+        self._start = None
+        self.status = 'pending'
+        self.result = None
+        self.progress = None
+        self.duration = 0.0
+
+    def start(self):
+        func, args, progress, traced = self._target
+        self._queue = _context.Queue()
+        self._process = _context.Process(target=_run, args=(func, args, self._queue, progress, traced))
+        self._process.daemon = True
+        self._start = time.time()
+        self._process.start()
+        self.status = 'running'
+
+    def finished(self):
+        return self.status not in ('pending', 'running')
+
+    def _receive(self):
+        while not self._queue.empty():
+            try:
+                kind, value = self._queue.get_nowait()
+            except Exception:
+                break
+            self._handle(kind, value)
+
+    def _handle(self, kind, value):
+        if kind in ('done', 'error'):
+            self.status = kind
+            self.result = value
+        elif kind == 'progress':
+            self.progress = value
+        elif kind == 'trace':
+            trace.merge(value)
+
+    def _alive(self):
+        return self._process.is_alive()
+
+    def _exitcode(self):
+        return self._process.exitcode
+
+    def _finish(self):
+        # the process and the queue hold file descriptors until they are released
+        self._process.join()
+        self._process.close()
+        self._process = None
+        self._queue = None
+
+    def poll(self):
+        """Process messages from the worker and return True when it has finished."""
+        if self.status != 'running':
+            return self.finished()
+
+        self._receive()
+        self.duration = time.time() - self._start
+        if self.finished():
+            self._finish()
+        elif not self._alive():
+            self._receive()
+            if not self.finished():
+                self.status = 'crashed'
+                self.result = 'worker exited with code %s' % self._exitcode()
+            self._finish()
+        elif self._timeout and self.duration > self._timeout:
+            self._kill()
+            self._finish()
+            self.status = 'timeout'
+            self.result = 'worker killed after %.0f seconds' % self.duration
+        return self.finished()
+
+    def cancel(self):
+        if self.status == 'running':
+            self._kill()
+            self._finish()
+        self.status = 'cancelled'
+
+    def _kill(self):
+        _stop(self._process)
+
+
+class Task(Worker):
+    """A function call submitted to a WorkerProcess, with the same interface as Worker. Killing a task
+    because it is cancelled or timed out kills the whole process and the global state it held.
+    """
+    def __init__(self, owner, taskId, func, args, timeout=None, progress=False):
+        self._owner = owner
+        self._command = (taskId, func, args, progress, trace.enabled())
+        self._timeout = timeout
+        self._start = None
+        self.status = 'pending'
+        self.result = None
+        self.progress = None
+        self.duration = 0.0
+
+    def start(self):
+        self._start = time.time()
+        self._owner._send(self._command)
+        self.status = 'running'
+
+    def _receive(self):
+        self._owner._receive()
+
+    def _alive(self):
+        return self._owner.alive()
+
+    def _exitcode(self):
+        return self._owner.exitcode()
+
+    def _finish(self):
+        pass
+
+    def _kill(self):
+        self._owner.kill()
+
+
+class Result(Worker):
+    """A Worker whose result and progress are already known, such as a cached fit, which is done as soon
+    as it is started.
+    """
+    def __init__(self, result, progress=None):
+        self._start = None
+        self.status = 'pending'
+        self.result = result
+        self.progress = progress
+        self.duration = 0.0
+
+    def start(self):
+        self.status = 'done'
+
+
+class Chain(Worker):
+    """Run the first Worker and, once it is done, the Worker that then(result) returns for its result, with
+    the same interface as Worker. then is called by poll, in the process that polls. The status, result and
+    progress are those of last, the worker that runs last, and the duration covers both.
+    """
+    def __init__(self, first, then):
+        self.last = first
+        self._then = then
+        self._start = None
+        self.status = 'pending'
+        self.result = None
+        self.progress = None
+        self.duration = 0.0
+
+    def start(self):
+        self._start = time.time()
+        self.last.start()
+        self.status = 'running'
+
+    def poll(self):
+        if self.status != 'running':
+            return self.finished()
+
+        if self.last.poll() and self.last.status == 'done' and self._then is not None:
+            then, self._then = self._then, None
+            try:
+                self.last = then(self.last.result)
+            except Exception:
+                self.status, self.result = 'error', traceback.format_exc()
+                return True
+            self.last.start()
+            self.last.poll()
+        self.status, self.result, self.progress = self.last.status, self.last.result, self.last.progress
+        self.duration = time.time() - self._start
+        return self.finished()
+
+    def cancel(self):
+        self.last.cancel()
+        self.status = 'cancelled'
+
+
+class WorkerProcess(object):
+    """A persistent isolated process that runs submitted functions one after another, so that global
+    state such as aether's geometry is kept between them. The generation is incremented every time the
+    process is (re)started, which means any state it held was lost.
+    """
+    def __init__(self):
+        self._process = None
+        self._tasks = {}
+        self._nextId = 1
+        self.generation = 0
+
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def exitcode(self):
+        return self._process.exitcode if self._process is not None else None
+
+    def submit(self, func, args, timeout=None, progress=False):
+        """Return a Task that runs func(*args) in this process once it is started."""
+        task = Task(self, self._nextId, func, args, timeout, progress)
+        self._tasks[self._nextId] = task
+        self._nextId += 1
+        return task
+
+    def start(self):
+        """Start the process if it is not running, this happens automatically when a task is started."""
+        if not self.alive():
+            self._commands = _context.Queue()
+            self._messages = _context.Queue()
+            self._process = _context.Process(target=_serve, args=(self._commands, self._messages))
+            self._process.daemon = True
+            self._process.start()
+            self.generation += 1
+
+    def _send(self, command):
+        self.start()
+        self._commands.put(command)
+
+    def _receive(self):
+        if self._process is None:
+            return
+        while not self._messages.empty():
+            try:
+                taskId, kind, value = self._messages.get_nowait()
+            except Exception:
+                break
+            task = self._tasks.get(taskId)
+            if task is not None:
+                task._handle(kind, value)
+                if task.finished():
+                    del self._tasks[taskId]
+
+    def kill(self):
+        if self._process is not None:
+            _stop(self._process)
+        for task in self._tasks.values():
+            if not task.finished():
+                task.status = 'crashed'
+                task.result = 'worker process was killed'
+        self._tasks = {}
+
+    def stop(self):
+        if self.alive():
+            self._commands.put(None)
+            self._process.join()
+
+
+def runPool(workers, processes=None):
+    """Run the workers with at most processes of them at the same time and yield each when it finishes."""
+    processes = processes or multiprocessing.cpu_count()
+    pending = list(workers)
+    running = []
+    while pending or running:
+        while pending and len(running) < processes:
+            worker = pending.pop(0)
+            worker.start()
+            running.append(worker)
+
+        time.sleep(POLL_INTERVAL)
+        for worker in list(running):
+            if worker.poll():
+                running.remove(worker)
+                yield worker
@@ -0,0 +1,26 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# the tests import the src package and the scripts from the root of the repository
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def inputs():
+    """The data cloud, template mesh and map of the example, in the order fitSurface takes them."""
+    return [os.path.join(ROOT, 'example', name) for name in ['surface_LULtrimmed.ipdata', 'LUL_surface.ipnode',
+                                                             'LUL_surface.ipelem', 'LUL_map.ipmap']]
+
+
+@pytest.fixture
+def aether(monkeypatch):
+    """Make aether importable, using the stand-in of the benchmarks that runs the Python engine behind its
+    interface when the Fortran build is not installed.
+    """
+    if importlib.util.find_spec('aether') is None:
+        monkeypatch.syspath_prepend(os.path.join(ROOT, 'benchmarks', 'stub'))
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from src.cache import Cache, FitCache
+
+
+def _filler(size, nested=False):
+    def fill(path):
+        if nested:
+            path = os.path.join(path, 'nested')
+            os.makedirs(path)
+        with open(os.path.join(path, 'data'), 'wb') as f:
+            f.write(b'x' * size)
+    return fill
+
+
+def _age(cache, key, mtime):
+    os.utime(os.path.join(cache._path, key), (mtime, mtime))
+
+
+def test_get_fills_once(tmp_path):
+    cache = Cache(str(tmp_path))
+    calls = []
+
+    def fill(path):
+        calls.append(path)
+        _filler(10)(path)
+
+    path = cache.get('a', fill)
+    assert cache.get('a', fill) == path
+    assert len(calls) == 1
+    assert cache.lookup('b') is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = Cache(str(tmp_path), maxSize=250)
+    for i, key in enumerate(['a', 'b']):
+        cache.store(key, _filler(100))
+        _age(cache, key, 1000 + i)
+
+    # looking an entry up makes it the most recently used one
+    assert cache.lookup('a') is not None
+    cache.store('c', _filler(100))
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') is not None
+    assert cache.lookup('c') is not None
+
+
+def test_evicts_by_size_of_nested_files(tmp_path):
+    cache = Cache(str(tmp_path), maxSize=15000)
+    cache.store('a', _filler(10000, nested=True))
+    _age(cache, 'a', 1000)
+    cache.store('b', _filler(10000, nested=True))
+    assert cache.lookup('a') is None
+    assert cache.lookup('b') is not None
+
+
+def test_keeps_entry_larger_than_cache(tmp_path):
+    cache = Cache(str(tmp_path), maxSize=50)
+    path = cache.store('a', _filler(100))
+    assert os.path.isdir(path)
+
+
+def test_failed_fill_leaves_nothing(tmp_path):
+    cache = Cache(str(tmp_path))
+
+    def fill(path):
+        _filler(10)(path)
+        raise ValueError('fill failed')
+
+    with pytest.raises(ValueError):
+        cache.store('a', fill)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_fit_cache_returns_longest_prefix(tmp_path):
+    inputs = [str(tmp_path / 'input')]
+    with open(inputs[0], 'w') as f:
+        f.write('input')
+    fits = FitCache(Cache(str(tmp_path / 'cache')))
+    assert fits.lookup(inputs, 'python', [1.0, 1.0]) == (None, 0)
+
+    path = fits.store(inputs, 'python', [0.5, 1.0], _filler(10))
+    assert fits.lookup(inputs, 'python', [0.5, 1.0, 1.0]) == (path, 2)
+    assert fits.lookup(inputs, 'python', [1.0, 1.0]) == (None, 0)
+    assert fits.lookup(inputs, 'aether', [0.5, 1.0]) == (None, 0)
@@ -0,0 +1,22 @@
+from src.fitting import fitSurface
+from src.quality import Convergence
+
+
+def test_fit_geometry_measures_iterations(aether, inputs, tmp_path):
+    progress = []
+    output = str(tmp_path / 'fitted')
+    exnode, exelem = fitSurface(*inputs + [[(0.3, 2), (1.0, 2)], output, 'aether'],
+                                progress=lambda *value: progress.append(value))
+    assert [value[:2] for value in progress] == [(i, 4) for i in range(1, 5)]
+    assert progress[-1][2] < progress[0][2]
+    ids, versions, values = progress[-1][3]
+    assert values.shape[2:] == (4, 3)
+    with open(output + '.exnode', 'rb') as f:
+        assert f.read() == exnode
+
+
+def test_fit_geometry_stops_early(aether, inputs):
+    progress = []
+    fitSurface(*inputs + [8, None, 'aether', Convergence(0.0, 1e-9)], progress=lambda *value: progress.append(value))
+    assert progress[-1][:2] == (1, 8)
+    assert progress[-1][5][0] == 'time budget'
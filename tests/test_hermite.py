@@ -0,0 +1,71 @@
+import numpy as np
+
+from src.hermite import HermiteMesh, basis, readExnode
+
+
+def test_read_example(inputs):
+    mesh = HermiteMesh.read(*inputs[1:])
+    assert len(mesh.nodeIds) > 0
+    assert mesh.elementNodes.shape == (len(mesh.elementIds), 4)
+    assert mesh.elementVersions.shape == (len(mesh.elementIds), 4, 3)
+    assert np.all(mesh.elementVersions < mesh.versions()[mesh.elementNodes][:, :, None])
+    assert not np.any(np.isnan(mesh.elementParameters()))
+    # the example has nodes with several versions
+    assert mesh.versions().max() > 1
+
+
+def test_write_read_round_trip(inputs, tmp_path):
+    mesh = HermiteMesh.read(*inputs[1:])
+    names = [str(tmp_path / name) for name in ['mesh.ipnode', 'mesh.ipelem', 'mesh.ipmap']]
+    mesh.write(*names, heading='round trip')
+    copy = HermiteMesh.read(*names)
+
+    np.testing.assert_array_equal(copy.nodeIds, mesh.nodeIds)
+    np.testing.assert_allclose(copy.values, mesh.values, rtol=1e-12)
+    np.testing.assert_array_equal(copy.elementIds, mesh.elementIds)
+    np.testing.assert_array_equal(copy.elementNodes, mesh.elementNodes)
+    np.testing.assert_array_equal(copy.elementVersions, mesh.elementVersions)
+    np.testing.assert_array_equal(copy.fixed, mesh.fixed)
+    np.testing.assert_array_equal(copy.mapped, mesh.mapped)
+    np.testing.assert_allclose(copy.scales, mesh.scales)
+
+
+def test_node_parameters_round_trip(inputs):
+    mesh = HermiteMesh.read(*inputs[1:])
+    ids, versions, values = mesh.nodeParameters()
+    np.testing.assert_array_equal(versions, mesh.versions())
+
+    copy = HermiteMesh.read(*inputs[1:])
+    copy.values[~np.isnan(copy.values)] = 0.0
+    copy.setNodeParameters(ids[::-1], versions[::-1], values[::-1])
+    np.testing.assert_array_equal(copy.values, mesh.values)
+
+
+def test_basis_interpolates_corners():
+    corners = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+    values = basis(corners)
+    # every local node has value 1 at its own corner and 0 at the others
+    np.testing.assert_allclose(values[:, :, 0], np.eye(4), atol=1e-12)
+
+
+def test_read_exnode(inputs, tmp_path):
+    mesh = HermiteMesh.read(*inputs[1:])
+    filename = str(tmp_path / 'mesh.exnode')
+    with open(filename, 'w') as f:
+        f.write(mesh.writeExnode())
+    ids, values = readExnode(filename)
+    np.testing.assert_array_equal(ids, mesh.nodeIds)
+    np.testing.assert_array_equal(values, mesh.values)
+
+
+def test_read_exnode_fields(tmp_path):
+    filename = str(tmp_path / 'points.exnode')
+    with open(filename, 'w') as f:
+        f.write(' Group name: points\n #Fields=2\n 1) coordinates, coordinate, rectangular cartesian, #Components=3\n'
+                '   x.  Value index= 1, #Derivatives= 0\n   y.  Value index= 2, #Derivatives= 0\n'
+                '   z.  Value index= 3, #Derivatives= 0\n 2) lod, field, rectangular cartesian, #Components=1\n'
+                '   1.  Value index= 4, #Derivatives= 0\n Node:     7\n 1.0 2.0\n 3.0 5.0\n Node:     9\n 4.0 5.0 6.0 0.0\n')
+    ids, values = readExnode(filename)
+    np.testing.assert_array_equal(ids, [7, 9])
+    np.testing.assert_array_equal(values[:, 0, :, 0], [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    np.testing.assert_array_equal(values[:, 0, :, 1:], 0.0)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from src.ipdata import exnodePoints, iterIpdata, readIpdata, writeIpdata
+
+
+def _cloud(count=10):
+    ids = np.arange(1, count + 1, dtype=np.int64) * 3
+    coords = np.linspace(-50.0, 250.0, count * 3).reshape(count, 3)
+    return ids, coords
+
+
+def test_write_read_round_trip(tmp_path):
+    ids, coords = _cloud()
+    filename = str(tmp_path / 'cloud.ipdata')
+    writeIpdata(filename, ids, coords, 'test cloud', chunkSize=4)
+    readIds, readCoords = readIpdata(filename, chunkSize=3)
+    assert readIds.dtype == np.int64
+    np.testing.assert_array_equal(readIds, ids)
+    np.testing.assert_allclose(readCoords, coords, rtol=1e-6)
+
+
+def test_read_in_chunks(tmp_path):
+    ids, coords = _cloud(10)
+    filename = str(tmp_path / 'cloud.ipdata')
+    writeIpdata(filename, ids, coords)
+    assert [len(chunkIds) for chunkIds, _ in iterIpdata(filename, 4)] == [4, 4, 2]
+
+
+def test_read_empty(tmp_path):
+    filename = str(tmp_path / 'empty.ipdata')
+    writeIpdata(filename, np.zeros(0, dtype=np.int64), np.zeros((0, 3)))
+    ids, coords = readIpdata(filename)
+    assert ids.shape == (0,)
+    assert coords.shape == (0, 3)
+
+
+def test_read_memory_mapped(tmp_path):
+    ids, coords = _cloud()
+    filename = str(tmp_path / 'cloud.ipdata')
+    mmapFilename = str(tmp_path / 'cloud')
+    writeIpdata(filename, ids, coords)
+    readIpdata(filename, mmapFilename=mmapFilename)
+
+    # the stored arrays are used without parsing the file again
+    writeIpdata(filename, ids[:2], coords[:2])
+    readIds, readCoords = readIpdata(filename, mmapFilename=mmapFilename)
+    assert isinstance(readCoords, np.memmap)
+    np.testing.assert_array_equal(readIds, ids)
+    np.testing.assert_allclose(readCoords, coords, rtol=1e-6)
+
+
+def test_exnode_points():
+    ids, coords = _cloud(3)
+    coords[1, 2] = 1.0 / 3.0
+    lines = exnodePoints(ids, coords, [2, 0, 1]).decode().splitlines()
+    assert lines[1] == ' #Fields=2'
+    assert lines[6] == ' 2) lod, field, rectangular cartesian, #Components=1'
+    nodes = lines[8:]
+    assert [line.split()[-1] for line in nodes[0::2]] == ['3', '6', '9']
+    values = np.array([line.split() for line in nodes[1::2]], dtype=float)
+    # written at full precision
+    np.testing.assert_array_equal(values[:, :3], coords)
+    np.testing.assert_array_equal(values[:, 3], [2, 0, 1])
+
+    lines = exnodePoints(ids, coords).decode().splitlines()
+    assert lines[1] == ' #Fields=1'
+    assert len(lines) == 6 + 2 * len(ids)
+
+
+def test_read_without_weights(tmp_path):
+    filename = str(tmp_path / 'cloud.ipdata')
+    with open(filename, 'w') as f:
+        f.write(' heading\n 1 1.0 2.0 3.0\n 2 4.0 5.0 6.0 1.0 1.0 1.0\n\n 3 7.0 8.0 9.0 1.0\n')
+    ids, coords = readIpdata(filename, chunkSize=2)
+    np.testing.assert_array_equal(ids, [1, 2, 3])
+    np.testing.assert_array_equal(coords, [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0]])
+
+
+@pytest.mark.parametrize('line', [' 4 1.0 2.0\n', ' 4 1.0 x 3.0 1.0 1.0 1.0\n'])
+def test_read_reports_invalid_line(tmp_path, line):
+    filename = str(tmp_path / 'cloud.ipdata')
+    with open(filename, 'w') as f:
+        # a short line followed by a long one must not shift the points
+        f.write(' heading\n 1 1.0 2.0 3.0 1.0 1.0 1.0\n 2 4.0 5.0 6.0 1.0 1.0 1.0\n 3 7.0 8.0 9.0 1.0 1.0 1.0\n')
+        f.write(line)
+        f.write(' 5 1.0 2.0 3.0 1.0 1.0 1.0 1.0\n')
+    with pytest.raises(ValueError, match='cloud.ipdata line 5 '):
+        readIpdata(filename, chunkSize=3)
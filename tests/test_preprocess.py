@@ -0,0 +1,91 @@
+import numpy as np
+
+from src.cache import Cache
+from src.ipdata import readIpdata, writeIpdata
+from src.hermite import HermiteMesh
+from src.preprocess import boxPlanes, cachedCleanIpdata, cleanIpdata, outlierMask, prepareInputs
+
+
+def _grid(size=10):
+    axis = np.arange(size, dtype=float)
+    return np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+def _cloud(tmp_path):
+    # a grid of 1000 points, 5 exact duplicates, one at -0.0 of the origin, 2 outliers and 3 outside the box
+    coords = np.concatenate([_grid(), _grid()[[1, 10, 100, 555, 999]], [[-0.0, 0.0, -0.0]],
+                             [[1000.0, 0.0, 0.0], [0.0, 1000.0, 0.0]],
+                             [[-5.0, 0.0, 0.0], [0.0, -5.0, 0.0], [0.0, 0.0, 3000.0]]])
+    filename = str(tmp_path / 'cloud.ipdata')
+    writeIpdata(filename, np.arange(1, len(coords) + 1), coords)
+    return filename
+
+
+def test_removal_counts(tmp_path):
+    output = str(tmp_path / 'cleaned.ipdata')
+    counts = cleanIpdata(_cloud(tmp_path), output, boxPlanes([-1.0] * 3, [2000.0] * 3), chunkSize=128)
+    assert counts == {'points': 1011, 'cropped': 3, 'duplicates': 6, 'outliers': 2, 'kept': 1000}
+
+    ids, coords = readIpdata(output)
+    assert len(ids) == 1000
+    # the first of every duplicate is kept
+    np.testing.assert_array_equal(ids, np.arange(1, 1001))
+    np.testing.assert_allclose(coords, _grid())
+
+
+def test_voxel_duplicates(tmp_path):
+    output = str(tmp_path / 'cleaned.ipdata')
+    counts = cleanIpdata(_cloud(tmp_path), output, boxPlanes([-1.0] * 3, [9.5] * 3), voxelSize=2.0, neighbours=0,
+                         chunkSize=128)
+    assert counts == {'points': 1011, 'cropped': 5, 'duplicates': 881, 'outliers': 0, 'kept': 125}
+
+
+def test_filters_disabled(tmp_path):
+    output = str(tmp_path / 'cleaned.ipdata')
+    counts = cleanIpdata(_cloud(tmp_path), output, voxelSize=None, neighbours=0)
+    assert counts == {'points': 1011, 'cropped': 0, 'duplicates': 0, 'outliers': 0, 'kept': 1011}
+
+
+def test_outliers_keep_grid():
+    coords = _grid()
+    assert not outlierMask(coords).any()
+    # a denser cluster does not make the sparser rest of the cloud outliers
+    coords = np.concatenate([coords, 0.1 * _grid(5)])
+    assert not outlierMask(coords).any()
+    assert not outlierMask(coords[:5]).any()
+
+
+def test_example_counts(inputs, tmp_path):
+    counts = cleanIpdata(inputs[0], str(tmp_path / 'cleaned.ipdata'))
+    assert counts['points'] == 6201
+    assert counts['points'] == counts['kept'] + sum(counts[name] for name in ['cropped', 'duplicates', 'outliers'])
+    # the default only drops points far from the rest of the cloud
+    assert 0 < counts['outliers'] < 0.01 * counts['points']
+
+
+def test_cached_clean(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    filename = _cloud(tmp_path)
+    output, counts = cachedCleanIpdata(cache, filename)
+    assert cachedCleanIpdata(cache, filename) == (output, counts)
+    assert cachedCleanIpdata(cache, filename, stdRatio=3.0)[0] != output
+    assert len(readIpdata(output)[0]) == counts['kept']
+
+
+def test_prepare_inputs(inputs, tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    ipdata, ipnode, ipelem = inputs[:3]
+    _, coords = readIpdata(ipdata)
+    landmarks = [('apex', coords[coords[:, 2].argmax()].tolist()), ('basal', coords[coords[:, 2].argmin()].tolist()),
+                 ('lateral', coords[coords[:, 0].argmax()].tolist()), ('ventral', coords[coords[:, 1].argmin()].tolist())]
+
+    cleaned, template = prepareInputs(cache, 'LUL', ipdata, ipnode, ipelem, landmarks, clean=True)
+    assert template == ipnode
+    assert 0 < len(readIpdata(cleaned)[0]) < len(coords)
+
+    prepared = prepareInputs(cache, 'LUL', ipdata, ipnode, ipelem, landmarks, transform='similarity', icp=True)
+    assert prepared[0] == ipdata
+    assert prepareInputs(cache, 'LUL', ipdata, ipnode, ipelem, landmarks, transform='similarity', icp=True) == prepared
+    template, aligned = HermiteMesh.read(ipnode, ipelem), HermiteMesh.read(prepared[1], ipelem)
+    assert np.array_equal(aligned.nodeIds, template.nodeIds)
+    assert not np.allclose(aligned.values, template.values)
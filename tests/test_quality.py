@@ -0,0 +1,124 @@
+import numpy as np
+
+from src import quality
+from src.quality import Convergence, convergedIteration, runStages, stoppedEarly
+from src.solver import fitHermite
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _nodes(offset=0.0):
+    # two nodes 100 apart with a second version missing on one of them
+    return np.array([[[0.0, 0.0, 0.0], [np.nan] * 3], [[100.0, 0.0, 0.0], [100.0, 0.0, 0.0]]]) + offset
+
+
+def test_converges_when_error_and_nodes_settle():
+    convergence = Convergence(tolerance=1e-3)
+    convergence.start()
+    assert convergence.update(2.0, _nodes()) is None
+    assert convergence.update(1.5, _nodes(1.0)) is None
+    assert convergence.improvement == 0.25
+    # the error no longer improves, but a node still moved by more than tolerance times the size of the mesh
+    assert convergence.update(1.4999, _nodes(2.0)) is None
+    assert convergence.update(1.4998, _nodes(2.05)) == 'converged'
+    assert np.isclose(convergence.displacement, 0.05 * np.sqrt(3.0))
+
+
+def test_restart_forgets_previous_stage():
+    convergence = Convergence(tolerance=1e-3)
+    convergence.start()
+    convergence.update(1.0, _nodes())
+    convergence.restart()
+    # the first iteration of a stage has nothing to compare with
+    assert convergence.update(1.0, _nodes()) is None
+    assert convergence.update(1.0, _nodes()) == 'converged'
+
+
+def test_time_budget(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(quality.time, 'time', clock)
+    convergence = Convergence(tolerance=0.0, timeBudget=10.0)
+    convergence.start()
+    for rms in [3.0, 2.0, 1.0]:
+        clock.now += 4.0
+        result = convergence.update(rms, _nodes(rms))
+    assert result == 'time budget'
+    assert convergence.secondsPerIteration() == 4.0
+
+
+def test_no_time_budget(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(quality.time, 'time', clock)
+    convergence = Convergence(tolerance=0.0)
+    convergence.start()
+    clock.now += 1e6
+    assert convergence.update(1.0, _nodes()) is None
+    assert convergence.secondsPerIteration() == 1e6
+
+
+def test_converged_iteration():
+    assert convergedIteration([4.0, 2.0, 1.01, 1.005, 1.0]) == 3
+    assert convergedIteration([4.0, 2.0, 1.01, 1.005, 1.0], tolerance=0.001) == 5
+
+
+def test_stopped_early():
+    assert stoppedEarly(None) is None
+    assert stoppedEarly((8, 8, 1.0, None, None, None)) is None
+    assert stoppedEarly((3, 8, 1.0, None, None, ('converged', 2.0))) == ('converged', 3, 8, 10.0)
+
+
+def test_fit_stops_early(inputs):
+    progress = []
+    fitHermite(*inputs + [8], progress=lambda *value: progress.append(value), convergence=Convergence(0.0, 1e-9))
+    assert progress[-1][:2] == (1, 8)
+    reason, seconds = progress[-1][5]
+    assert reason == 'time budget' and seconds > 0.0
+    assert stoppedEarly(progress[-1])[:3] == ('time budget', 1, 8)
+
+
+class _Error(object):
+    # stands in for a FitError whose RMS error stops improving after a few iterations
+    def __init__(self, rms):
+        self.mesh = _Mesh()
+        self._rms = list(rms)
+
+    def update(self):
+        self._rms.pop(0)
+
+    def rms(self):
+        return self._rms[0]
+
+    def elementErrors(self):
+        return None
+
+
+class _Mesh(object):
+    values = _nodes()[:, :, :, None]
+
+    def nodeParameters(self):
+        return None
+
+
+def test_run_stages_stops_converged_stage():
+    stages = [(0.5, 4), (1.0, 2)]
+    errors = {0.5: _Error([4.0, 2.0, 1.0, 1.0, 1.0]), 1.0: _Error([3.0, 2.0, 1.0])}
+    started = []
+    progress = []
+
+    def startStage(fraction):
+        started.append(fraction)
+        return errors[fraction]
+
+    stopped = runStages(stages, startStage, lambda error: None, lambda *value: progress.append(value), Convergence())
+    assert started == [0.5, 1.0]
+    # the first stage converged after its third iteration, the next stage still ran
+    assert [value[:3] for value in progress] == [(1, 6, 2.0), (2, 6, 1.0), (3, 6, 1.0), (4, 6, 2.0), (5, 6, 1.0),
+                                                 (5, 6, 1.0)]
+    assert stopped == 'converged'
+    assert progress[-1][5][0] == 'converged'
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import socket
+import base64
+import threading
+import multiprocessing
+from multiprocessing.connection import Client
+
+import numpy as np
+import pytest
+
+from src import service
+from src.service import FittingService, RemoteFit, _checkJob, _decode, _encode, available, request
+
+unix = pytest.mark.skipif(sys.platform == 'win32', reason='the tests listen on UNIX sockets')
+
+
+def _job(inputs, **fields):
+    job = dict(zip(service.INPUTS, inputs), iterations=[(1.0, 1)], engine='python', convergence=None)
+    job.update(fields)
+    return job
+
+
+class _Peer(object):
+    # a client connection of a user, which records what the service sends it
+    def __init__(self, uid):
+        self.uid = uid
+        self.closed = False
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+class _Task(object):
+    def __init__(self, args):
+        self.args = args
+        self.progress = None
+
+    def start(self):
+        pass
+
+    def poll(self):
+        return False
+
+    def finished(self):
+        return False
+
+    def cancel(self):
+        pass
+
+
+class _Process(object):
+    # records the jobs the service starts instead of running them
+    def __init__(self):
+        self.started = []
+
+    def submit(self, func, args, timeout=None, progress=False):
+        self.started.append(args[0])
+        return _Task(args)
+
+
+@pytest.fixture
+def fittingService(tmp_path):
+    fittingService = FittingService(str(tmp_path / 'service' / 'service.sock'), processes=1)
+    yield fittingService
+    fittingService._listener.close()
+
+
+def test_encode_decode_round_trip():
+    message = ('progress', 3, {
+        'values': np.arange(24, dtype=np.float64).reshape(2, 3, 4),
+        'ids': np.array([5, 7], dtype=np.int32),
+        'mask': np.array([True, False]),
+        'buffers': [b'exnode', b'\x00\xff'],
+        'rms': np.float64(1.5),
+        'stop': None,
+    })
+    decoded = _decode(_encode(message))
+    assert decoded[:2] == ('progress', 3)
+    for name in ['values', 'ids', 'mask']:
+        np.testing.assert_array_equal(decoded[2][name], message[2][name])
+        assert decoded[2][name].dtype == message[2][name].dtype
+    # lists are decoded as tuples
+    assert decoded[2]['buffers'] == (b'exnode', b'\x00\xff')
+    assert decoded[2]['rms'] == 1.5 and type(decoded[2]['rms']) is float
+    assert decoded[2]['stop'] is None
+
+
+@pytest.mark.parametrize('dtype', ['|O', '<U4', '|S4', [['a', '|O']], 'not a type'])
+def test_decode_rejects_other_arrays(dtype):
+    value = {'__array__': base64.b64encode(b'\x00' * 8).decode('ascii'), 'dtype': dtype, 'shape': [1]}
+    with pytest.raises(ValueError):
+        _decode(value)
+
+
+def test_decode_rejects_wrong_shape():
+    value = _encode(np.zeros(4))
+    value['shape'] = [5]
+    with pytest.raises(ValueError):
+        _decode(value)
+
+
+def test_check_job(inputs):
+    _checkJob(_job(inputs), 0)
+    _checkJob(_job(inputs, iterations=[[0.1, 4], [1.0, 2]], convergence=[1e-3, None]), 2)
+
+
+@pytest.mark.parametrize('fields, message', [
+    ({'ipdata': os.path.join('example', 'surface_LULtrimmed.ipdata')}, 'absolute path'),
+    ({'ipmap': os.path.abspath('missing.ipmap')}, 'not a file'),
+    ({'ipnode': 1}, 'absolute path'),
+    ({'iterations': 8}, 'stages'),
+    ({'iterations': []}, 'schedule'),
+    ({'iterations': [(0.0, 2)]}, 'schedule'),
+    ({'iterations': [(1.5, 2)]}, 'schedule'),
+    ({'iterations': [(1.0, 0)]}, 'schedule'),
+    ({'engine': 'fortran'}, 'engine'),
+    ({'convergence': [-1.0, None]}, 'convergence'),
+    ({'output': '/tmp/fitted'}, 'fields'),
+])
+def test_check_job_rejects(inputs, fields, message):
+    with pytest.raises(ValueError, match=message):
+        _checkJob(_job(inputs, **fields), 0)
+
+
+def test_check_job_rejects_priority(inputs):
+    with pytest.raises(ValueError, match='priority'):
+        _checkJob(_job(inputs), '1')
+
+
+def test_check_job_files_sent_as_descriptors(inputs):
+    # a shared service reads the files through the descriptors of the client, it may not see the paths
+    _checkJob(_job(inputs, ipmap=os.path.abspath('missing.ipmap')), 0, False)
+
+
+@unix
+def test_jobs_start_by_priority(fittingService, inputs):
+    process = _Process()
+    fittingService._processes = [process]
+    peer = _Peer(service._uid())
+    for priority in [0, 5, 0, 5, -1]:
+        fittingService._request(peer, ('submit', _job(inputs), priority, False), None)
+    assert [message[:2] for message in peer.messages] == [('submitted', i) for i in range(1, 6)]
+
+    order = []
+    for _ in range(5):
+        fittingService._running = {}
+        fittingService._schedule()
+        order.append(fittingService._running[process].id)
+    assert order == [2, 4, 1, 3, 5]
+
+
+@unix
+def test_other_peers_cannot_watch_or_cancel(fittingService, inputs):
+    owner = _Peer(service._uid() + 1)
+    other = _Peer(service._uid() + 2)
+    fittingService._request(owner, ('submit', _job(inputs), 0, False), None)
+    jobId = owner.messages[-1][1]
+
+    for op in ['watch', 'cancel']:
+        fittingService._request(other, (op, jobId), None)
+        assert other.messages[-1] == ('error', jobId, 'unknown job')
+    assert fittingService._jobs[jobId].watchers == []
+    assert fittingService._jobs[jobId].status == 'queued'
+
+    fittingService._request(other, ('shutdown',), None)
+    assert other.messages[-1][0] == 'error'
+    assert not fittingService._stopped
+
+    # the owner of the job and the owner of the service can
+    fittingService._request(owner, ('watch', jobId), None)
+    assert owner.messages[-1] == ('queued', jobId, None)
+    fittingService._request(_Peer(service._uid()), ('cancel', jobId), None)
+    assert owner.messages[-1] == ('cancelled', jobId, None)
+    assert jobId not in fittingService._jobs
+
+
+@unix
+def test_invalid_requests(fittingService, inputs):
+    peer = _Peer(service._uid())
+    for message in [(), 'jobs', ('restart',), ('cancel',), ('submit', _job(inputs, engine='fortran'), 0, False)]:
+        fittingService._request(peer, message, None)
+        assert peer.messages[-1][0] == 'error'
+    assert fittingService._jobs == {}
+
+
+@unix
+def test_socket_closed_to_other_users(fittingService, tmp_path):
+    directory = str(tmp_path / 'service')
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    assert os.stat(os.path.join(directory, 'authkey')).st_mode & 0o777 == 0o600
+
+    # a service does not use a directory that other users can enter
+    os.chmod(directory, 0o755)
+    with pytest.raises(PermissionError):
+        FittingService(str(tmp_path / 'service' / 'other.sock'), processes=1)
+
+
+@unix
+@pytest.mark.parametrize('shared', [False, True])
+def test_fit(tmp_path, inputs, shared):
+    if shared and not hasattr(socket, 'SO_PEERCRED'):
+        pytest.skip('a shared service needs Linux')
+    address = str(tmp_path / 'service' / 'service.sock')
+    fittingService = FittingService(address, processes=1, shared=shared)
+    thread = threading.Thread(target=fittingService.serve)
+    thread.daemon = True
+    thread.start()
+    try:
+        assert available(address)
+        if not shared:
+            # clients without the secret are turned away
+            with pytest.raises(multiprocessing.AuthenticationError):
+                Client(address, authkey=b'not the secret')
+        output = str(tmp_path / 'fitted')
+        worker = RemoteFit(inputs + [1, output, 'python', None], address=address)
+        worker.start()
+        start = time.time()
+        while not worker.poll() and time.time() - start < 120.0:
+            time.sleep(0.1)
+        assert worker.status == 'done', worker.result
+        assert worker.progress[:2] == (1, 1)
+        assert os.path.isfile(output + '.exnode') and os.path.isfile(output + '.exelem')
+        assert request(('jobs',), address) == ('jobs', None, ())
+    finally:
+        assert request(('shutdown',), address)[0] == 'stopping'
+        thread.join(30.0)
+    assert not os.path.exists(os.path.join(str(tmp_path / 'service'), 'authkey'))
@@ -0,0 +1,44 @@
+import numpy as np
+
+from src.hermite import HermiteMesh
+from src.solver import fitHermite
+
+
+def _fit(inputs, iterations, **kwargs):
+    progress = []
+    buffers = fitHermite(*inputs + [iterations], progress=lambda *value: progress.append(value), **kwargs)
+    return buffers, progress
+
+
+def test_fit_converges_on_example(inputs):
+    buffers, progress = _fit(inputs, 4)
+    assert [value[:2] for value in progress] == [(i, 4) for i in range(1, 5)]
+    rms = [value[2] for value in progress]
+    assert all(later < earlier for earlier, later in zip(rms, rms[1:]))
+    assert rms[-1] < 0.75 * rms[0]
+    assert progress[-1][5] is None
+
+    exnode, exelem = buffers
+    assert exnode.startswith(b' Group name: fitted')
+    assert exelem.startswith(b' Group name: fitted')
+
+
+def test_fit_keeps_fixed_parameters(inputs):
+    template = HermiteMesh.read(*inputs[1:])
+    _, progress = _fit(inputs, 2)
+    ids, versions, values = progress[-1][3]
+    np.testing.assert_array_equal(ids, template.nodeIds)
+    np.testing.assert_array_equal(versions, template.versions())
+    fitted = HermiteMesh.read(*inputs[1:])
+    fitted.setNodeParameters(ids, versions, values)
+    assert not np.any(np.isnan(fitted.elementParameters()))
+    assert not np.allclose(fitted.values[:, :, :, 0], template.values[:, :, :, 0], equal_nan=True)
+    nodes, versions, derivatives = template.fixed.T
+    np.testing.assert_allclose(fitted.values[nodes, versions, :, derivatives],
+                               template.values[nodes, versions, :, derivatives])
+
+
+def test_coarse_to_fine_schedule(inputs):
+    _, progress = _fit(inputs, [(0.3, 2), (1.0, 1)])
+    assert [value[:2] for value in progress] == [(1, 3), (2, 3), (3, 3)]
+    assert progress[-1][2] < progress[0][2]
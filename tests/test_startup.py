@@ -0,0 +1,93 @@
+import os
+import sys
+import ast
+import builtins
+import importlib.util
+
+import pytest
+
+from src import startup
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def _available(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        return False
+
+
+# modules the callbacks import when they need them, or warmUp in run.py once the window is shown
+LAZY_MODULES = ['numpy', 'src.cache', 'src.fitting', 'src.quality', 'src.tessellation', 'src.model', 'src.lobe',
+                'src.session', 'src.preprocess', 'src.solver', 'src.service']
+
+
+def _moduleImports(filename, package):
+    # the modules imported when the file runs, leaving out the imports in functions and classes
+    imports = set()
+    body = list(ast.parse(open(filename).read()).body)
+    while body:
+        node = body.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = importlib.util.resolve_name('.' * node.level + (node.module or ''), package) if node.level else node.module
+            imports.add(module)
+            # from package import module
+            imports.update('%s.%s' % (module, alias.name) for alias in node.names)
+        else:
+            body.extend(ast.iter_child_nodes(node))
+    return imports
+
+
+def _startupImports():
+    # the imports of run.py and, in turn, of the modules of this repository it imports, up to the window
+    imports = set()
+    pending = [(os.path.join(ROOT, 'run.py'), None)]
+    while pending:
+        filename, package = pending.pop()
+        for module in _moduleImports(filename, package) - imports:
+            imports.add(module)
+            path = os.path.join(ROOT, *module.split('.')) + '.py'
+            if module.startswith('src.') and os.path.isfile(path):
+                pending.append((path, 'src'))
+    return imports
+
+
+def _benchmark():
+    # benchmarks/startup.py launches run.py and reads its startup report
+    spec = importlib.util.spec_from_file_location('startup_benchmark', os.path.join(ROOT, 'benchmarks', 'startup.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_stop_imports_restores_import():
+    original = builtins.__import__
+    startup.recordImports()
+    try:
+        assert builtins.__import__ is not original
+        import colorsys
+    finally:
+        startup.stopImports()
+    assert builtins.__import__ is original
+    startup.stopImports()
+    assert builtins.__import__ is original
+
+
+def test_startup_imports_lazily():
+    imports = _startupImports()
+    assert 'src.view' in imports and 'src.scene' in imports
+    assert sorted(imports.intersection(LAZY_MODULES)) == []
+
+
+@pytest.mark.skipif(not _available('PySide2') or not _available('opencmiss.zinc'),
+                    reason='the GUI needs PySide2 and Zinc')
+def test_time_to_window_within_budget(tmp_path):
+    benchmark = _benchmark()
+    offscreen = sys.platform.startswith('linux') and not os.environ.get('DISPLAY')
+    runs = sorted(benchmark.launch(str(tmp_path / ('startup%d.json' % run)), offscreen)[0] for run in range(3))
+    assert runs[1] <= benchmark.BUDGET, 'median time to the window %.3fs is over the budget of %.3fs' % (runs[1], benchmark.BUDGET)
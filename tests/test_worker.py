@@ -0,0 +1,33 @@
+from src.worker import Chain, Result
+
+
+class _Failing(Result):
+    def start(self):
+        self.status, self.result = 'error', 'failed'
+
+
+def test_chain():
+    chain = Chain(Result(('data', 'node')), lambda prepared: Result(prepared[::-1], progress=(1, 1, 0.5)))
+    assert chain.status == 'pending'
+    chain.start()
+    assert chain.poll()
+    assert (chain.status, chain.result, chain.progress) == ('done', ('node', 'data'), (1, 1, 0.5))
+    assert chain.last.result == ('node', 'data')
+
+
+def test_chain_stops():
+    called = []
+    chain = Chain(_Failing(None), called.append)
+    chain.start()
+    assert chain.poll()
+    assert (chain.status, chain.result, called) == ('error', 'failed', [])
+
+    chain = Chain(Result(None), lambda prepared: 1 / 0)
+    chain.start()
+    assert chain.poll()
+    assert chain.status == 'error' and 'ZeroDivisionError' in chain.result
+
+    chain = Chain(Result(None), called.append)
+    chain.cancel()
+    assert chain.poll() and chain.status == 'cancelled'
+    assert called == []